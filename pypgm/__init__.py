@@ -42,6 +42,24 @@ Syntax:
 from .variable import Variable, BinaryVariable
 from .factor import Factor
 from .bayesian import Bayesian
+from .elimination import VariableElimination
+from .junction import JunctionTree
+from .logfactor import LogFactor
+from .sparsefactor import SparseFactor
+from .loopy import LoopyBeliefPropagation
+
+try:
+    from .arrayfactor import ArrayFactor
+    from .batch import BatchElimination
+    from .sampling import ForwardSampler, LikelihoodWeighting, GibbsSampler
+    from .parallel import ParallelQuery
+    from .learning import MaximumLikelihood, OnlineDirichlet, \
+        ExpectationMaximization
+    from .counts import CountIndex
+    from .structure import HillClimbing
+    from .storage import save, load
+except ImportError:             # numpy is not available
+    pass
 
 # TODO: test on larger nets with operands of marginal, reduce,
 # __mul__, __div__ including more than one cons var
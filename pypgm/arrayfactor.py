@@ -0,0 +1,610 @@
+'''
+    Factor backed by a numpy ndarray. The table has one axis per variable in
+    Factor.var, so factor product is an axis-aligned broadcast, marginalization
+    is a sum over one axis and conditioning is a broadcast divide. Everything
+    else (queries, joint, uncond, string representation) is inherited from
+    Factor and works on top of these operations.
+'''
+
+import unittest
+import numpy as np
+from pypgm.variable import Variable
+from pypgm.factor import Factor
+
+class ArrayFactor(Factor):
+    '''
+    Syntax:
+
+            >>> C = ArrayFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.99, 0.01])
+            >>> T = ArrayFactor(name='Test', values=["pos", "neg"],
+            ...                 cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> T.table
+            array([[0.2, 0.8],
+                   [0.9, 0.1]])
+            >>> T.cpd
+            array([0.2, 0.8, 0.9, 0.1])
+
+    Fields:
+        table
+            ndarray of factor's values. Its shape is equal to Factor.card,
+            i. e. axis i corresponds to variable Factor.var[i].
+        cpd
+            flat (one-dimensional) view of the table in the same order as
+            Factor.cpd. Writing to its elements writes to the table; if the
+            table is shared or read-only, the view is read-only too and the
+            factor is changed by assigning cpd.
+
+        All other fields are the same as in Factor.
+
+    Reductions on fixed values and permutations of the scope return view
+    factors: their tables share the parent's buffer (numpy keeps offset and
+    strides for them) and nothing is copied. Shared tables are read-only;
+    the first write to either side through _norm() or _writable() makes
+    a private copy (copy-on-write). Reading never copies a contiguous table,
+    so tables mapped from files (see pypgm.storage) stay mapped.
+    '''
+
+    def __init__(self, name='',
+                        values=None,
+                        cond=None,
+                        cpd=None,
+                        var=None,
+                        table=None):
+        '''
+        Syntax:
+            Arguments are the same as for Factor, both explicit and implicit
+            ways of defining variables are supported:
+                >>> C = Variable('Cancer', ['yes', 'no'])
+                >>> T = Variable('Test', ['pos', 'neg'])
+                >>> F = ArrayFactor(name='T', var=[C,T], cpd=[0.9, 0.1, 0.2, 0.8])
+                >>> F.var
+                [Cancer, Test]
+                >>> F.table.shape
+                (2, 2)
+                >>> F = ArrayFactor(name='T', var=[C,T])
+                >>> F.cpd
+                array([0., 0., 0., 0.])
+
+        Arguments:
+            table
+                ndarray of shape Factor.card. If given, it is used as is,
+                without copying; tables of other than floating types are
+                converted to float.
+
+            Other arguments are the same as for Factor.__init__().
+        '''
+        self.table = None
+        self._shared = False
+        Factor.__init__(self, name=name, values=values, cond=cond, var=var)
+
+        if table is not None:
+            if table.dtype.kind != 'f':         # _norm() divides in place
+                table = table.astype(float)
+            self.table = table
+        elif cpd is not None and len(cpd) > 0:
+            if len(cpd) != self.pcard[0]:
+                string = "Cannot build conditioned factor: " + \
+                        "cpd cardinality doesn't match"
+                raise AttributeError(string)
+            self.table = np.array(cpd, dtype=float).reshape(self.card)
+        else:
+            self.table = np.zeros(self.card)
+
+    def _get_cpd(self):
+        table = self.table
+        if not table.flags.c_contiguous:        # permuted view
+            self.table = table = np.ascontiguousarray(table)
+            self._shared = False
+        flat = table.reshape(-1)
+        if self._shared:
+            flat.flags.writeable = False
+        return flat
+
+    def _set_cpd(self, cpd):
+        if self.table is None:      # called from Factor.__init__()
+            return
+        self.table = np.array(cpd, dtype=float).reshape(self.card)
+        self.changed()
+
+    cpd = property(_get_cpd, _set_cpd)
+
+    def _share(self, table):
+        '''
+        marks this factor's buffer as shared with given view of it and
+        returns the view, made read-only.
+
+        Syntax:
+            >>> T = ArrayFactor(name='Test', values=["pos", "neg"],
+            ...                 cpd=[0.2, 0.8])
+            >>> V = T._share(T.table[::-1])
+            >>> V.flags.writeable, T._shared
+            (False, True)
+        '''
+        self._shared = True
+        table.flags.writeable = False
+        return table
+
+    def _writable(self):
+        '''
+        returns the table, ready to be written to. If the buffer is shared
+        with a view (or is a view itself), it is copied first.
+
+        Syntax:
+            >>> T = ArrayFactor(name='Test', values=["pos", "neg"],
+            ...                 cpd=[0.2, 0.8])
+            >>> V = T.permute(T.var)
+            >>> V._writable() is V.table, V.table.flags.writeable
+            (True, True)
+            >>> T._shared
+            True
+            >>> T._writable() is T.table, T._shared
+            (True, False)
+        '''
+        if self._shared or not self.table.flags.writeable:
+            self.table = self.table.copy()
+            self._shared = False
+        return self.table
+
+    @classmethod
+    def from_factor(cls, factor):
+        '''
+        Builds an ndarray-backed copy of any factor. The copy shares
+        variables, conditions and parents with the original.
+
+        Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> A = ArrayFactor.from_factor(C)
+            >>> A.var == C.var, A.cons is C.cons
+            (True, True)
+            >>> A.table
+            array([0.99, 0.01])
+
+        Arguments:
+            factor
+                instance of Factor or ArrayFactor
+        '''
+        if isinstance(factor, cls):
+            return factor
+        res = cls(name=factor.name, var=factor.var,
+                    table=np.array(factor.cpd, dtype=float).reshape(factor.card))
+        res.cons = factor.cons
+        res.cond = list(factor.cond)
+        res.parents = list(factor.parents)
+        return res
+
+    def _aligned(self, var, table=None):
+        '''
+        returns the table with axes rearranged according to given var list,
+        with length-1 axes inserted for variables missing in this factor,
+        so that the result is ready for broadcasting. No data is copied.
+
+        Syntax:
+            >>> C = ArrayFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.99, 0.01])
+            >>> T = ArrayFactor(name='Test', values=["pos", "neg"],
+            ...                 cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> T._aligned([T.cons, C.cons])
+            array([[0.2, 0.9],
+                   [0.8, 0.1]])
+            >>> C._aligned([C.cons, T.cons]).shape
+            (2, 1)
+
+        Arguments:
+            var
+                list of variables, which should include all of this factor's
+                variables
+            table
+                array of the same shape as this factor's table to rearrange
+                instead of the table itself
+        '''
+        if table is None:
+            table = self.table
+        axes = [self.var.index(v) for v in var if v in self.var]
+        shape = [v.card if v in self.var else 1 for v in var]
+        return table.transpose(axes).reshape(shape)
+
+    def __mul__(self, other):
+        '''
+        computes product of factors
+        F(A,C)*F(C,B) = F(A,B,C)
+
+        Syntax:
+            >>> C = ArrayFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.99, 0.01])
+            >>> T = ArrayFactor(name='Test', values=["pos", "neg"],
+            ...                 cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> P = T*C
+            >>> P.var
+            [Cancer, Test]
+            >>> P.cpd
+            array([0.198, 0.792, 0.009, 0.001])
+            >>> P.name
+            'Product'
+        '''
+        if other is None:           # for compatibility
+            return self
+        other = ArrayFactor.from_factor(other)
+        res = ArrayFactor(name='Product',
+                    var=Factor._canonical(set(self.var) | set(other.var)),
+                    table=np.zeros(()))
+        res.cond = list(other.cond)
+        res.parents = list(other.parents)
+        res.table = self._aligned(res.var) * other._aligned(res.var)
+        return res
+
+    def __rmul__(self, other):
+        '''
+        product of a list-based factor and an ndarray-backed one. Result is
+        always ndarray-backed.
+
+        Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> T = ArrayFactor(name='Test', values=["pos", "neg"],
+            ...                 cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> (C*T).cpd
+            array([0.198, 0.792, 0.009, 0.001])
+        '''
+        return ArrayFactor.from_factor(other) * self
+
+    def marginal(self, var=None):
+        '''
+        perfoms a factor marginalization
+        F(A,B,C)-B = F(A,C)
+
+        Syntax:
+            >>> C = ArrayFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.99, 0.01])
+            >>> T = ArrayFactor(name='Test', values=["pos", "neg"],
+            ...                 cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> M = T.marginal(C.var[-1])
+            >>> M.name, M.var
+            ('Marginal factor', [Test])
+            >>> M.cpd
+            array([1.1, 0.9])
+        '''
+        if not var in self.var:
+            raise AttributeError("Unable to marginalize: variable is missing")
+
+        res = ArrayFactor('Marginal factor',
+                        var=Factor._canonical(set(self.var) - set([var])),
+                        table=np.zeros(()))
+        rest = [v for v in self.var if v != var]
+        table = self.table.sum(axis=self.var.index(var))
+        res.table = table.transpose([rest.index(v) for v in res.var])
+        return res
+
+    def _reduce1(self, var=None, value=''):
+        '''
+        returns a slice of the factor where var is equal to value.
+        Result is not normalized.
+
+        Syntax:
+            >>> C = ArrayFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.99, 0.01])
+            >>> T = ArrayFactor(name='Test', values=["pos", "neg"],
+            ...                 cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> T._reduce1(var=T.cons, value='neg').cpd
+            array([0.8, 0.1])
+        '''
+        if not var in self.var:
+            raise AttributeError()
+
+        res = ArrayFactor(name='Reduced',
+                        var=Factor._canonical(set(self.var) - set([var])),
+                        table=np.zeros(()))
+        rest = [v for v in self.var if v != var]
+        index = var.find_value(value)
+        if index is None:
+            table = np.zeros([v.card for v in rest])
+        else:
+            axis = self.var.index(var)
+            table = self._share(
+                    self.table[(slice(None),) * axis + (index, Ellipsis)])
+        res.table = table.transpose([rest.index(v) for v in res.var])
+        return res
+
+    def _reduce3(self, evidence):
+        '''
+        reduces the factor on all variables of given assignment at once by
+        indexing the table. Result is not normalized.
+
+        Syntax:
+            >>> A = ArrayFactor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = ArrayFactor(name='B', values=[0, 1], cpd=[0.7, 0.3])
+            >>> C = ArrayFactor(name='C', values=[0, 1], cond=[A, B],
+            ...             cpd=[0.7, 0.3, 0.9, 0.1, 0.8, 0.2, 0.6, 0.4])
+            >>> R = C._reduce3({A.cons: 1, C.cons: 0})
+            >>> R.var, R.cpd
+            ([B], array([0.8, 0.6]))
+        '''
+        index = [slice(None)] * len(self.var)
+        for (var, value) in evidence.iteritems():
+            if not var in self.var:
+                raise AttributeError()
+            index[self.var.index(var)] = var.find_value(value)
+
+        res = ArrayFactor(name='Marginal factor',
+                        var=Factor._canonical(set(self.var) - set(evidence)),
+                        table=np.zeros(()))
+        rest = [v for v in self.var if not v in evidence]
+        if None in index:               # value is not among var's values
+            table = np.zeros([v.card for v in rest])
+        else:
+            table = self._share(self.table[tuple(index) + (Ellipsis,)])
+        res.table = table.transpose([rest.index(v) for v in res.var])
+        return res
+
+    def _reduce2(self, var=None, value=''):
+        '''
+        Same as _reduce1(), kept for compatibility with Factor.
+
+        Syntax:
+            >>> C = ArrayFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.99, 0.01])
+            >>> T = ArrayFactor(name='Test', values=["pos", "neg"],
+            ...                 cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> R = T._reduce2(var=C.cons, value='yes')
+            >>> R.name, R.cpd
+            ('Marginal factor', array([0.9, 0.1]))
+        '''
+        res = self._reduce1(var=var, value=value)
+        res.name = 'Marginal factor'
+        return res
+
+    def permute(self, var):
+        '''
+        returns the same factor with variables reordered according to given
+        list. The result is a view: no data is copied.
+
+        Syntax:
+            >>> C = ArrayFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.99, 0.01])
+            >>> T = ArrayFactor(name='Test', values=["pos", "neg"],
+            ...                 cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> R = T.permute([T.cons, C.cons])
+            >>> R.var, R.cond, R.cons
+            ([Test, Cancer], [Cancer], Test)
+            >>> R.table
+            array([[0.2, 0.9],
+                   [0.8, 0.1]])
+            >>> np.may_share_memory(R.table, T.table)
+            True
+
+        Arguments:
+            var
+                list of the same variables as in this factor's var list,
+                in new order
+        '''
+        if sorted(var) != sorted(self.var):
+            raise AttributeError("Unable to permute: scope doesn't match")
+
+        res = ArrayFactor(name=self.name, var=list(var), table=np.zeros(()))
+        res.cons = self.cons
+        res.cond = list(self.cond)
+        res.parents = list(self.parents)
+        res.table = self._share(self.table.transpose(
+                                    [self.var.index(v) for v in res.var]))
+        return res
+
+    def _copy(self):
+        '''
+        returns a copy of the factor with its own writable table
+
+        Syntax:
+            >>> C = ArrayFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.99, 0.01])
+            >>> R = C._copy()
+            >>> R.cpd[0] = 0.5
+            >>> C.cpd, C._shared
+            (array([0.99, 0.01]), False)
+        '''
+        res = ArrayFactor(name=self.name, var=list(self.var),
+                            table=self.table.copy())
+        res.cons = self.cons
+        res.cond = list(self.cond)
+        res.parents = list(self.parents)
+        return res
+
+    def __div__(self, other=None):
+        '''
+        Syntax:
+            >>> C = ArrayFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.99, 0.01])
+            >>> T = ArrayFactor(name='Test', values=["pos", "neg"],
+            ...                 cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> D = (T*C)/C
+            >>> D.name
+            'Conditional'
+            >>> D.var, D.cond
+            ([Cancer, Test], [Cancer])
+            >>> D.cpd
+            array([0.2, 0.8, 0.9, 0.1])
+        '''
+        t = Factor._canonical(set(other.var) - set(other.cond))
+        var = t[-1]
+        if not var in self.var:
+            raise AttributeError()
+
+        parents = sorted(set([other]) | set(self.parents),
+                            key=lambda f: f.var[-1].ordinal)
+        cond = [fact.var[-1] for fact in parents]
+        res = ArrayFactor(name='Conditional',
+                        var=Factor._canonical(set(self.var) | set(cond)),
+                        table=np.zeros(()))
+        res.cond = cond
+        res.parents = parents
+
+        hidden = tuple(i for i in range(len(self.var)) if self.var[i] not in t)
+        temp = self.table.sum(axis=hidden, keepdims=True)
+        table = self._aligned(res.var, self.table / temp)
+        if list(table.shape) != res.card:   # parents outside of the scope
+            table = np.broadcast_to(table, res.card).copy()
+        res.table = table
+        return res
+
+    def __rdiv__(self, other):
+        '''
+        conditioning of a list-based factor on an ndarray-backed one.
+
+        Syntax:
+            >>> C = ArrayFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.99, 0.01])
+            >>> T = Factor(name='Test', values=["pos", "neg"],
+            ...             cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> (T*C/C).cpd
+            array([0.2, 0.8, 0.9, 0.1])
+        '''
+        return ArrayFactor.from_factor(other) / self
+
+    def sum(self):
+        '''
+        returns sum of all factor's values
+
+        Syntax:
+            >>> C = ArrayFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.99, 0.01])
+            >>> C.sum()
+            1.0
+        '''
+        return float(self.table.sum())
+
+    def _norm(self):
+        '''
+        normalizes values of the factor to make all valies sum to 1.0
+        Warning: mutates the factor!
+        If factor sums to 0, does nothing
+
+        Syntax:
+            >>> T = ArrayFactor(name='Test', values=["pos", "neg"],
+            ...                 cpd=[3.0, 1.0])
+            >>> T._norm().cpd
+            array([0.75, 0.25])
+        '''
+        sum_ = self.sum()
+        if sum_ != 0:
+            if self._shared or not self.table.flags.writeable:
+                self.table = self.table / sum_
+                self._shared = False
+            else:
+                self.table /= sum_
+            self.changed()
+        return self
+
+
+class TestArrayFactor(unittest.TestCase):
+
+    def setUp(self):
+        self.C = ArrayFactor(name='Cancer',
+                        values=["no", "yes"],
+                        cpd=[0.99, 0.01])
+        self.T = ArrayFactor(name='Test',
+                        values=["pos", "neg"], cond=[self.C],
+                        cpd=[0.2, 0.8, 0.9, 0.1])
+
+    def tearDown(self):
+        pass
+
+    def test_table(self):
+        self.assertEqual((2,), self.C.table.shape)
+        self.assertEqual((2, 2), self.T.table.shape)
+        self.assertAlmostEqual(0.9, self.T.table[1, 0])
+        self.assertEqual(4, len(self.T.cpd))
+
+    def test_table_dtype(self):
+        A = ArrayFactor(var=self.C.var, table=np.array([1, 3]))
+        self.assertEqual([0.25, 0.75], A._norm().cpd.tolist())
+        table = np.array([0.5, 0.5])
+        self.assertTrue(ArrayFactor(var=self.C.var, table=table).table
+                        is table)
+
+    def test__mul__(self):
+        P = self.C * self.T
+        self.assertEqual(4, len(P.cpd))
+        self.assertAlmostEqual(0.198, P.cpd[0])
+        self.assertAlmostEqual(0.001, P.cpd[3])
+        self.assertEqual('Cancer', P.var[0].name)
+        self.assertEqual('Test', P.var[1].name)
+
+    def testmarginal(self):
+        M = self.T.marginal(self.T.var[-1])
+        self.assertEqual(2, len(M.cpd))
+        self.assertAlmostEqual(1.0, M.cpd[0])
+        self.assertAlmostEqual(1.0, M.cpd[1])
+        self.assertEqual('Cancer', M.var[0].name)
+
+    def testreduce(self):
+        M = self.T.reduce(var=self.T.var[-1], value='pos')
+        self.assertAlmostEqual(0.18181818181818182, M.cpd[0])
+        self.assertAlmostEqual(0.8181818181818181, M.cpd[1])
+        self.assertEqual('Cancer', M.var[0].name)
+
+    def testreduce_evidence(self):
+        M = (self.T*self.C).reduce(evidence={self.C.cons: 'yes',
+                                             self.T.cons: 'neg'})
+        self.assertEqual(0, len(M.var))
+        self.assertAlmostEqual(1.0, M.cpd[0])
+
+    def test_views(self):
+        P = self.T*self.C
+        before = P.table.copy()
+        R = P._reduce1(var=self.C.cons, value='yes')
+        V = P.permute([self.T.cons, self.C.cons])
+        self.assertTrue(np.may_share_memory(R.table, P.table))
+        self.assertTrue(np.may_share_memory(V.table, P.table))
+
+        R._norm()                       # write to the view
+        V.cpd[0] = 5.0
+        self.assertTrue((P.table == before).all())
+        self.assertAlmostEqual(0.9, R.cpd[0])
+        self.assertAlmostEqual(5.0, V.table[0, 0])
+
+        R = P._reduce1(var=self.C.cons, value='no')
+        self.assertRaises(ValueError, P.cpd.__setitem__, 0, 7.0)
+        P._writable()[0, 0] = 7.0       # write to the parent
+        self.assertAlmostEqual(0.198, R.cpd[0])
+        self.assertAlmostEqual(7.0, P.table[0, 0])
+
+    def test__div__(self):
+        M = (self.T*self.C)/self.C
+        self.assertAlmostEqual(0.2, M.cpd[0])
+        self.assertAlmostEqual(0.8, M.cpd[1])
+        self.assertAlmostEqual(0.9, M.cpd[2])
+        self.assertAlmostEqual(0.1, M.cpd[3])
+
+    def testquery(self):
+        M = self.T.query(query=[self.C], evidence={self.T: 'neg'})
+        self.assertAlmostEqual(0.9987389659520807, M.cpd[0])
+        self.assertAlmostEqual(0.0012610340479192938, M.cpd[1])
+
+        M = self.T.query(query=[self.C], evidence=[self.T])
+        self.assertAlmostEqual(0.9565217391304348, M.cpd[0])
+        self.assertAlmostEqual(0.9987389659520807, M.cpd[1])
+
+    def test_matches_factor(self):
+        plain = []
+        array = []
+        for cls, res in ((Factor, plain), (ArrayFactor, array)):
+            D = cls(name='D', values=[0, 1], cpd=[0.6, 0.4])
+            I = cls(name='I', values=[0, 1], cpd=[0.7, 0.3])
+            G = cls(name='G', values=[1, 2, 3], cond=[D, I],
+                    cpd=[0.3, 0.4, 0.3, 0.05, 0.25, 0.7,
+                         0.9, 0.08, 0.02, 0.5, 0.3, 0.2])
+            L = cls(name='L', values=[0, 1], cond=[G],
+                    cpd=[0.1, 0.9, 0.4, 0.6, 0.99, 0.01])
+            res.append(L.query(query=[G], evidence={L: 0}))
+            res.append(G.query(query=[D], evidence=[G]))
+            res.append(L.uncond())
+            res.append((G*D*I).marginal(G.cons))
+        for p, a in zip(plain, array):
+            self.assertEqual([v.name for v in p.var], [v.name for v in a.var])
+            for x, y in zip(p.cpd, a.cpd):
+                self.assertAlmostEqual(x, y)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=False)
+##    doctest.testmod(verbose=True)
@@ -0,0 +1,334 @@
+'''
+    Batched exact inference. Many evidence assignments for the same query
+    and evidence variables are answered at once: every factor's table gets a
+    leading batch axis, so variable elimination runs as a few vectorized
+    numpy passes instead of one Python call per assignment.
+'''
+
+import unittest
+import numpy as np
+from pypgm.factor import Factor
+from pypgm.elimination import VariableElimination
+
+
+def encode(var, column):
+    '''
+    maps a column of raw values of the variable to their numbers among
+    Variable.value. Values read as text (for ex. from CSV) match the
+    string form of Variable.value too. Raises AttributeError on unknown
+    values.
+
+    Syntax:
+        >>> from pypgm.variable import Variable
+        >>> T = Variable('Test', ['pos', 'neg'])
+        >>> encode(T, ['neg', 'pos', 'neg'])
+        array([1, 0, 1])
+        >>> encode(Variable('Grade', [1, 2, 3]), [3, 1])
+        array([2, 0])
+        >>> encode(Variable('Grade', [1, 2, 3]), ['3', '1'])
+        array([2, 0])
+
+    Arguments:
+        var
+            variable
+        column
+            sequence of values of the variable
+    '''
+    column = np.asarray(column)
+    if column.ndim == 0:
+        column = column.reshape(1)
+    if var.value == range(var.card) and column.dtype.kind in 'iu':
+        codes = column.astype(np.intp)
+        if len(codes) and (codes.min() < 0 or codes.max() >= var.card):
+            raise AttributeError("Unknown value of variable " + var.name)
+        return codes
+    (unique, inverse) = np.unique(column, return_inverse=True)
+    lookup = []
+    text = None
+    for val in unique.tolist():
+        index = var.find_value(val)
+        if index is None and isinstance(val, basestring):
+            if text is None:
+                text = dict((str(v), i) for (i, v) in enumerate(var.value))
+            index = text.get(val)
+        if index is None:
+            raise AttributeError("Unknown value of variable " + var.name +
+                                    ": " + str(val))
+        lookup.append(index)
+    return np.array(lookup, dtype=np.intp)[inverse]
+
+
+class _Batched(object):
+    '''
+    table of a factor with leading batch axis: shape is (N,) + card, or
+    (1,) + card for factors, which don't depend on the evidence
+    '''
+
+    def __init__(self, var, table):
+        self.var = var
+        self.table = table
+
+    def _aligned(self, var):
+        axes = [0] + [self.var.index(v) + 1 for v in var if v in self.var]
+        shape = [self.table.shape[0]] + \
+                [v.card if v in self.var else 1 for v in var]
+        return self.table.transpose(axes).reshape(shape)
+
+    def __mul__(self, other):
+        if other is None:
+            return self
+        var = Factor._canonical(set(self.var) | set(other.var))
+        return _Batched(var, self._aligned(var) * other._aligned(var))
+
+    def marginal(self, var):
+        rest = [v for v in self.var if v != var]
+        return _Batched(rest, self.table.sum(axis=self.var.index(var) + 1))
+
+
+class BatchElimination(object):
+    '''
+    Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> T = Factor(name='Test', values=["pos", "neg"],
+            ...             cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> BE = BatchElimination([C, T])
+            >>> BE.query([C], [T], [['pos'], ['neg'], ['pos']])
+            array([[0.95652174, 0.04347826],
+                   [0.99873897, 0.00126103],
+                   [0.95652174, 0.04347826]])
+
+    Fields:
+        factors
+            list of factors, for ex. Bayesian.factors
+    '''
+
+    def __init__(self, factors=None):
+        '''
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> BatchElimination([A]).factors
+            [A]
+
+        Arguments:
+            factors
+                list of factors
+        '''
+        if not factors:
+            factors = []
+
+        self.factors = factors
+
+    def _table(self, fact):
+        '''
+        returns factor's values as ndarray of shape Factor.card
+        '''
+        table = getattr(fact, 'table', None)
+        if table is None:
+            table = np.array(fact.cpd, dtype=float).reshape(fact.card)
+        return table
+
+    def _evidence(self, fact, codes):
+        '''
+        returns batched table of the factor with evidence variables indexed
+        out by arrays of their value numbers
+        '''
+        table = self._table(fact)
+        observed = [v for v in fact.var if v in codes]
+        if not observed:
+            return _Batched(list(fact.var), table[np.newaxis, ...])
+        rest = [v for v in fact.var if not v in codes]
+        axes = [fact.var.index(v) for v in observed + rest]
+        index = tuple(codes[v] for v in observed)
+        return _Batched(rest, table.transpose(axes)[index])
+
+    def query(self, query=None, evidence=None, values=None,
+                order='min-fill', chunk=65536):
+        '''
+        computes distribution of query variables for every row of evidence
+        values. Returns ndarray N x |query|, where |query| is the product of
+        query variables' cardinalities; columns go in the order of
+        Factor.cpd of the canonically ordered query variables. Rows of
+        impossible evidence are all zeros.
+
+        Syntax:
+            >>> D = Factor(name='Difficulty', values=[0, 1], cpd=[0.6, 0.4])
+            >>> I = Factor(name='Intelligence', values=[0, 1],
+            ...             cpd=[0.7, 0.3])
+            >>> G = Factor(name='Grade', values=[1, 2, 3],
+            ...             cond=[D, I], cpd=[0.3, 0.4, 0.3,
+            ...                             0.05, 0.25, 0.7,
+            ...                             0.9, 0.08, 0.02,
+            ...                             0.5, 0.3, 0.2])
+            >>> BE = BatchElimination([D, I, G])
+            >>> BE.query([I], [G, D], [[3, 1], [1, 0]])
+            array([[0.18918919, 0.81081081],
+                   [0.93333333, 0.06666667]])
+
+        Arguments:
+            query
+                list of factors, which variables are queried
+            evidence
+                list of factors, which variables are observed
+            values
+                N x len(evidence) table (list of rows or ndarray) of observed
+                values, i. e. values[n][k] is the value of evidence[k] in
+                n-th assignment. Values are mapped through Variable.value.
+            order
+                elimination heuristic or list of variables (see
+                VariableElimination.query)
+            chunk
+                number of rows processed at once. Bounds memory used by
+                batched tables.
+        '''
+        if not query: query = []
+        if not evidence: evidence = []
+
+        query_ = Factor._canonical(fact.var[-1] for fact in query)
+        evid = [fact.var[-1] for fact in evidence]
+        if set(query_) & set(evid):
+            raise AttributeError("Unable to query: variable is observed")
+
+        if values is None:
+            values = np.zeros((0, len(evid)))
+        n = len(values)
+        table = np.asarray(values)
+        if table.ndim == 2 and table.dtype.kind != 'O':
+            columns = [table[:, k] for k in range(len(evid))]
+        else:   # ragged rows or objects: transposed row by row
+            columns = zip(*values) if n else [[]] * len(evid)
+        codes = dict((var, encode(var, col))
+                        for (var, col) in zip(evid, columns))
+
+        res = self._query(query_, codes, n, order, chunk)
+        sums = res.sum(axis=1, keepdims=True)
+        np.divide(res, sums, out=res, where=sums != 0)
+        return res
+
+    def _query(self, query, codes, n, order='min-fill', chunk=65536):
+        '''
+        computes unnormalized joint distribution of query variables and
+        evidence for every row of evidence. Returns ndarray N x |query|,
+        which row sums are probabilities of evidence rows.
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> BatchElimination([A, B])._query([A.cons],
+            ...                         {B.cons: np.array([0, 1])}, 2)
+            array([[0.42, 0.08],
+                   [0.18, 0.32]])
+
+        Arguments:
+            query
+                list of query variables in canonical order
+            codes
+                dict {evidence variable: ndarray of N value numbers}
+            n
+                number of evidence rows
+            order
+                elimination heuristic or list of variables
+            chunk
+                number of rows processed at once
+        '''
+        evid = codes.keys()
+        size = reduce(lambda x, y: x*y, [v.card for v in query], 1)
+        if not query and not evid:
+            return np.ones((n, 1))
+
+        VE = VariableElimination(self.factors)
+        factors = VE._relevant(query + evid)
+        hidden = set(v for fact in factors for v in fact.var) \
+                    - set(query) - set(evid)
+        order = VE._elimination_order(factors, hidden, order)
+
+        res = np.zeros((n, size))
+        for start in range(0, n, chunk):
+            part = dict((var, c[start:start+chunk])
+                            for (var, c) in codes.iteritems())
+            batched = [self._evidence(fact, part) for fact in factors]
+            prod = None
+            for fact in VE.eliminate(batched, order):
+                prod = fact * prod
+            table = prod._aligned(query).reshape(prod.table.shape[0], size)
+            res[start:start+chunk] = table
+        return res
+
+
+class TestBatchElimination(unittest.TestCase):
+
+    def setUp(self):
+        self.D = Factor(name='Difficulty', values=[0, 1], cpd=[0.6, 0.4])
+        self.I = Factor(name='Intelligence', values=['low', 'high'],
+                        cpd=[0.7, 0.3])
+        self.G = Factor(name='Grade|I,D', values=[1, 2, 3],
+                        cond=[self.D, self.I], cpd=[0.3, 0.4, 0.3,
+                                                0.05, 0.25, 0.7,
+                                                0.9, 0.08, 0.02,
+                                                0.5, 0.3, 0.2])
+        self.S = Factor(name='SAT|I', values=[0, 1], cond=[self.I],
+                        cpd=[0.95, 0.05, 0.2, 0.8])
+        self.L = Factor(name='Letter|G', values=[0, 1], cond=[self.G],
+                        cpd=[0.1, 0.9, 0.4, 0.6, 0.99, 0.01])
+        self.factors = [self.D, self.I, self.S, self.G, self.L]
+
+    def tearDown(self):
+        pass
+
+    def testquery(self):
+        VE = VariableElimination(self.factors)
+        BE = BatchElimination(self.factors)
+        rows = [(l, s, d) for l in [0, 1] for s in [0, 1] for d in [0, 1]]
+        for query in ([self.I], [self.G], [self.I, self.G]):
+            res = BE.query(query, [self.L, self.S, self.D], rows, chunk=3)
+            self.assertEqual((len(rows), abs(VE.query(query))), res.shape)
+            for (row, post) in zip(rows, res):
+                expected = VE.query(query, {self.L: row[0], self.S: row[1],
+                                            self.D: row[2]})
+                for (x, y) in zip(expected.cpd, post):
+                    self.assertAlmostEqual(x, y)
+
+    def testquery_partial_order(self):
+        BE = BatchElimination(self.factors)
+        expected = BE.query([self.I], [self.L], [[0], [1]])
+        for order in ([], [self.D.var[-1]]):
+            res = BE.query([self.I], [self.L], [[0], [1]], order)
+            for (x, y) in zip(expected.ravel(), res.ravel()):
+                self.assertAlmostEqual(x, y)
+
+    def testquery_unrelated(self):
+        BE = BatchElimination(self.factors)
+        res = BE.query([self.D], [self.S], [[0], [1]])
+        for post in res:
+            self.assertAlmostEqual(0.6, post[0])
+
+    def testquery_impossible(self):
+        A = Factor(name='A', values=[0, 1], cpd=[1.0, 0.0])
+        B = Factor(name='B', values=[0, 1], cond=[A], cpd=[1.0, 0.0, 0.0, 1.0])
+        res = BatchElimination([A, B]).query([A], [B], [[0], [1]])
+        self.assertEqual([1.0, 0.0], list(res[0]))
+        self.assertEqual([0.0, 0.0], list(res[1]))
+
+    def testquery_values(self):
+        BE = BatchElimination(self.factors)
+        rows = [('high', 1), ('low', 3), ('high', 2)]
+        expected = BE.query([self.D], [self.I, self.G], rows)
+        for values in (np.array(rows), np.array(rows, dtype=object),
+                        [['high', '1'], ['low', '3'], ['high', '2']]):
+            res = BE.query([self.D], [self.I, self.G], values)
+            self.assertEqual(expected.tolist(), res.tolist())
+        res = BE.query([self.I], [self.D, self.G], np.array([[0, 3], [1, 1]]))
+        self.assertEqual((2, 2), res.shape)
+        self.assertEqual((0, 2), BE.query([self.I], [self.G], []).shape)
+
+    def testencode(self):
+        self.assertEqual([1, 0], list(encode(self.I.var[-1], ['high', 'low'])))
+        self.assertRaises(AttributeError, encode, self.I.var[-1], ['mid'])
+        self.assertRaises(AttributeError, encode, self.D.var[-1], [2])
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=False)
+##    doctest.testmod(verbose=True)
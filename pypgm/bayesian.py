@@ -1,25 +1,49 @@
 ﻿##import networkx as nx
+from pypgm.factor import Factor, MemoCache
+from pypgm.elimination import VariableElimination
+from pypgm.junction import JunctionTree
+from pypgm.loopy import LoopyBeliefPropagation
 
 class Bayesian(object):
     '''
     Syntax:
 
     Fields:
-
+        factors
+            list of factors of the net
+        memo
+            MemoCache shared by all factors of the net (see Factor.memo)
     '''
 
-    def __init__(self, factors=None):
+    def __init__(self, factors=None, capacity=1 << 20):
         '''
         Syntax:
+            >>> C = Factor(name='C', values=["no", "yes"], cpd=[0.99, 0.01])
+            >>> T = Factor(name='T|C', values=["pos", "neg"], cond=[C],
+            ...             cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> BN = Bayesian([C, T], capacity=64)
+            >>> T.memo is BN.memo
+            True
+            >>> T.uncond().cpd
+            [0.20700000000000002, 0.793]
+            >>> C.cpd = [0.5, 0.5]
+            >>> T.uncond().cpd
+            [0.55, 0.45]
 
         Arguments:
-
+            factors
+                list of factors
+            capacity
+                maximal total cardinality of cached factors (see MemoCache)
         '''
         if not factors:
             factors = []
 
 ##        self.graph = nx.DiGraph()
         self.factors = factors
+        self.memo = MemoCache(capacity)
+        for fact in self.factors:
+            fact.memo = self.memo
 
 ##        for factor in self.factors:
 ####            self.graph.add_node(factor.var[-1])
@@ -38,6 +62,383 @@ class Bayesian(object):
             res = fact*res
         return res
 
+    def query(self, query=None, evidence=None, order='min-fill', cache=False):
+        '''
+        computes distribution of query variables given evidence by variable
+        elimination. The full joint distribution is never built.
+
+        Syntax:
+            >>> D = Factor(name='D', values=[0,1], cpd=[0.6, 0.4])
+            >>> I = Factor(name='I', values=[0,1], cpd=[0.7, 0.3])
+            >>> G = Factor(name='G|I,D', values=[1, 2, 3], cond=[D,I],
+            ... cpd=[0.3,  0.4,  0.3,
+            ... 0.05, 0.25, 0.7,
+            ... 0.9,  0.08, 0.02,
+            ... 0.5,  0.3,  0.2])
+            >>> S = Factor(name='S|I', values=[0, 1], cond=[I],
+            ...             cpd=[0.95, 0.05, 0.2, 0.8])
+            >>> L = Factor(name='L|G', values=[0, 1], cond=[G],
+            ...             cpd=[0.1, 0.9, 0.4, 0.6, 0.99, 0.01])
+            >>> BN = Bayesian([D,I,S,G,L])
+            >>> R = BN.query(query=[I], evidence={G:3, D:1})
+            >>> R.cpd
+            [0.18918918918918917, 0.8108108108108107]
+            >>> R = BN.query(query=[I], evidence={L:1}, order='min-degree')
+            >>> R.cpd
+            [0.8024494855235265, 0.19755051447647357]
+            >>> R = BN.query(query=[I], evidence={L:1}, cache=True)
+            >>> R.cpd[0] = 0.0
+            >>> BN.query(query=[I], evidence={L:1}, cache=True).cpd
+            [0.8024494855235265, 0.19755051447647357]
+            >>> BN.memo.hits
+            1
+
+        Arguments:
+            query
+                list of factors, which variables are queried
+            evidence
+                dict {factor: value} of observed values, or list of factors
+                to condition on (see Factor.query())
+            order
+                elimination heuristic: 'min-fill', 'min-degree',
+                'weighted-min-fill', 'min-weight', or list of variables in
+                elimination order
+            cache
+                if True, the result is looked up in and stored to memo, keyed
+                on query variables and evidence. Cached results are dropped
+                when any factor of the net changes. Copies are returned, so
+                cached results can't be corrupted by callers.
+        '''
+        if not cache:
+            return VariableElimination(self.factors).query(query, evidence,
+                                                            order)
+        key = ('query', Factor._query_key(query, evidence))
+        res = self.memo.get(key)
+        if res is None:
+            res = VariableElimination(self.factors).query(query, evidence,
+                                                            order)
+            self.memo.put(key, res, self.factors)
+        return res._copy()
+
+    def query_batch(self, query=None, evidence=None, values=None,
+                    order='min-fill'):
+        '''
+        computes distribution of query variables for each of N assignments
+        of evidence variables at once. Returns ndarray N x |query| (see
+        BatchElimination.query). Requires numpy.
+
+        Syntax:
+            >>> C = Factor(name='C', values=["no", "yes"], cpd=[0.99, 0.01])
+            >>> T = Factor(name='T|C', values=["pos", "neg"], cond=[C],
+            ...             cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> BN = Bayesian([C, T])
+            >>> BN.query_batch(query=[C], evidence=[T],
+            ...                 values=[['pos'], ['neg']])
+            array([[0.95652174, 0.04347826],
+                   [0.99873897, 0.00126103]])
+
+        Arguments:
+            query
+                list of factors, which variables are queried
+            evidence
+                list of factors, which variables are observed
+            values
+                N x len(evidence) table of observed values
+            order
+                elimination heuristic or list of variables in elimination
+                order
+        '''
+        from pypgm.batch import BatchElimination    # numpy is optional
+        return BatchElimination(self.factors).query(query, evidence, values,
+                                                    order)
+
+    def query_parallel(self, queries=None, processes=None, batch=None,
+                        order='min-fill'):
+        '''
+        answers list of independent queries in a pool of worker processes,
+        which share CPDs of the net (see ParallelQuery). Requires numpy.
+
+        Syntax:
+            >>> C = Factor(name='C', values=["no", "yes"], cpd=[0.8, 0.2])
+            >>> T = Factor(name='T|C', values=["pos", "neg"], cond=[C],
+            ...             cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> R = Bayesian([C, T]).query_parallel([([C], {T: 'pos'}),
+            ...                     ([C], {T: 'neg'})], processes=2)
+            >>> [[round(p, 6) for p in r.cpd] for r in R]
+            [[0.470588, 0.529412], [0.969697, 0.030303]]
+
+        Arguments:
+            queries
+                list of (query, evidence): query is list of factors and
+                evidence is dict {factor: value}
+            processes
+                number of worker processes, by default number of cores
+            batch
+                number of queries sent to a worker at once
+            order
+                elimination heuristic or order
+        '''
+        if not queries: queries = []
+
+        from pypgm.parallel import ParallelQuery    # numpy is optional
+        PQ = ParallelQuery(self.factors, processes, order)
+        try:
+            return PQ.map(queries, batch)
+        finally:
+            PQ.close()
+
+    def sample(self, n, seed=None):
+        '''
+        draws n samples from the joint distribution of the net by ancestral
+        sampling. Returns integer ndarray n x len(factors) of numbers of
+        values (see ForwardSampler.sample()). Requires numpy.
+
+        Syntax:
+            >>> C = Factor(name='C', values=["no", "yes"], cpd=[0.99, 0.01])
+            >>> T = Factor(name='T|C', values=["pos", "neg"], cond=[C],
+            ...             cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> X = Bayesian([C, T]).sample(1000, seed=0)
+            >>> X.shape
+            (1000, 2)
+
+        Arguments:
+            n
+                number of samples
+            seed
+                seed of the random number generator
+        '''
+        from pypgm.sampling import ForwardSampler   # numpy is optional
+        return ForwardSampler(self.factors).sample(n, seed)
+
+    def likelihood_weighting(self, query=None, evidence=None, ess=None,
+                                width=None, limit=1000000, seed=None):
+        '''
+        estimates distribution of query variables given evidence by
+        likelihood weighting (see LikelihoodWeighting.query()). Requires
+        numpy.
+
+        Syntax:
+            >>> C = Factor(name='C', values=["no", "yes"], cpd=[0.99, 0.01])
+            >>> T = Factor(name='T|C', values=["pos", "neg"], cond=[C],
+            ...             cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> R = Bayesian([C, T]).likelihood_weighting([C], {T: 'neg'},
+            ...                                             ess=10000, seed=0)
+            >>> [round(p, 2) for p in R.cpd]
+            [1.0, 0.0]
+
+        Arguments:
+            query
+                list of factors, which variables are queried
+            evidence
+                dict {factor: value} of observed values
+            ess
+                target effective sample size
+            width
+                target width of confidence intervals
+            limit
+                maximal number of samples
+            seed
+                seed of the random number generator
+        '''
+        from pypgm.sampling import LikelihoodWeighting  # numpy is optional
+        return LikelihoodWeighting(self.factors).query(query, evidence,
+                            ess=ess, width=width, limit=limit, seed=seed)
+
+    def gibbs(self, query=None, evidence=None, samples=1000, burn=100,
+                chains=4, processes=None, seed=None):
+        '''
+        estimates distribution of query variables given evidence by Gibbs
+        sampling in several chains, run in a process pool (see
+        GibbsSampler.query()). Requires numpy.
+
+        Syntax:
+            >>> C = Factor(name='C', values=["no", "yes"], cpd=[0.8, 0.2])
+            >>> T = Factor(name='T|C', values=["pos", "neg"], cond=[C],
+            ...             cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> R = Bayesian([C, T]).gibbs([C], {T: 'neg'}, processes=1,
+            ...                             seed=0)
+            >>> [round(p, 1) for p in R.cpd]
+            [1.0, 0.0]
+
+        Arguments:
+            query
+                list of factors, which variables are queried
+            evidence
+                dict {factor: value} of observed values
+            samples
+                number of samples kept in each chain
+            burn
+                number of sweeps discarded at the beginning of each chain
+            chains
+                number of independent chains
+            processes
+                number of worker processes
+            seed
+                seed of the random number generator
+        '''
+        from pypgm.sampling import GibbsSampler     # numpy is optional
+        return GibbsSampler(self.factors).query(query, evidence,
+                            samples=samples, burn=burn, chains=chains,
+                            processes=processes, seed=seed)
+
+    def fit(self, source, laplace=0.0, chunk=100000):
+        '''
+        learns CPDs of the net by maximum likelihood from data, read in
+        chunks (see MaximumLikelihood.fit()). Requires numpy. Returns self.
+
+        Syntax:
+            >>> C = Factor(name='C', values=["no", "yes"])
+            >>> T = Factor(name='T', values=["pos", "neg"], cond=[C])
+            >>> BN = Bayesian([C, T]).fit({'C': ['no', 'yes', 'no'],
+            ...                             'T': ['neg', 'pos', 'pos']},
+            ...                             laplace=1)
+            >>> T.cpd
+            [0.5, 0.5, 0.6666666666666666, 0.3333333333333333]
+
+        Arguments:
+            source
+                CSV file name or file object with header line of variable
+                names, dict {variable name: column} or iterable of such
+                dicts
+            laplace
+                pseudocount added to every count
+            chunk
+                number of CSV rows read at once
+        '''
+        from pypgm.learning import MaximumLikelihood   # numpy is optional
+        MaximumLikelihood(self.factors, laplace).fit(source, chunk)
+        return self
+
+    def fit_em(self, source, laplace=0.0, tol=1e-6, max_iter=100,
+                chunk=100000, seed=None):
+        '''
+        learns CPDs of the net from data with missing values by
+        expectation-maximization (see ExpectationMaximization). Requires
+        numpy. Returns self.
+
+        Syntax:
+            >>> C = Factor(name='C', values=["no", "yes"])
+            >>> T = Factor(name='T', values=["pos", "neg"], cond=[C])
+            >>> BN = Bayesian([C, T]).fit_em({'C': ['no', 'yes', None],
+            ...                             'T': ['neg', 'pos', 'pos']},
+            ...                             laplace=1, seed=0)
+            >>> [round(p, 3) for p in C.cpd]
+            [0.464, 0.536]
+
+        Arguments:
+            source
+                CSV file name or seekable file object with header line of
+                variable names, dict {variable name: column} or list of such
+                dicts
+            laplace
+                pseudocount added to every expected count
+            tol
+                relative tolerance of log-likelihood
+            max_iter
+                maximal number of iterations
+            chunk
+                number of CSV rows read at once
+            seed
+                seed of random initial CPDs of factors without them
+        '''
+        from pypgm.learning import ExpectationMaximization  # numpy is optional
+        ExpectationMaximization(self.factors, laplace, tol, max_iter,
+                                seed=seed).fit(source, chunk)
+        return self
+
+    def save(self, path):
+        '''
+        writes the net to a binary file (see storage.save()). Requires
+        numpy.
+
+        Arguments:
+            path
+                file name
+        '''
+        from pypgm.storage import save          # numpy is optional
+        save(self.factors, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        reads a net written by save(). With mmap CPDs are mapped into memory
+        and not read (see storage.load()). Requires numpy.
+
+        Syntax:
+            >>> import os, tempfile
+            >>> C = Factor(name='C', values=["no", "yes"], cpd=[0.8, 0.2])
+            >>> T = Factor(name='T|C', values=["pos", "neg"], cond=[C],
+            ...             cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> (handle, path) = tempfile.mkstemp()
+            >>> os.close(handle)
+            >>> Bayesian([C, T]).save(path)
+            >>> BN = Bayesian.load(path)
+            >>> BN.factors
+            [C, T|C]
+            >>> [round(p, 6) for p in BN.query([BN.factors[0]],
+            ...                                 {BN.factors[1]: 'pos'}).cpd]
+            [0.470588, 0.529412]
+            >>> os.remove(path)
+
+        Arguments:
+            path
+                file name
+            mmap
+                map CPDs into memory instead of reading them
+        '''
+        from pypgm.storage import load          # numpy is optional
+        return load(path, mmap)
+
+    def junction_tree(self, order='min-fill'):
+        '''
+        compiles the net into a junction tree for repeated queries
+
+        Syntax:
+            >>> D = Factor(name='D', values=[0,1], cpd=[0.6, 0.4])
+            >>> I = Factor(name='I', values=[0,1], cpd=[0.7, 0.3])
+            >>> S = Factor(name='S|I', values=[0, 1], cond=[I],
+            ...             cpd=[0.95, 0.05, 0.2, 0.8])
+            >>> JT = Bayesian([D,I,S]).junction_tree()
+            >>> JT.cliques
+            [[D], [I, S|I]]
+            >>> JT.calibrate()
+            >>> JT.query(query=[S]).cpd
+            [0.725, 0.275]
+
+        Arguments:
+            order
+                elimination heuristic used for triangulation, or list of
+                variables in elimination order
+        '''
+        return JunctionTree(self.factors, order)
+
+    def loopy_bp(self, schedule='synchronous', damping=0.0, tol=1e-6,
+                    max_iter=100):
+        '''
+        prepares approximate inference by loopy belief propagation on the
+        factor graph of the net (see LoopyBeliefPropagation)
+
+        Syntax:
+            >>> C = Factor(name='C', values=["no", "yes"], cpd=[0.8, 0.2])
+            >>> T = Factor(name='T|C', values=["pos", "neg"], cond=[C],
+            ...             cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> BP = Bayesian([C, T]).loopy_bp(schedule='residual')
+            >>> [round(p, 6) for p in BP.query([C], {T: 'pos'}).cpd]
+            [0.470588, 0.529412]
+
+        Arguments:
+            schedule
+                'synchronous' or 'residual' message updates
+            damping
+                weight of the old message in the updated one
+            tol
+                convergence tolerance
+            max_iter
+                maximal number of iterations
+        '''
+        return LoopyBeliefPropagation(self.factors, schedule, damping,
+                                        tol, max_iter)
+
 ##    def draw(self):
 ##        '''
 ##        Syntax:
@@ -0,0 +1,249 @@
+'''
+    Count index over training data. Records are reduced once to distinct
+    assignments of all variables with their multiplicities (sparse full
+    contingency table), and for every value of every variable a sorted list
+    of distinct assignments having it is kept. A conjunctive count
+    N(X=x, Y=y, ...) intersects the lists, and a contingency table over any
+    variables is one weighted bincount over distinct assignments; raw
+    records are never scanned again.
+'''
+
+import unittest
+from timeit import default_timer
+import numpy as np
+from pypgm.factor import Factor
+from pypgm.batch import encode
+from pypgm.learning import _chunks, _column
+
+
+class CountIndex(object):
+    '''
+    Syntax:
+            >>> A = Factor(name='A', values=['a0', 'a1'])
+            >>> B = Factor(name='B', values=[0, 1, 2])
+            >>> CI = CountIndex([A, B], {'A': ['a0', 'a1', 'a0', 'a0'],
+            ...                           'B': [2, 0, 2, 1]})
+            >>> CI.records, len(CI.weights)
+            (4, 3)
+            >>> CI.count({A: 'a0'}), CI.count({A: 'a0', B: 2}), CI.count({})
+            (3, 2, 4)
+            >>> CI.table([B, A])
+            array([[0, 1],
+                   [1, 0],
+                   [2, 0]])
+
+    Fields:
+        factors
+            list of factors, which variables are indexed
+        rows
+            ndarray U x V of value numbers: distinct assignments of V
+            variables
+        weights
+            ndarray of numbers of records with each distinct assignment
+        postings
+            list of lists of ndarrays: postings[k][j] are sorted numbers of
+            distinct assignments, where k-th variable has j-th value
+        records
+            number of records
+        build_time
+            seconds spent on building the index
+    '''
+
+    def __init__(self, factors=None, source=None, chunk=100000):
+        '''
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1])
+            >>> CI = CountIndex([A], [{'A': [1, 1]}, {'A': [0, 1]}])
+            >>> CI.rows.tolist(), CI.weights.tolist(), CI.rows.dtype
+            ([[0], [1]], [1, 3], dtype('uint8'))
+
+        Arguments:
+            factors
+                list of factors, which variables are indexed
+            source
+                CSV file name or file object with header line of variable
+                names, dict {variable name: column} or iterable of such
+                dicts
+            chunk
+                number of CSV rows read at once
+        '''
+        if not factors:
+            factors = []
+        if source is None:
+            source = []
+
+        start = default_timer()
+        self.factors = factors
+        variables = [fact.var[-1] for fact in factors]
+        largest = max([var.card for var in variables] or [1])
+        dtype = np.min_scalar_type(largest - 1)
+        self._column = dict((var, k) for (k, var) in enumerate(variables))
+        parts = []
+        weights = []
+        self.records = 0
+        for data in _chunks(source, chunk):
+            codes = np.array([encode(var, _column(data, var))
+                                for var in variables], dtype=dtype).T
+            if not len(codes):
+                continue
+            (rows, counts) = np.unique(codes, axis=0, return_counts=True)
+            parts.append(rows)
+            weights.append(counts)
+            self.records += len(codes)
+        if parts:
+            (self.rows, inverse) = np.unique(np.concatenate(parts), axis=0,
+                                                return_inverse=True)
+            self.weights = np.bincount(inverse,
+                            weights=np.concatenate(weights)).astype(np.int64)
+        else:
+            self.rows = np.zeros((0, len(variables)), dtype=dtype)
+            self.weights = np.zeros(0, dtype=np.int64)
+        index = np.min_scalar_type(max(len(self.rows) - 1, 0))
+        self.postings = []
+        for (k, var) in enumerate(variables):
+            order = np.argsort(self.rows[:, k], kind='mergesort')
+            sizes = np.bincount(self.rows[:, k], minlength=var.card)
+            self.postings.append([order[stop - size:stop].astype(index)
+                    for (stop, size) in zip(np.cumsum(sizes), sizes)])
+        self.build_time = default_timer() - start
+
+    def nbytes(self):
+        '''
+        returns memory used by arrays of the index in bytes
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1])
+            >>> CountIndex([A], {'A': [0, 1, 1]}).nbytes()
+            20
+        '''
+        return self.rows.nbytes + self.weights.nbytes + \
+                sum(ids.nbytes for lists in self.postings for ids in lists)
+
+    def _variable(self, fact):
+        try:
+            return self._column[fact.var[-1]]
+        except KeyError:
+            raise AttributeError("Variable is not indexed: " +
+                                    fact.var[-1].name)
+
+    def count(self, assignment):
+        '''
+        returns number of records with given values of variables
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1])
+            >>> B = Factor(name='B', values=[0, 1])
+            >>> CI = CountIndex([A, B], {'A': [0, 1, 1], 'B': [1, 1, 0]})
+            >>> CI.count({A: 1, B: 1}), CI.count({A: 0, B: 0})
+            (1, 0)
+
+        Arguments:
+            assignment
+                dict {factor: value}
+        '''
+        lists = []
+        for (fact, value) in assignment.iteritems():
+            k = self._variable(fact)
+            index = fact.var[-1].find_value(value)
+            if index is None:
+                raise AttributeError("Unknown value of variable " +
+                                        fact.var[-1].name)
+            lists.append(self.postings[k][index])
+        if not lists:
+            return self.records
+        lists.sort(key=len)
+        ids = lists[0]
+        for other in lists[1:]:
+            if not len(ids):
+                break
+            ids = np.intersect1d(ids, other, assume_unique=True)
+        return int(self.weights[ids].sum())
+
+    def table(self, factors):
+        '''
+        returns contingency table of variables: integer ndarray, which axes
+        go in the order of given factors
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1])
+            >>> B = Factor(name='B', values=[0, 1])
+            >>> CI = CountIndex([A, B], {'A': [0, 1, 1], 'B': [1, 1, 0]})
+            >>> CI.table([A]), CI.table([])
+            (array([1, 2]), array(3))
+
+        Arguments:
+            factors
+                list of factors, which variables are counted
+        '''
+        columns = [self._variable(fact) for fact in factors]
+        cards = [fact.var[-1].card for fact in factors]
+        flat = np.zeros(len(self.rows), dtype=np.intp)
+        for (k, card) in zip(columns, cards):
+            flat = flat * card + self.rows[:, k]
+        size = int(np.prod(cards))
+        return np.bincount(flat, weights=self.weights, minlength=size
+                            ).astype(np.int64).reshape(cards)
+
+
+class TestCountIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.D = Factor(name='Difficulty', values=[0, 1], cpd=[0.6, 0.4])
+        self.I = Factor(name='Intelligence', values=['low', 'high'],
+                        cpd=[0.7, 0.3])
+        self.G = Factor(name='Grade', values=[1, 2, 3],
+                        cond=[self.D, self.I], cpd=[0.3, 0.4, 0.3,
+                                                0.05, 0.25, 0.7,
+                                                0.9, 0.08, 0.02,
+                                                0.5, 0.3, 0.2])
+        self.factors = [self.D, self.I, self.G]
+        from pypgm.sampling import ForwardSampler
+        self.samples = ForwardSampler(self.factors).sample(3000, seed=5)
+        self.data = [dict((fact.var[-1].name,
+                        np.array(fact.var[-1].value)[self.samples[k:k + 700,
+                        n]]) for (n, fact) in enumerate(self.factors))
+                        for k in range(0, 3000, 700)]
+
+    def tearDown(self):
+        pass
+
+    def testcount(self):
+        CI = CountIndex(self.factors, self.data)
+        self.assertEqual(3000, CI.records)
+        self.assertEqual(3000, CI.weights.sum())
+        self.assertTrue(len(CI.rows) <= 12)
+        for d in range(2):
+            for g in range(3):
+                expected = np.sum((self.samples[:, 0] == d) &
+                                    (self.samples[:, 2] == g))
+                self.assertEqual(expected, CI.count({self.D: d,
+                                                    self.G: g + 1}))
+        self.assertEqual(np.sum(self.samples[:, 1] == 1),
+                            CI.count({self.I: 'high'}))
+        self.assertRaises(AttributeError, CI.count, {self.I: 'medium'})
+        A = Factor(name='A', values=[0, 1])
+        self.assertRaises(AttributeError, CI.count, {A: 0})
+
+    def testtable(self):
+        CI = CountIndex(self.factors, self.data)
+        table = CI.table([self.G, self.D])
+        self.assertEqual((3, 2), table.shape)
+        for d in range(2):
+            for g in range(3):
+                self.assertEqual(CI.count({self.D: d, self.G: g + 1}),
+                                    table[g, d])
+
+    def testfootprint(self):
+        CI = CountIndex(self.factors, self.data)
+        self.assertTrue(CI.build_time >= 0)
+        self.assertEqual(CI.nbytes(), CI.rows.nbytes + CI.weights.nbytes +
+                            len(CI.rows) * 3)           # 3 postings of uint8
+        empty = CountIndex(self.factors)
+        self.assertEqual(0, empty.count({}))
+        self.assertEqual(0, empty.table([self.G]).sum())
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=False)
+##    doctest.testmod(verbose=True)
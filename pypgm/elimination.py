@@ -0,0 +1,421 @@
+'''
+    Variable elimination - exact inference over a set of factors (for ex.
+    CPDs of a bayesian net) which never builds the full joint distribution.
+    Hidden variables are summed out one by one in an order chosen by a
+    greedy heuristic over the interaction graph of the factors.
+'''
+
+import unittest
+from pypgm.factor import Factor
+
+
+def _fill_edges(graph, var):
+    '''
+    returns list of pairs of var's neighbours, which are not connected yet
+    '''
+    neighbours = sorted(graph[var], key=lambda v: v.ordinal)
+    res = []
+    for i in range(len(neighbours)):
+        for j in range(i+1, len(neighbours)):
+            if not neighbours[j] in graph[neighbours[i]]:
+                res.append((neighbours[i], neighbours[j]))
+    return res
+
+def min_degree(graph, var):
+    '''
+    number of neighbours of the variable
+    '''
+    return len(graph[var])
+
+def min_fill(graph, var):
+    '''
+    number of edges added to the graph, when the variable is eliminated
+    '''
+    return len(_fill_edges(graph, var))
+
+def weighted_min_fill(graph, var):
+    '''
+    sum of weights of edges added to the graph, when the variable is
+    eliminated. Weight of an edge is product of its ends' cardinalities.
+    '''
+    return sum(u.card * w.card for (u, w) in _fill_edges(graph, var))
+
+def min_weight(graph, var):
+    '''
+    size of the factor, produced when the variable is eliminated
+    '''
+    res = var.card
+    for u in graph[var]:
+        res *= u.card
+    return res
+
+
+class VariableElimination(object):
+    '''
+    Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> T = Factor(name='Test', values=["pos", "neg"],
+            ...             cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> VE = VariableElimination([C, T])
+            >>> VE.query(query=[C], evidence={T: 'pos'}).cpd
+            [0.9565217391304347, 0.043478260869565216]
+
+    Fields:
+        factors
+            list of factors to run inference on. Factors of any type can be
+            used (Factor, ArrayFactor, ...), the engine relies only on their
+            product, marginal and reduction operations.
+    '''
+
+    heuristics = {'min-degree': min_degree,
+                  'min-fill': min_fill,
+                  'weighted-min-fill': weighted_min_fill,
+                  'min-weight': min_weight}
+
+    def __init__(self, factors=None):
+        '''
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> VariableElimination([A]).factors
+            [A]
+
+        Arguments:
+            factors
+                list of factors
+        '''
+        if not factors:
+            factors = []
+
+        self.factors = factors
+
+    def _relevant(self, variables):
+        '''
+        returns factors, which can affect distribution of given variables:
+        factors introducing them and all their ancestors (factors introducing
+        variables of their scopes). Other factors sum out to 1 and are
+        skipped.
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> C = Factor(name='C', values=[0, 1], cond=[A],
+            ...             cpd=[0.1, 0.9, 0.5, 0.5])
+            >>> VariableElimination([A, B, C])._relevant([B.cons])
+            [A, B]
+
+        Arguments:
+            variables
+                list of variables
+        '''
+        owner = {}
+        for fact in self.factors:
+            owner[fact.var[-1]] = fact
+        if [v for v in variables if not v in owner]:
+            return list(self.factors)       # not a bayesian net
+        stack = [owner[v] for v in variables]
+        keep = set()
+        while stack:
+            fact = stack.pop()
+            if fact in keep:
+                continue
+            keep.add(fact)
+            for var in fact.var:
+                if var in owner:
+                    stack.append(owner[var])
+        return [fact for fact in self.factors if fact in keep]
+
+    def order(self, factors, hidden, heuristic='min-fill'):
+        '''
+        computes elimination order of the hidden variables greedily: on
+        every step eliminates the variable with the lowest cost given by
+        heuristic. Ties are broken by Variable.ordinal.
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> C = Factor(name='C', values=[0, 1], cond=[B],
+            ...             cpd=[0.1, 0.9, 0.5, 0.5])
+            >>> VE = VariableElimination([A, B, C])
+            >>> VE.order(VE.factors, [A.cons, B.cons])
+            [A, B]
+            >>> VE.order(VE.factors, [A.cons, B.cons], 'min-degree')
+            [A, B]
+
+        Arguments:
+            factors
+                list of factors, which defines the interaction graph
+            hidden
+                list of variables to eliminate
+            heuristic
+                name of the cost function: 'min-fill', 'min-degree',
+                'weighted-min-fill' or 'min-weight'
+        '''
+        if not heuristic in self.heuristics:
+            raise AttributeError("Unknown elimination heuristic: " +
+                                    str(heuristic))
+        cost = self.heuristics[heuristic]
+
+        graph = {}
+        for fact in factors:
+            for var in fact.var:
+                graph.setdefault(var, set()).update(fact.var)
+        for var in graph:
+            graph[var].discard(var)
+
+        res = []
+        hidden = set(v for v in hidden if v in graph)
+        while hidden:
+            var = min(hidden, key=lambda v: (cost(graph, v), v.ordinal))
+            neighbours = graph.pop(var)
+            for u in neighbours:
+                graph[u].discard(var)
+                graph[u].update(neighbours - set([u]))
+            hidden.remove(var)
+            res.append(var)
+        return res
+
+    def _elimination_order(self, factors, hidden, order):
+        '''
+        returns elimination order of the hidden variables: computed by
+        heuristic, or given list of variables without ones, which are not
+        hidden, followed by missing hidden variables in min-fill order
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> C = Factor(name='C', values=[0, 1], cond=[B],
+            ...             cpd=[0.1, 0.9, 0.5, 0.5])
+            >>> VE = VariableElimination([A, B, C])
+            >>> VE._elimination_order(VE.factors, [A.cons, B.cons], [])
+            [A, B]
+            >>> VE._elimination_order(VE.factors, [A.cons, B.cons],
+            ...                         [C.cons, B.cons])
+            [B, A]
+
+        Arguments:
+            factors
+                list of factors, which defines the interaction graph
+            hidden
+                list of variables to eliminate
+            order
+                name of elimination heuristic or list of variables
+        '''
+        if not isinstance(order, (list, tuple)):
+            return self.order(factors, hidden, order)
+        hidden = set(hidden)
+        res = [var for var in order if var in hidden]
+        return res + self.order(factors, hidden - set(res))
+
+    def eliminate(self, factors, order):
+        '''
+        sums out variables from the product of factors one by one in given
+        order. Returns list of remaining factors.
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> R = VariableElimination().eliminate([A, B], [A.cons])
+            >>> R[0].var, R[0].cpd
+            ([B], [0.5, 0.5])
+
+        Arguments:
+            factors
+                list of factors
+            order
+                list of variables to sum out
+        '''
+        for var in order:
+            related = [fact for fact in factors if var in fact.var]
+            if not related:
+                continue
+            factors = [fact for fact in factors if not var in fact.var]
+            res = None
+            for fact in related:
+                res = fact * res
+            factors.append(res.marginal(var))
+        return factors
+
+    def query(self, query=None, evidence=None, order='min-fill'):
+        '''
+        computes distribution of query variables given evidence. The result
+        is the same as Factor.query() on the joint distribution of the
+        factors.
+
+        Syntax:
+            >>> D = Factor(name='Difficulty', values=[0, 1], cpd=[0.6, 0.4])
+            >>> I = Factor(name='Intelligence', values=[0, 1],
+            ...             cpd=[0.7, 0.3])
+            >>> G = Factor(name='Grade', values=[1, 2, 3],
+            ...             cond=[D, I], cpd=[0.3, 0.4, 0.3,
+            ...                             0.05, 0.25, 0.7,
+            ...                             0.9, 0.08, 0.02,
+            ...                             0.5, 0.3, 0.2])
+            >>> VE = VariableElimination([D, I, G])
+            >>> R = VE.query(query=[I], evidence={G: 3, D: 1})
+            >>> R.name, R.var
+            ('Marginal factor', [Intelligence])
+            >>> R.cpd
+            [0.18918918918918917, 0.8108108108108107]
+
+            With evidence given as a list, the result is conditional
+            distribution of query variables given evidence variables:
+            >>> R = VE.query(query=[I], evidence=[D])
+            >>> R.name, R.var, R.cond
+            ('Conditional', [Difficulty, Intelligence], [Difficulty])
+            >>> R.cpd
+            [0.7, 0.3, 0.7000000000000001, 0.3]
+
+        Arguments:
+            query
+                list of factors, which variables are queried
+            evidence
+                dict {factor: value} of observed values, or list of factors
+                to condition on
+            order
+                name of elimination heuristic (see VariableElimination.order)
+                or list of variables in elimination order. Hidden variables
+                missing from the list are eliminated after it in min-fill
+                order.
+        '''
+        if not query: query = []
+        if not evidence: evidence = {}
+
+        query_ = [fact.var[-1] for fact in query]
+        if isinstance(evidence, dict):
+            observed = dict((fact.var[-1], val)
+                                for (fact, val) in evidence.iteritems())
+            kept = query_
+        else:
+            observed = {}
+            kept = query_ + [fact.var[-1] for fact in evidence]
+
+        factors = []
+        for fact in self._relevant(kept + observed.keys()):
+            local = dict((var, val) for (var, val) in observed.iteritems()
+                                    if var in fact.var and not var in kept)
+            if local:
+                fact = fact._reduce3(local)
+            factors.append(fact)
+        for var in Factor._canonical(set(observed) & set(kept)):
+            index = var.find_value(observed[var])
+            factors.append(Factor(name='Evidence', var=[var],
+                            cpd=[float(j == index) for j in range(var.card)]))
+
+        hidden = set(v for fact in factors for v in fact.var) - set(kept)
+        order = self._elimination_order(factors, hidden, order)
+
+        res = None
+        for fact in self.eliminate(factors, order):
+            res = fact * res
+        res = res.permute(res.var)._norm()      # never mutate given factors
+
+        if isinstance(evidence, dict):
+            res.name = 'Marginal factor'
+            res.cond = []
+            res.parents = []
+            return res
+
+        marg = res
+        for var in query_:
+            marg = marg.marginal(var)
+        marg.cond = []
+        res = res / marg
+        res.parents = sorted(evidence, key=lambda f: f.var[-1].ordinal)
+        res.cond = [fact.var[-1] for fact in res.parents]
+        return res
+
+
+class TestVariableElimination(unittest.TestCase):
+
+    def setUp(self):
+        self.D = Factor(name='Difficulty', values=[0, 1], cpd=[0.6, 0.4])
+        self.I = Factor(name='Intelligence', values=['low', 'high'],
+                        cpd=[0.7, 0.3])
+        self.G = Factor(name='Grade|I,D', values=[1, 2, 3],
+                        cond=[self.D, self.I], cpd=[0.3, 0.4, 0.3,
+                                                0.05, 0.25, 0.7,
+                                                0.9, 0.08, 0.02,
+                                                0.5, 0.3, 0.2])
+        self.S = Factor(name='SAT|I', values=[0, 1], cond=[self.I],
+                        cpd=[0.95, 0.05, 0.2, 0.8])
+        self.L = Factor(name='Letter|G', values=[0, 1], cond=[self.G],
+                        cpd=[0.1, 0.9, 0.4, 0.6, 0.99, 0.01])
+        self.factors = [self.D, self.I, self.S, self.G, self.L]
+        self.VE = VariableElimination(self.factors)
+
+    def tearDown(self):
+        pass
+
+    def _joint(self, query, evidence):
+        res = None
+        for fact in self.factors:
+            res = fact * res
+        res = res.reduce(evidence=dict((f.var[-1], v)
+                                        for (f, v) in evidence.items()))
+        for var in set(res.var) - set(f.var[-1] for f in query):
+            res = res.marginal(var)
+        return res._norm()
+
+    def test_order(self):
+        hidden = [f.var[-1] for f in self.factors]
+        for heuristic in VariableElimination.heuristics:
+            order = self.VE.order(self.factors, hidden, heuristic)
+            self.assertEqual(set(hidden), set(order))
+        self.assertRaises(AttributeError, self.VE.order,
+                            self.factors, hidden, 'unknown')
+
+    def testquery_partial_order(self):
+        expected = self.VE.query([self.L], {self.S: 1})
+        for order in ([], [self.G.var[-1]], [self.L.var[-1], self.D.var[-1]]):
+            res = self.VE.query([self.L], {self.S: 1}, order)
+            self.assertEqual([self.L.var[-1]], res.var)
+            for (x, y) in zip(expected.cpd, res.cpd):
+                self.assertAlmostEqual(x, y)
+
+    def testquery(self):
+        cases = [([self.I], {self.G: 3, self.D: 1}),
+                 ([self.G], {self.L: 0}),
+                 ([self.D, self.I], {self.L: 1, self.S: 1}),
+                 ([self.L], {})]
+        for (query, evidence) in cases:
+            expected = self._joint(query, evidence)
+            for heuristic in VariableElimination.heuristics:
+                res = self.VE.query(query, evidence, heuristic)
+                self.assertEqual(expected.var, res.var)
+                for (x, y) in zip(expected.cpd, res.cpd):
+                    self.assertAlmostEqual(x, y)
+
+    def testquery_conditional(self):
+        C = Factor(name='Cancer', values=["no", "yes"], cpd=[0.99, 0.01])
+        T = Factor(name='Test', values=["pos", "neg"], cond=[C],
+                    cpd=[0.2, 0.8, 0.9, 0.1])
+        expected = T.query(query=[C], evidence=[T])
+        res = VariableElimination([C, T]).query(query=[C], evidence=[T])
+        self.assertEqual(expected.var, res.var)
+        self.assertEqual(expected.cond, res.cond)
+        for (x, y) in zip(expected.cpd, res.cpd):
+            self.assertAlmostEqual(x, y)
+
+    def testquery_observed(self):
+        res = self.VE.query([self.G], {self.G: 2, self.L: 1})
+        self.assertEqual([self.G.var[-1]], res.var)
+        self.assertEqual([0.0, 1.0, 0.0], list(res.cpd))
+
+        res = self.VE.query([self.D])
+        res.cpd[0] = 5.0
+        self.assertEqual([0.6, 0.4], self.D.cpd)
+
+    def testrelevant(self):
+        self.assertEqual([self.D, self.I, self.G],
+                            self.VE._relevant([self.G.var[-1]]))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=False)
+##    doctest.testmod(verbose=True)
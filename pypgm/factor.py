@@ -6,8 +6,247 @@
 '''
 
 import unittest
+from itertools import izip
+from collections import OrderedDict
 from pypgm.variable import Variable
 
+
+def _walk(card, strides):
+    '''
+    iterates over all assignments of variables with given cardinalities in
+    order and yields numbers of corresponding assignments of another
+    factor, given its strides along the same variables. Uses integer
+    arithmetic only.
+
+    Syntax:
+        >>> list(_walk([2, 2], [1, 2]))
+        [0, 2, 1, 3]
+
+    Arguments:
+        card
+            list of cardinalities of variables
+        strides
+            list of strides, one for each variable
+    '''
+    digits = [0] * len(card)
+    index = 0
+    for i in xrange(reduce(lambda x, y: x*y, card, 1)):
+        yield index
+        j = len(card) - 1
+        while j >= 0:
+            digits[j] += 1
+            index += strides[j]
+            if digits[j] < card[j]:
+                break
+            index -= strides[j] * card[j]
+            digits[j] = 0
+            j -= 1
+
+
+class PlanCache(object):
+    '''
+    Bounded LRU cache of index mappings (plans) between factors' scopes. A
+    plan depends only on the cardinalities of the scope being walked and on
+    the strides of the other factor along it, so the same plan serves every
+    pair of scopes of the same shape. Factor operations take their plans
+    from the cache, so repeated operations on the same scopes are pure data
+    movement.
+
+    Syntax:
+        >>> P = PlanCache(capacity=8)
+        >>> P.indices([2, 2], [1, 2])
+        (0, 2, 1, 3)
+        >>> P.indices([2, 2], [1, 2])
+        (0, 2, 1, 3)
+        >>> P.hits, P.misses, P.stored
+        (1, 1, 4)
+
+    Fields:
+        capacity
+            maximal total number of indices in stored plans. Least recently
+            used plans are evicted to fit; plans larger than capacity are
+            computed but never stored.
+        stored
+            total number of indices in stored plans
+        hits
+            number of lookups, served from the cache
+        misses
+            number of lookups, which computed the plan
+    '''
+
+    def __init__(self, capacity=1 << 20):
+        '''
+        Arguments:
+            capacity
+                maximal total number of indices in stored plans
+        '''
+        self.capacity = capacity
+        self.stored = 0
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict()
+
+    def indices(self, card, strides):
+        '''
+        returns plan - tuple of numbers of assignments of another factor for
+        each assignment of variables with given cardinalities (see _walk()).
+
+        Arguments:
+            card
+                list of cardinalities of variables
+            strides
+                list of strides of another factor, one for each variable
+        '''
+        key = (tuple(card), tuple(strides))
+        plan = self._plans.pop(key, None)
+        if plan is not None:
+            self.hits += 1
+            self._plans[key] = plan
+            return plan
+        self.misses += 1
+        plan = tuple(_walk(card, strides))
+        if len(plan) <= self.capacity:
+            while self.stored + len(plan) > self.capacity:
+                self.stored -= len(self._plans.popitem(last=False)[1])
+            self._plans[key] = plan
+            self.stored += len(plan)
+        return plan
+
+    def clear(self):
+        '''
+        drops all stored plans and resets counters
+
+        Syntax:
+            >>> P = PlanCache()
+            >>> P.indices([2], [1])
+            (0, 1)
+            >>> P.clear()
+            >>> P.hits, P.misses, P.stored
+            (0, 0, 0)
+        '''
+        self._plans.clear()
+        self.stored = 0
+        self.hits = 0
+        self.misses = 0
+
+
+class MemoCache(object):
+    '''
+    Bounded LRU cache of factors computed out of other factors, for ex.
+    unconditioned distributions (see Factor.uncond()). Every entry records
+    the factors it was computed from. When a factor changes (see
+    Factor.changed()), all entries depending on it are dropped - including
+    entries of its descendants, since they depend on it too.
+
+    Syntax:
+        >>> A = Factor(name='A', values=[0, 1], cpd=[0.2, 0.8])
+        >>> B = Factor(name='B', values=[0, 1], cond=[A],
+        ...             cpd=[0.6, 0.4, 0.3, 0.7])
+        >>> M = MemoCache(capacity=16)
+        >>> M.put('key', B.uncond(), [A, B])
+        >>> M.get('key').cpd
+        [0.36, 0.6399999999999999]
+        >>> M.invalidate(A)
+        >>> M.get('key') is None
+        True
+
+    Fields:
+        capacity
+            maximal total cardinality of stored factors. Least recently used
+            entries are evicted to fit; larger factors are never stored.
+        stored
+            total cardinality of stored factors
+        hits
+            number of lookups, served from the cache
+        misses
+            number of lookups of missing entries
+    '''
+
+    def __init__(self, capacity=1 << 20):
+        '''
+        Arguments:
+            capacity
+                maximal total cardinality of stored factors
+        '''
+        self.capacity = capacity
+        self.stored = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> (factor, dependencies)
+        self._dependents = {}           # factor -> set of keys
+
+    def get(self, key):
+        '''
+        returns factor stored under given key, or None
+
+        Arguments:
+            key
+                any hashable object
+        '''
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries[key] = entry
+        return entry[0]
+
+    def put(self, key, value, depends):
+        '''
+        stores factor under given key
+
+        Arguments:
+            key
+                any hashable object
+            value
+                factor to store
+            depends
+                iterable of factors, which the value is computed out of
+        '''
+        self._drop(key)
+        if abs(value) > self.capacity:
+            return
+        while self.stored + abs(value) > self.capacity:
+            self._drop(next(iter(self._entries)))
+        depends = frozenset(depends)
+        self._entries[key] = (value, depends)
+        self.stored += abs(value)
+        for fact in depends:
+            self._dependents.setdefault(fact, set()).add(key)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.stored -= abs(entry[0])
+        for fact in entry[1]:
+            keys = self._dependents[fact]
+            keys.discard(key)
+            if not keys:
+                del self._dependents[fact]
+
+    def invalidate(self, fact):
+        '''
+        drops all entries, which depend on given factor
+
+        Arguments:
+            fact
+                factor
+        '''
+        for key in list(self._dependents.get(fact, ())):
+            self._drop(key)
+
+    def clear(self):
+        '''
+        drops all entries and resets counters
+        '''
+        self._entries.clear()
+        self._dependents.clear()
+        self.stored = 0
+        self.hits = 0
+        self.misses = 0
+
+
 class Factor(object):
     '''
     Syntax:
@@ -34,7 +273,9 @@ class Factor(object):
             When creating a factor , variables are put in this list as they
             were listed by user, first conditioning variables, then listed
             using var argument, then induced variable if any (see
-            Factor.__init__() for details).
+            Factor.__init__() for details). Factors computed by operations
+            (product, marginal, reduction, division) keep their variables in
+            canonical order - sorted by Variable.ordinal.
         cpd
             list of all fator's values. Length of this list should be equal
             to the product of all included variables' cardinalities.
@@ -43,6 +284,10 @@ class Factor(object):
             to var list.
         pcard
             list of poduct-cumulative cardinalities computed out of card list.
+        stride
+            list of strides: how far the assignment number moves when value of
+            the corresponding variable in var list increments. Equal to
+            pcard[1:].
         cons
             if factor introduces new variable (see Factor.__init__() for
             details), it is stored in this field
@@ -52,8 +297,17 @@ class Factor(object):
         parents
             list of all factors, that are meant to be conditioning this, or are
             parents to this according to bayesian net.
+        plans
+            class-wide PlanCache of index mappings, used by all operations
+        memo
+            MemoCache of results computed out of this factor. By default
+            it is a class-wide cache; Bayesian gives the factors of a
+            net a cache of its own.
     '''
 
+    plans = PlanCache()
+    memo = MemoCache()
+
     def __init__(self, name='',
                         values=None,
                         cond=None,
@@ -159,7 +413,7 @@ class Factor(object):
         self.parents = []           # факторы-родители
         self.var = []               # переменные, входящие в фактор
         self.card = []              # вектор разрядности переменных
-        self._uncond_cache = None
+        self.stride = []            # шаг номера присваивания по переменным
 
         for factor in cond:
             self.cond.append(factor.var[-1])
@@ -179,6 +433,7 @@ class Factor(object):
         for i in range(len(self.var)):
             self.pcard.append(reduce(lambda x, y: x*y, self.card[i:], 1))
         self.pcard.append(1)    # for compatibility
+        self.stride = self.pcard[1:]
 
         if len(cpd) > 0:
             if len(cpd) != self.pcard[0]:
@@ -186,6 +441,104 @@ class Factor(object):
                         "cpd cardinality doesn't match"
                 raise AttributeError(string)
 
+    def _get_cpd(self):
+        return self._cpd
+
+    def _set_cpd(self, cpd):
+        self._cpd = cpd
+        self.changed()
+
+    cpd = property(_get_cpd, _set_cpd)
+
+    def changed(self):
+        '''
+        drops cached results computed out of this factor, including results
+        of its descendants. Called automatically when cpd is assigned or
+        normalized; should be called after changing elements of cpd in
+        place.
+
+        Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> T = Factor(name='Test', values=["pos", "neg"], cond=[C],
+            ...             cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> T.uncond().cpd
+            [0.20700000000000002, 0.793]
+            >>> C.cpd[0], C.cpd[1] = 0.5, 0.5
+            >>> C.changed()
+            >>> T.uncond().cpd
+            [0.55, 0.45]
+        '''
+        self.memo.invalidate(self)
+
+    @staticmethod
+    def _query_key(query, evidence):
+        '''
+        returns hashable key of a query: set of query variables and either
+        set of observed (variable, number of value) pairs or set of
+        conditioning variables
+
+        Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> T = Factor(name='Test', values=["pos", "neg"], cond=[C],
+            ...             cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> Factor._query_key([C], {T: 'neg'})
+            (frozenset([Cancer]), True, frozenset([(Test, 1)]))
+
+        Arguments:
+            query
+                list of factors, which variables are queried
+            evidence
+                dict {factor: value} or list of factors (see query())
+        '''
+        query_ = frozenset(fact.var[-1] for fact in query or [])
+        if isinstance(evidence, dict):
+            evid = frozenset((fact.var[-1], fact.var[-1].find_value(val))
+                                for (fact, val) in evidence.iteritems())
+            return (query_, True, evid)
+        return (query_, False, frozenset(fact.var[-1]
+                                            for fact in evidence or []))
+
+    def ancestors(self):
+        '''
+        returns set of this factor and all its ancestors
+
+        Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> T = Factor(name='Test', values=["pos", "neg"], cond=[C],
+            ...             cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> sorted(T.ancestors(), key=lambda f: f.name)
+            [Cancer, Test]
+        '''
+        res = set([self])
+        stack = [self]
+        while stack:
+            for fact in stack.pop().parents:
+                if not fact in res:
+                    res.add(fact)
+                    stack.append(fact)
+        return res
+
+    @staticmethod
+    def _canonical(var):
+        '''
+        returns given variables as a list in canonical order - sorted by
+        Variable.ordinal
+
+        Syntax:
+            >>> C = Variable('Cancer', ['yes', 'no'])
+            >>> T = Variable('Test', ['pos', 'neg'])
+            >>> Factor._canonical(set([T, C]))
+            [Cancer, Test]
+
+        Arguments:
+            var
+                any iterable of variables
+        '''
+        return sorted(var, key=lambda v: v.ordinal)
+
     def _map(self, lst):
         '''
         bulds a map: hash table,
@@ -215,6 +568,65 @@ class Factor(object):
                     res[i] = j
         return res
 
+    def _strides(self, lst):
+        '''
+        returns list of THIS factor's strides for each variable of given
+        var list. Variables missing in this factor get zero stride.
+
+        Syntax:
+            >>> C = Factor(name='Cancer',
+            ...             values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> T = Factor(name='Test',
+            ...             values=["pos", "neg"], cond=[C],
+            ...             cpd=[0.2, 0.8, 0.9, 0.1])
+
+            >>> T.stride
+            [2, 1]
+            >>> T._strides([T.cons, C.cons])
+            [1, 2]
+            >>> C._strides(T.var)
+            [1, 0]
+
+        Arguments:
+            lst
+                list of variables
+        '''
+        res = []
+        for var in lst:
+            if var in self.var:
+                res.append(self.stride[self.var.index(var)])
+            else:
+                res.append(0)
+        return res
+
+    def _indices(self, strides):
+        '''
+        returns numbers of corresponding assignments of another factor for
+        all assignments of this factor in order, given the other factor's
+        strides along this factor's var list (see Factor._strides()).
+        Mappings are taken from Factor.plans.
+
+        Syntax:
+            >>> C = Factor(name='Cancer',
+            ...             values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> T = Factor(name='Test',
+            ...             values=["pos", "neg"], cond=[C],
+            ...             cpd=[0.2, 0.8, 0.9, 0.1])
+
+            >>> list(T._indices(C._strides(T.var)))
+            [0, 0, 1, 1]
+            >>> list(T._indices(T._strides([T.cons, C.cons])))
+            [0, 2, 1, 3]
+
+        Arguments:
+            strides
+                list of strides, one for each variable in this factor's var
+                list
+        '''
+        return Factor.plans.indices(self.card, strides)
+
     def _ass(self, number, mapping):
         '''
         given number of assignment, computes
@@ -366,18 +778,22 @@ class Factor(object):
 ##        print other.var, other.cond
 ##        print (set(self.var) | set(other.var)) - set(other.cond)
         res = Factor(name='Product',
-                    var=sorted(list((set(self.var) | set(other.var)) - set(other.cond)),
-                            cmp=lambda x, y: cmp(x.name, y.name)),
-                    cpd=[], cond=other.parents)
-        map_s = res._map(self.var)
-        map_o = res._map(other.var)
-        res.cpd = []
-        for i in range(res.pcard[0]):
-            res.cpd.append(0)
-        for i in range(res.pcard[0]):
-            self_ind = self._ass2index(res._ass(i, map_s))
-            other_ind = other._ass2index(res._ass(i, map_o))
-            res.cpd[i] = (self.cpd[self_ind] * other.cpd[other_ind])
+                    var=Factor._canonical(set(self.var) | set(other.var)),
+                    cpd=[])
+        res.cond = list(other.cond)
+        res.parents = list(other.parents)
+        if self.var == res.var:         # aligned scopes: no index mapping
+            self_ind = xrange(res.pcard[0])
+        else:
+            self_ind = res._indices(self._strides(res.var))
+        if other.var == res.var:
+            other_ind = xrange(res.pcard[0])
+        else:
+            other_ind = res._indices(other._strides(res.var))
+        self_cpd = self.cpd
+        other_cpd = other.cpd
+        res.cpd = [self_cpd[i] * other_cpd[j]
+                    for (i, j) in izip(self_ind, other_ind)]
         return res
 
     def marginal(self, var=None):
@@ -412,22 +828,23 @@ class Factor(object):
             raise AttributeError("Unable to marginalize: variable is missing")
 
         res = Factor('Marginal factor',
-                        var=sorted(list(set(self.var) - set([var])),
-                                        cmp=lambda x, y: cmp(x.name, y.name)),
+                        var=Factor._canonical(set(self.var) - set([var])),
                         cpd=[])
-        map_x = self._map(res.var)
-        for i in range(res.pcard[0]):
-            res.cpd.append(0)
-        for i in range(len(self.cpd)):
-            ind = res._ass2index(self._ass(i, map_x))
-            res.cpd[ind] += self.cpd[i]
+        cpd = [0] * res.pcard[0]
+        for (val, ind) in izip(self.cpd, self._indices(res._strides(self.var))):
+            cpd[ind] += val
+        res.cpd = cpd
         return res
 
-    def reduce(self, var=None, value=''):
+    def reduce(self, var=None, value='', evidence=None):
         '''
         computes a factor reduction
         F(A,B)/F(B) = F(A)
 
+        Several variables can be reduced at once by passing the whole
+        assignment as evidence dict. The result is normalized once, after
+        the reduction.
+
         Syntax:
             >>> C = Factor(name='Cancer',
             ...             values=["no", "yes"],
@@ -450,8 +867,23 @@ class Factor(object):
             [Cancer]
             >>> R.cpd
             [0.18181818181818182, 0.8181818181818181]
+            >>> R = T.reduce(evidence={C.cons: 'no', T.cons: 'neg'})
+            >>> R.var
+            []
+            >>> R.cpd
+            [1.0]
+
+        Arguments:
+            var
+                variable to reduce
+            value
+                value of the variable to keep
+            evidence
+                dict {variable: value}. If given, var and value are ignored.
         '''
-        return self._reduce2(var=var, value=value)._norm()
+        if evidence is None:
+            evidence = {var: value}
+        return self._reduce3(evidence)._norm()
 
     def _reduce1(self, var=None, value=''):
         '''
@@ -464,19 +896,60 @@ class Factor(object):
             raise AttributeError()
 
         res = Factor(name='Reduced',
-                        var=sorted(list(set(self.var) - set([var])),
-                                        cmp=lambda x, y: cmp(x.name, y.name)),
+                        var=Factor._canonical(set(self.var) - set([var])),
                         cpd=[])
-        map_x = self._map(res.var)
-        map_y = self._map([var])
-        for i in range(res.pcard[0]):
-            res.cpd.append(0)
-        for i in range(len(self.cpd)):
-            ass_x = self._ass(i, map_x)
-            ass_y = self._ass(i, map_y)
-            ind = res._ass2index(ass_x)
-            if ass_y[0] == value:
-                res.cpd[ind] = self.cpd[i]
+        cpd = [0] * res.pcard[0]
+        res_ind = self._indices(res._strides(self.var))
+        var_ind = self._indices([int(v == var) for v in self.var])
+        index = var.find_value(value)
+        for (val, ind, j) in izip(self.cpd, res_ind, var_ind):
+            if j == index:
+                cpd[ind] = val
+        res.cpd = cpd
+        return res
+
+    def _reduce3(self, evidence):
+        '''
+        reduces the factor on all variables of given assignment in a single
+        pass, visiting only entries consistent with the assignment.
+        Result is not normalized.
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cpd=[0.7, 0.3])
+            >>> C = Factor(name='C', values=[0, 1], cond=[A, B],
+            ...             cpd=[0.7, 0.3, 0.9, 0.1, 0.8, 0.2, 0.6, 0.4])
+            >>> R = C._reduce3({A.cons: 1, C.cons: 0})
+            >>> R.name
+            'Marginal factor'
+            >>> R.var
+            [B]
+            >>> R.cpd
+            [0.8, 0.6]
+
+        Arguments:
+            evidence
+                dict {variable: value}
+        '''
+        offset = 0
+        for (var, value) in evidence.iteritems():
+            if not var in self.var:
+                raise AttributeError()
+            index = var.find_value(value)
+            if index is None:
+                offset = None
+                break
+            offset += self.stride[self.var.index(var)] * index
+
+        res = Factor(name='Marginal factor',
+                        var=Factor._canonical(set(self.var) - set(evidence)),
+                        cpd=[])
+        if offset is None:              # value is not among var's values
+            res.cpd = [0.0] * res.pcard[0]
+            return res
+        cpd = self.cpd
+        res.cpd = [cpd[offset + i]
+                    for i in res._indices(self._strides(res.var))]
         return res
 
     def _reduce2(self, var=None, value=''):
@@ -492,15 +965,10 @@ class Factor(object):
         res = Factor(name='Reduced',
                         var=self.var,
                         cpd=[])
-        map_x = self._map(res.var)
-        map_y = self._map([var])
-        for i in range(res.pcard[0]):
-            res.cpd.append(0)
-        for i in range(len(self.cpd)):
-            ass_x = self._ass(i, map_x)
-            ass_y = self._ass(i, map_y)
-            ind = res._ass2index(ass_x)
-            res.cpd[ind] = self.cpd[i] * var.equal(ass_y[0], value)
+        index = var.find_value(value)
+        var_ind = self._indices([int(v == var) for v in self.var])
+        res.cpd = [val * float(j == index)
+                    for (val, j) in izip(self.cpd, var_ind)]
         return res.marginal(var)
 
     def __div__(self, other=None):
@@ -524,7 +992,7 @@ class Factor(object):
             0.2
 
         '''
-        t = list(set(other.var) - set(other.cond))
+        t = Factor._canonical(set(other.var) - set(other.cond))
         var = t[-1]
         if not var in self.var:
             raise AttributeError()
@@ -534,43 +1002,85 @@ class Factor(object):
 ##        print "Initial division"
 ##        print self
 
+        parents = sorted(set([other]) | set(self.parents),
+                            key=lambda f: f.var[-1].ordinal)
+        cond = [fact.var[-1] for fact in parents]
         res = Factor(name='Conditional',
-                        var=list(set(self.var) - set(t)),
-                        cond=list(set([other]) | set(self.parents)),
+                        var=Factor._canonical(set(self.var) | set(cond)),
                         cpd=[])
-
-        for i in range(res.pcard[0]):
-            res.cpd.append(0)
+        res.cond = cond
+        res.parents = parents
 
         temp = Factor(var=t)
-        for i in range(temp.pcard[0]):
-            temp.cpd.append(0)
+        temp_cpd = [0] * temp.pcard[0]
 
-        map_to_temp = self._map(temp.var)
-
-        for i in range(self.pcard[0]):
-            temp_ass = self._ass(i, map_to_temp)
-            temp_index = temp._ass2index(temp_ass)
-            temp.cpd[temp_index] += self.cpd[i]
+        for (val, k) in izip(self.cpd, self._indices(temp._strides(self.var))):
+            temp_cpd[k] += val
 
 ##        print "Temp factor"
 ##        print temp
 
-        map_to_res = self._map(res.var)
-        map_from_res = res._map(self.var)
-##        print map_to_res, map_from_res
-
-        for i in range(self.pcard[0]):
-            temp_ass = self._ass(i, map_to_temp)
-            temp_index = temp._ass2index(temp_ass)
-            res_ass = self._ass(i, map_to_res)
-            j = res._ass2index(res_ass)
-            res.cpd[j] = self.cpd[i] / temp.cpd[temp_index]
+        cpd = self.cpd
+        self_ind = res._indices(self._strides(res.var))
+        temp_ind = res._indices(temp._strides(res.var))
+        res.cpd = [cpd[i] / temp_cpd[k] for (i, k) in izip(self_ind, temp_ind)]
 
 ##        print "------------------------"
 
         return res
 
+    def permute(self, var):
+        '''
+        returns the same factor with variables reordered according to given
+        list. Conditions, parents and induced variable are kept.
+
+        Syntax:
+            >>> C = Factor(name='Cancer',
+            ...             values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> T = Factor(name='Test',
+            ...             values=["pos", "neg"], cond=[C],
+            ...             cpd=[0.2, 0.8, 0.9, 0.1])
+
+            >>> R = T.permute([T.cons, C.cons])
+            >>> R.var
+            [Test, Cancer]
+            >>> R.cpd
+            [0.2, 0.9, 0.8, 0.1]
+            >>> R.cond, R.cons
+            ([Cancer], Test)
+
+        Arguments:
+            var
+                list of the same variables as in this factor's var list,
+                in new order
+        '''
+        if sorted(var) != sorted(self.var):
+            raise AttributeError("Unable to permute: scope doesn't match")
+
+        res = Factor(name=self.name, var=list(var), cpd=[])
+        res.cons = self.cons
+        res.cond = list(self.cond)
+        res.parents = list(self.parents)
+        cpd = self.cpd
+        res.cpd = [cpd[i] for i in res._indices(self._strides(res.var))]
+        return res
+
+    def _copy(self):
+        '''
+        returns a copy of the factor, which can be changed without
+        affecting this one
+
+        Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> R = C._copy()
+            >>> R.cpd[0] = 0.5
+            >>> C.cpd
+            [0.99, 0.01]
+        '''
+        return self.permute(self.var)
+
     def __abs__(self):
         '''
         returns factor's cardinality: product of all variables' cardinalities
@@ -685,7 +1195,8 @@ class Factor(object):
             [0.20700000000000002, 0.793]
         '''
 
-        if self._uncond_cache:  return self._uncond_cache
+        cached = self.cached_uncond()
+        if cached is not None:  return cached
 
 ##        print "Computing unconditioned of", self.name
 ##        res = self.joint()
@@ -713,10 +1224,27 @@ class Factor(object):
                 res = res.marginal(fact.cons)
 
         if depth == -1:
-            self._uncond_cache = res
+            self.memo.put(('uncond', self), res, self.ancestors())
 
         return res
 
+    def cached_uncond(self):
+        '''
+        returns unconditioned distribution of this factor (see uncond()) if
+        it is cached and still valid, otherwise None
+
+        Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> T = Factor(name='Test', values=["pos", "neg"], cond=[C],
+            ...             cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> T.cached_uncond() is None
+            True
+            >>> T.uncond() is T.cached_uncond()
+            True
+        '''
+        return self.memo.get(('uncond', self))
+
     def _query1(self, query=None, evidence=None):
 
         if not query:  query = []
@@ -748,9 +1276,10 @@ class Factor(object):
 ##            print fact.name
             if not fact in evidence:
 ##                print "Product"
-                if fact._uncond_cache:
+                cached = fact.cached_uncond()
+                if cached is not None:
 ##                    print "From cache"
-                    res = res * fact._uncond_cache
+                    res = res * cached
                 else:
                     if depth == 0:
                         temp = Factor(name=fact.name+'_temp', var=[fact.cons])
@@ -784,7 +1313,7 @@ class Factor(object):
 
         return res
 
-    def query(self, query=None, evidence=None):
+    def query(self, query=None, evidence=None, cache=False):
         '''
         Syntax:
             >>> C = Factor(name='Cancer',
@@ -852,7 +1381,7 @@ class Factor(object):
             >>> R.name
             'Conditional'
             >>> R.var
-            [Test, Cancer]
+            [Cancer, Test]
             >>> R.cpd[0]
             0.9565217391304347
             >>> R.cond
@@ -866,13 +1395,42 @@ class Factor(object):
             []
             >>> R.cpd
             [0.99, 0.010000000000000002]
+            >>> R = T.query(query=[C], evidence={T: 'pos'}, cache=True)
+            >>> T.query(query=[C], evidence={T: 'pos'}, cache=True).cpd
+            [0.9565217391304348, 0.04347826086956522]
+
+        Arguments:
+            query
+                list of factors, which variables are queried
+            evidence
+                dict {factor: value} of observed values, or list of factors
+                to condition on
+            cache
+                if True, the result is looked up in and stored to Factor.memo.
+                Cached results are dropped when any factor they were computed
+                out of changes. Copies are returned, so cached results can't be
+                corrupted by callers.
         '''
 
+        if cache:
+            if evidence is None:
+                evidence = {}
+            key = ('query', self, Factor._query_key(query, evidence))
+            res = self.memo.get(key)
+            if res is None:
+                res = self.query(query, evidence)
+                if res is None:                 # evidence of unknown type
+                    return None
+                depends = self.ancestors()
+                for fact in list(query or []) + list(evidence or []):
+                    depends |= fact.ancestors()
+                self.memo.put(key, res, depends)
+            return res._copy()
+
         if isinstance(evidence, dict):
             res = self._query2(query, evidence.keys())
-            for (var, val) in evidence.iteritems():
-                res = res.reduce(var=var.var[-1], value=val)
-            return res
+            return res.reduce(evidence=dict((fact.var[-1], val)
+                                    for (fact, val) in evidence.iteritems()))
         elif isinstance(evidence, list):
             return self._query2(query, evidence)
 
@@ -906,8 +1464,10 @@ class Factor(object):
         '''
         sum_ = self.sum()
         if sum_ != 0:
-            for i in range(len(self.cpd)):
-                self.cpd[i] = self.cpd[i] / sum_
+            cpd = self.cpd
+            for i in range(len(cpd)):
+                cpd[i] = cpd[i] / sum_
+            self.changed()
         return self
 
 
@@ -1020,6 +1580,22 @@ class TestFactor(unittest.TestCase):
         self.assertEqual(1, len(M.var))
         self.assertEqual('Test', M.var[0].name)
 
+    def testreduce_evidence(self):
+        A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+        B = Factor(name='B', values=[0, 1], cpd=[0.7, 0.3])
+        C = Factor(name='C', values=[0, 1], cond=[A, B],
+                    cpd=[0.7, 0.3, 0.9, 0.1, 0.8, 0.2, 0.6, 0.4])
+        J = C*A*B
+        M = J.reduce(evidence={A.cons: 1, C.cons: 0})
+        R = J.reduce(var=A.cons, value=1).reduce(var=C.cons, value=0)
+        self.assertEqual(1, len(M.var))
+        self.assertEqual('B', M.var[0].name)
+        for (x, y) in zip(R.cpd, M.cpd):
+            self.assertAlmostEqual(x, y)
+
+        M = J.reduce(evidence={A.cons: 2})
+        self.assertEqual([0.0] * 4, M.cpd)
+
     def test__div__(self):
         M = (self.T*self.C)/self.C
         self.assertEqual(4, len(M.cpd))
@@ -1031,6 +1607,40 @@ class TestFactor(unittest.TestCase):
         self.assertEqual('Cancer', M.var[0].name)
         self.assertEqual('Test', M.var[1].name)
 
+    def testcanonical_order(self):
+        A = Factor(name='Z', values=[0, 1], cpd=[0.6, 0.4])
+        B = Factor(name='Y', values=[0, 1], cond=[A], cpd=[0.7, 0.3, 0.2, 0.8])
+        C = Factor(name='X', values=[0, 1], cond=[B], cpd=[0.1, 0.9, 0.5, 0.5])
+        for P in (A*B*C, C*B*A, (C*A)*B):
+            self.assertEqual([A.cons, B.cons, C.cons], P.var)
+        self.assertEqual([A.cons, C.cons], (A*B*C).marginal(B.cons).var)
+
+    def testpermute(self):
+        P = (self.T*self.C).permute([self.T.cons, self.C.cons])
+        self.assertEqual('Test', P.var[0].name)
+        self.assertEqual('Cancer', P.var[1].name)
+        self.assertAlmostEqual(0.198, P.cpd[0])
+        self.assertAlmostEqual(0.009, P.cpd[1])
+        self.assertAlmostEqual(0.792, P.cpd[2])
+        self.assertRaises(AttributeError, self.T.permute, [self.T.cons])
+
+    def testplans(self):
+        plans = Factor.plans
+        Factor.plans = PlanCache(capacity=6)
+        try:
+            P = self.T.permute([self.T.cons, self.C.cons])
+            misses = Factor.plans.misses
+            Q = self.T.permute([self.T.cons, self.C.cons])
+            self.assertEqual(P.cpd, Q.cpd)
+            self.assertEqual(misses, Factor.plans.misses)
+            self.assertTrue(Factor.plans.hits > 0)
+            A = Factor(name='A', values=[0, 1, 2], cond=[self.C],
+                        cpd=[0.2, 0.3, 0.5, 0.1, 0.1, 0.8])
+            A.permute([A.cons, self.C.cons])
+            self.assertTrue(Factor.plans.stored <= 6)
+        finally:
+            Factor.plans = plans
+
     def test__abs__(self):
         self.assertEqual(2, abs(self.C))
         self.assertEqual(4, abs(self.T))
@@ -1073,6 +1683,73 @@ class TestFactor(unittest.TestCase):
         self.assertEqual(1, len(M.var))
         self.assertEqual('G', M.var[0].name)
 
+    def testuncond_invalidation(self):
+        memo = Factor.memo
+        Factor.memo = MemoCache(capacity=4)
+        try:
+            A = Factor(name='A', values=[0, 1], cpd=[0.2, 0.8])
+            B = Factor(name='B', values=[0, 1], cond=[A],
+                        cpd=[0.6, 0.4, 0.3, 0.7])
+            C = Factor(name='C', values=[0, 1], cond=[B],
+                        cpd=[0.6, 0.4, 0.3, 0.7])
+            self.assertAlmostEqual(0.408, C.uncond().cpd[0])
+            self.assertTrue(C.cached_uncond() is not None)
+            self.assertTrue(Factor.memo.stored <= 4)
+            A.cpd[0], A.cpd[1] = 3.0, 1.0
+            A._norm()                   # normalizing in place invalidates
+            self.assertTrue(C.cached_uncond() is None)
+            self.assertAlmostEqual(0.4575, C.uncond().cpd[0])
+            B.cpd = [1.0, 0.0, 1.0, 0.0]
+            self.assertAlmostEqual(0.6, C.uncond().cpd[0])
+            self.assertEqual(B.uncond().cpd, B.cached_uncond().cpd)
+        finally:
+            Factor.memo = memo
+
+    def testquery_cache(self):
+        memo = Factor.memo
+        Factor.memo = MemoCache()
+        try:
+            M = self.T.query([self.C], {self.T: 'pos'}, cache=True)
+            M.cpd[0] = 0.0
+            N = self.T.query([self.C], {self.T: 'pos'}, cache=True)
+            self.assertEqual(1, Factor.memo.hits)
+            self.assertAlmostEqual(0.9565217, N.cpd[0])
+            self.C.cpd = [0.5, 0.5]
+            N = self.T.query([self.C], {self.T: 'pos'}, cache=True)
+            self.assertEqual(1, Factor.memo.hits)
+            self.assertAlmostEqual(0.1818182, N.cpd[0])
+        finally:
+            Factor.memo = memo
+
+    def testquery_cache_no_evidence(self):
+        memo = Factor.memo
+        Factor.memo = MemoCache()
+        try:
+            M = self.T.query([self.C], cache=True)
+            self.assertEqual([self.C.var[-1]], M.var)
+            self.assertAlmostEqual(0.99, M.cpd[0])
+            N = self.T.query([self.C], {}, cache=True)
+            self.assertEqual(1, Factor.memo.hits)
+            self.assertEqual(list(M.cpd), list(N.cpd))
+        finally:
+            Factor.memo = memo
+
+    def testquery_cache_arrayfactor(self):
+        from pypgm.arrayfactor import ArrayFactor
+        memo = Factor.memo
+        Factor.memo = MemoCache()
+        try:
+            C = ArrayFactor.from_factor(self.C)
+            T = ArrayFactor.from_factor(self.T)
+            T.parents = [C]
+            M = T.query([C], {T: 'pos'}, cache=True)
+            M.cpd[0] = 5.0
+            N = T.query([C], {T: 'pos'}, cache=True)
+            self.assertEqual(1, Factor.memo.hits)
+            self.assertAlmostEqual(0.9565217, N.cpd[0])
+        finally:
+            Factor.memo = memo
+
     def testquery(self):
         M = self.T.query(query=[self.C], evidence={self.T: 'pos'})
         self.assertEqual(2, len(M.cpd))
@@ -1091,12 +1768,17 @@ class TestFactor(unittest.TestCase):
         M = self.T.query(query=[self.C], evidence=[self.T])
         self.assertEqual(4, len(M.cpd))
         self.assertAlmostEqual(0.9565217391304348, M.cpd[0])
-        self.assertAlmostEqual(0.04347826086956522, M.cpd[1])
-        self.assertAlmostEqual(0.9987389659520807, M.cpd[2])
+        self.assertAlmostEqual(0.9987389659520807, M.cpd[1])
+        self.assertAlmostEqual(0.04347826086956522, M.cpd[2])
         self.assertAlmostEqual(0.0012610340479192938, M.cpd[3])
         self.assertEqual(2, len(M.var))
-        self.assertEqual('Test', M.var[0].name)
-        self.assertEqual('Cancer', M.var[1].name)
+        self.assertEqual('Cancer', M.var[0].name)
+        self.assertEqual('Test', M.var[1].name)
+
+        D = (self.C*self.T)/self.T
+        E = (self.T*self.C)/self.T
+        self.assertEqual(D.var, E.var)
+        self.assertEqual(D.cpd, E.cpd)
 
     def test_norm(self):
         M = self.T._norm()
@@ -0,0 +1,611 @@
+'''
+    Junction tree (clique tree) - compiled form of a set of factors for
+    repeated exact queries. The interaction graph of the factors is
+    triangulated along an elimination order, maximal cliques are connected
+    into a tree by maximum-weight spanning tree over separator sizes, and the
+    tree is calibrated by Shafer-Shenoy message passing. After calibration
+    every clique holds its belief and single-variable posteriors are read
+    from these beliefs.
+
+    Evidence can be added, changed and retracted on a calibrated tree. Only
+    messages directed away from the cliques holding changed variables are
+    invalidated, and they are recomputed lazily, when a belief needs them.
+'''
+
+import unittest
+from pypgm.factor import Factor
+from pypgm.elimination import VariableElimination
+
+
+class JunctionTree(object):
+    '''
+    Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> T = Factor(name='Test', values=["pos", "neg"],
+            ...             cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> JT = JunctionTree([C, T])
+            >>> JT.cliques
+            [[Cancer, Test]]
+            >>> JT.query(query=[C], evidence={T: 'pos'}).cpd
+            [0.9565217391304347, 0.043478260869565216]
+
+    Fields:
+        factors
+            list of factors the tree is compiled from
+        cliques
+            list of cliques - lists of variables in canonical order
+        neighbours
+            dict {clique number: list of adjacent clique numbers}
+        assignment
+            dict {clique number: list of factors multiplied into the clique}
+        evidence
+            dict {variable: value} of currently entered evidence
+        touched
+            set of numbers of cliques, which potentials, outgoing messages or
+            beliefs were recomputed since evidence was last set or updated
+    '''
+
+    def __init__(self, factors=None, order='min-fill'):
+        '''
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> C = Factor(name='C', values=[0, 1], cond=[B],
+            ...             cpd=[0.1, 0.9, 0.5, 0.5])
+            >>> JT = JunctionTree([A, B, C])
+            >>> JT.cliques
+            [[A, B], [B, C]]
+            >>> JT.neighbours
+            {0: [1], 1: [0]}
+
+        Arguments:
+            factors
+                list of factors, for ex. Bayesian.factors
+            order
+                elimination heuristic used for triangulation (see
+                VariableElimination.order), or list of variables in
+                elimination order; variables missing from it are eliminated
+                after them in min-fill order
+        '''
+        if not factors:
+            factors = []
+
+        self.factors = factors
+        self.cliques = []
+        self.neighbours = {}
+        self.assignment = {}
+        self.evidence = {}
+        self.touched = set()
+        self._home = {}             # variable -> smallest clique with it
+        self._potentials = {}
+        self._messages = {}
+        self._beliefs = {}
+        self._marginals = {}
+
+        self._triangulate(order)
+        self._connect()
+        self._assign()
+
+    def _triangulate(self, order):
+        '''
+        eliminates all variables of the interaction graph in given order,
+        collecting maximal cliques of the triangulated graph
+        '''
+        variables = Factor._canonical(set(v for fact in self.factors
+                                            for v in fact.var))
+        order = VariableElimination()._elimination_order(self.factors,
+                                                            variables, order)
+
+        graph = dict((var, set()) for var in variables)
+        for fact in self.factors:
+            for var in fact.var:
+                graph[var].update(fact.var)
+        for var in graph:
+            graph[var].discard(var)
+
+        cliques = []
+        for var in order:
+            neighbours = graph.pop(var)
+            clique = set([var]) | neighbours
+            if not [c for c in cliques if clique <= c]:
+                cliques.append(clique)
+            for u in neighbours:
+                graph[u].discard(var)
+                graph[u].update(neighbours - set([u]))
+        self.cliques = [Factor._canonical(c) for c in cliques]
+
+    def _sepset(self, i, j):
+        '''
+        returns variables shared by two cliques in canonical order
+        '''
+        return [v for v in self.cliques[i] if v in self.cliques[j]]
+
+    def _connect(self):
+        '''
+        connects cliques into a tree by maximum-weight spanning tree
+        (Kruskal), where weight of an edge is size of the separator
+        '''
+        n = len(self.cliques)
+        edges = []
+        for i in range(n):
+            for j in range(i+1, n):
+                edges.append((-len(self._sepset(i, j)), i, j))
+        edges.sort()
+
+        root = range(n)
+        def find(i):
+            while root[i] != i:
+                root[i] = root[root[i]]
+                i = root[i]
+            return i
+
+        self.neighbours = dict((i, []) for i in range(n))
+        for (weight, i, j) in edges:
+            (a, b) = (find(i), find(j))
+            if a != b:
+                root[a] = b
+                self.neighbours[i].append(j)
+                self.neighbours[j].append(i)
+        for i in self.neighbours:
+            self.neighbours[i].sort()
+
+    def _assign(self):
+        '''
+        assigns every factor and every variable to the smallest clique
+        covering it
+        '''
+        order = sorted(range(len(self.cliques)),
+                        key=lambda i: (len(self.cliques[i]), i))
+        self.assignment = dict((i, []) for i in range(len(self.cliques)))
+        for fact in self.factors:
+            for i in order:
+                if set(fact.var) <= set(self.cliques[i]):
+                    self.assignment[i].append(fact)
+                    break
+        for i in reversed(order):
+            for var in self.cliques[i]:
+                self._home[var] = i
+
+    def _potential(self, i):
+        '''
+        returns initial potential of the clique: product of its factors and
+        evidence indicators of its variables
+        '''
+        if i in self._potentials:
+            return self._potentials[i]
+
+        self.touched.add(i)
+        res = None
+        for fact in self.assignment[i]:
+            res = fact * res
+        for (var, value) in sorted(self.evidence.items(),
+                                    key=lambda item: item[0].ordinal):
+            if self._home[var] == i:
+                index = var.find_value(value)
+                res = Factor(name='Evidence', var=[var],
+                            cpd=[float(j == index) for j in range(var.card)]) * res
+        if res is None or len(res.var) < len(self.cliques[i]):
+            res = Factor(name='Clique', var=self.cliques[i],
+                            cpd=[1.0] * reduce(lambda x, y: x*y,
+                                        [v.card for v in self.cliques[i]], 1)) * res
+        self._potentials[i] = res
+        return res
+
+    def _message(self, i, j):
+        '''
+        returns Shafer-Shenoy message from clique i to adjacent clique j.
+        Messages from the other neighbours of i should be computed first.
+        '''
+        if (i, j) in self._messages:
+            return self._messages[(i, j)]
+
+        self.touched.add(i)
+        res = self._potential(i)
+        for k in self.neighbours[i]:
+            if k != j:
+                res = self._messages[(k, i)] * res
+        sepset = self._sepset(i, j)
+        for var in self.cliques[i]:
+            if not var in sepset:
+                res = res.marginal(var)
+        self._messages[(i, j)] = res
+        return res
+
+    def _schedule(self, root=0, collect=True, distribute=True):
+        '''
+        returns list of directed edges (i, j) of the tree component of the
+        root, ordered so that every message is preceded by the messages it
+        depends on: first towards the root (collect), then away from it
+        (distribute)
+        '''
+        visited = set([root])
+        queue = [root]
+        down = []
+        for i in queue:
+            for j in self.neighbours[i]:
+                if not j in visited:
+                    visited.add(j)
+                    queue.append(j)
+                    down.append((i, j))
+        res = []
+        if collect:
+            res += [(j, i) for (i, j) in reversed(down)]
+        if distribute:
+            res += down
+        return res
+
+    def calibrate(self):
+        '''
+        computes all messages and beliefs of all cliques
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> JT = JunctionTree([A, B])
+            >>> JT.calibrate()
+            >>> JT.belief(0).cpd
+            [0.42, 0.18, 0.08000000000000002, 0.32000000000000006]
+        '''
+        visited = set()
+        for i in range(len(self.cliques)):
+            if i in visited:
+                continue
+            visited.add(i)
+            for (k, j) in self._schedule(i):
+                self._message(k, j)
+                visited.add(j)
+        for i in range(len(self.cliques)):
+            self.belief(i)
+
+    def belief(self, i):
+        '''
+        returns belief of the clique: its potential multiplied by all
+        incoming messages. The belief is proportional to the joint
+        distribution of the clique's variables and the evidence.
+
+        Arguments:
+            i
+                number of the clique
+        '''
+        if i in self._beliefs:
+            return self._beliefs[i]
+
+        self.touched.add(i)
+        for (k, j) in self._schedule(i, distribute=False):
+            self._message(k, j)
+        res = self._potential(i)
+        for k in self.neighbours[i]:
+            res = self._messages[(k, i)] * res
+        self._beliefs[i] = res
+        return res
+
+    def _invalidate(self, var):
+        '''
+        drops everything, that depends on evidence of the variable: the
+        potential of its clique, messages directed away from this clique,
+        beliefs and cached posteriors in the clique's tree component
+        '''
+        home = self._home[var]
+        self._potentials.pop(home, None)
+        self._beliefs.pop(home, None)
+        component = set([home])
+        for (i, j) in self._schedule(home, collect=False):
+            self._messages.pop((i, j), None)
+            self._beliefs.pop(j, None)
+            component.add(j)
+        for i in component:
+            for v in self.cliques[i]:
+                self._marginals.pop(v, None)
+
+    def _change(self, observed):
+        '''
+        applies given {variable: value} changes of evidence, value None
+        retracts the variable. Returns list of actually changed variables.
+        Raises AttributeError, if a variable is not in the tree.
+        '''
+        for var in observed:
+            if not var in self._home:
+                raise AttributeError("Unable to query: variable is not in " +
+                                        "the tree: " + var.name)
+        self.touched = set()
+        changed = []
+        for (var, value) in observed.iteritems():
+            if value is None:
+                if var in self.evidence:
+                    del self.evidence[var]
+                    changed.append(var)
+            elif not var in self.evidence or self.evidence[var] != value:
+                self.evidence[var] = value
+                changed.append(var)
+        for var in changed:
+            self._invalidate(var)
+        return Factor._canonical(changed)
+
+    def set_evidence(self, evidence=None):
+        '''
+        replaces entered evidence. Only variables, which value differs from
+        the current evidence, invalidate messages.
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> JT = JunctionTree([A, B])
+            >>> JT.set_evidence({B: 1})
+            [B]
+            >>> JT.evidence
+            {B: 1}
+            >>> JT.set_evidence({A: 0, B: 1})
+            [A]
+
+        Arguments:
+            evidence
+                dict {factor: value}
+
+        Returns list of changed variables.
+        '''
+        if not evidence:
+            evidence = {}
+
+        observed = dict((fact.var[-1], value)
+                            for (fact, value) in evidence.iteritems())
+        for var in self.evidence:
+            if not var in observed:
+                observed[var] = None
+        return self._change(observed)
+
+    def update_evidence(self, evidence=None):
+        '''
+        adds or changes values of given evidence, keeping other entered
+        evidence. Value None retracts the variable. Messages are recomputed
+        lazily: a following query recomputes only messages on the path from
+        changed cliques to the queried one (see JunctionTree.touched).
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> C = Factor(name='C', values=[0, 1], cond=[B],
+            ...             cpd=[0.1, 0.9, 0.5, 0.5])
+            >>> JT = JunctionTree([A, B, C])
+            >>> JT.calibrate()
+            >>> JT.update_evidence({A: 1})
+            [A]
+            >>> JT.query([B]).cpd
+            [0.2, 0.8]
+            >>> sorted(JT.touched)
+            [0]
+            >>> JT.update_evidence({A: None, C: 0})
+            [A, C]
+
+        Arguments:
+            evidence
+                dict {factor: value}
+
+        Returns list of changed variables.
+        '''
+        if not evidence:
+            evidence = {}
+
+        return self._change(dict((fact.var[-1], value)
+                                    for (fact, value) in evidence.iteritems()))
+
+    def retract_evidence(self, factors=None):
+        '''
+        removes evidence on variables of given factors
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> JT = JunctionTree([A, B])
+            >>> JT.set_evidence({A: 0, B: 1})
+            [A, B]
+            >>> JT.retract_evidence([A])
+            [A]
+            >>> JT.evidence
+            {B: 1}
+
+        Arguments:
+            factors
+                list of factors
+
+        Returns list of changed variables.
+        '''
+        if not factors:
+            factors = []
+
+        return self._change(dict((fact.var[-1], None) for fact in factors))
+
+    def query(self, query=None, evidence=None):
+        '''
+        computes distribution of query variables given evidence out of the
+        belief of a clique containing them all. Posteriors of single
+        variables are cached until the evidence changes.
+
+        Syntax:
+            >>> D = Factor(name='Difficulty', values=[0, 1], cpd=[0.6, 0.4])
+            >>> I = Factor(name='Intelligence', values=[0, 1],
+            ...             cpd=[0.7, 0.3])
+            >>> G = Factor(name='Grade', values=[1, 2, 3],
+            ...             cond=[D, I], cpd=[0.3, 0.4, 0.3,
+            ...                             0.05, 0.25, 0.7,
+            ...                             0.9, 0.08, 0.02,
+            ...                             0.5, 0.3, 0.2])
+            >>> JT = JunctionTree([D, I, G])
+            >>> R = JT.query(query=[I], evidence={G: 3, D: 1})
+            >>> R.name, R.var
+            ('Marginal factor', [Intelligence])
+            >>> R.cpd
+            [0.18918918918918917, 0.8108108108108107]
+
+        Arguments:
+            query
+                list of factors, which variables are queried. All of them
+                should be in one clique.
+            evidence
+                dict {factor: value}. If None, currently entered evidence is
+                used.
+        '''
+        if not query: query = []
+
+        if evidence is not None:
+            self.set_evidence(evidence)
+
+        query_ = [fact.var[-1] for fact in query]
+        if len(query_) == 1 and query_[0] in self._marginals:
+            return self._marginals[query_[0]].permute(query_)
+
+        cliques = [i for i in range(len(self.cliques))
+                        if set(query_) <= set(self.cliques[i])]
+        if not cliques:
+            raise AttributeError("Unable to query: variables are not " +
+                                    "in one clique")
+        i = min(cliques, key=lambda i: len(self.cliques[i]))
+
+        res = self.belief(i)
+        for var in self.cliques[i]:
+            if not var in query_:
+                res = res.marginal(var)
+        res = res.permute(res.var)._norm()
+        res.name = 'Marginal factor'
+        res.cond = []
+        res.parents = []
+        if len(query_) == 1:
+            self._marginals[query_[0]] = res
+            return res.permute(query_)
+        return res
+
+
+class TestJunctionTree(unittest.TestCase):
+
+    def setUp(self):
+        self.D = Factor(name='Difficulty', values=[0, 1], cpd=[0.6, 0.4])
+        self.I = Factor(name='Intelligence', values=['low', 'high'],
+                        cpd=[0.7, 0.3])
+        self.G = Factor(name='Grade|I,D', values=[1, 2, 3],
+                        cond=[self.D, self.I], cpd=[0.3, 0.4, 0.3,
+                                                0.05, 0.25, 0.7,
+                                                0.9, 0.08, 0.02,
+                                                0.5, 0.3, 0.2])
+        self.S = Factor(name='SAT|I', values=[0, 1], cond=[self.I],
+                        cpd=[0.95, 0.05, 0.2, 0.8])
+        self.L = Factor(name='Letter|G', values=[0, 1], cond=[self.G],
+                        cpd=[0.1, 0.9, 0.4, 0.6, 0.99, 0.01])
+        self.factors = [self.D, self.I, self.S, self.G, self.L]
+
+    def tearDown(self):
+        pass
+
+    def _compare(self, factors, evidence):
+        VE = VariableElimination(factors)
+        JT = JunctionTree(factors)
+        JT.set_evidence(evidence)
+        JT.calibrate()
+        for fact in factors:
+            expected = VE.query([fact], evidence)
+            res = JT.query([fact])
+            self.assertEqual(expected.var, res.var)
+            for (x, y) in zip(expected.cpd, res.cpd):
+                self.assertAlmostEqual(x, y)
+
+    def test_cliques(self):
+        JT = JunctionTree(self.factors)
+        for fact in self.factors:
+            self.assertTrue([c for c in JT.cliques if set(fact.var) <= set(c)])
+        edges = sum(len(n) for n in JT.neighbours.values()) / 2
+        self.assertEqual(len(JT.cliques) - 1, edges)
+
+    def testpartial_order(self):
+        VE = VariableElimination(self.factors)
+        for order in ([], [self.L.var[-1], self.D.var[-1]]):
+            JT = JunctionTree(self.factors, order)
+            self.assertTrue(len(JT.cliques) > 1)
+            JT.set_evidence({self.L: 0})
+            JT.calibrate()
+            for fact in self.factors:
+                for (x, y) in zip(VE.query([fact], {self.L: 0}).cpd,
+                                    JT.query([fact]).cpd):
+                    self.assertAlmostEqual(x, y)
+
+    def testquery(self):
+        self._compare(self.factors, {})
+        self._compare(self.factors, {self.G: 3, self.D: 1})
+        self._compare(self.factors, {self.L: 0, self.S: 1})
+
+    def testquery_loop(self):
+        A = Factor(name='A', values=[0, 1], cpd=[0.3, 0.7])
+        B = Factor(name='B', values=[0, 1], cond=[A], cpd=[0.6, 0.4, 0.1, 0.9])
+        C = Factor(name='C', values=[0, 1], cond=[A], cpd=[0.2, 0.8, 0.7, 0.3])
+        D = Factor(name='D', values=[0, 1], cond=[B, C],
+                    cpd=[0.9, 0.1, 0.5, 0.5, 0.4, 0.6, 0.05, 0.95])
+        E = Factor(name='E', values=[0, 1], cond=[D], cpd=[0.3, 0.7, 0.8, 0.2])
+        self._compare([A, B, C, D, E], {})
+        self._compare([A, B, C, D, E], {E: 0})
+        self._compare([A, B, C, D, E], {D: 1, A: 0})
+
+    def testquery_clique(self):
+        JT = JunctionTree(self.factors)
+        R = JT.query([self.G, self.L], {self.D: 0})
+        expected = VariableElimination(self.factors).query(
+                                        [self.G, self.L], {self.D: 0})
+        for (x, y) in zip(expected.cpd, R.cpd):
+            self.assertAlmostEqual(x, y)
+        self.assertRaises(AttributeError, JT.query, [self.D, self.L])
+
+    def testupdate_evidence(self):
+        chain = [Factor(name='X0', values=[0, 1], cpd=[0.3, 0.7])]
+        for k in range(1, 10):
+            chain.append(Factor(name='X%d' % k, values=[0, 1],
+                                cond=[chain[-1]], cpd=[0.8, 0.2, 0.3, 0.7]))
+        JT = JunctionTree(chain)
+        JT.calibrate()
+        self.assertEqual(len(JT.cliques), len(JT.touched))
+
+        VE = VariableElimination(chain)
+        JT.update_evidence({chain[0]: 1})
+        res = JT.query([chain[2]])
+        self.assertTrue(len(JT.touched) <= 3)
+        for (x, y) in zip(VE.query([chain[2]], {chain[0]: 1}).cpd, res.cpd):
+            self.assertAlmostEqual(x, y)
+
+        JT.update_evidence({chain[9]: 0})
+        res = JT.query([chain[2]])
+        for (x, y) in zip(VE.query([chain[2]], {chain[0]: 1, chain[9]: 0}).cpd,
+                            res.cpd):
+            self.assertAlmostEqual(x, y)
+
+        JT.retract_evidence([chain[0]])
+        JT.calibrate()
+        for fact in chain:
+            expected = VE.query([fact], {chain[9]: 0})
+            for (x, y) in zip(expected.cpd, JT.query([fact]).cpd):
+                self.assertAlmostEqual(x, y)
+
+        self.assertEqual([], JT.update_evidence({chain[9]: 0}))
+        self.assertEqual(set(), JT.touched)
+
+    def testunknown_evidence(self):
+        X = Factor(name='X', values=[0, 1], cpd=[0.5, 0.5])
+        JT = JunctionTree(self.factors)
+        JT.set_evidence({self.G: 2})
+        self.assertRaises(AttributeError, JT.query, [self.I], {X: 0})
+        self.assertRaises(AttributeError, JT.update_evidence,
+                            {self.L: 1, X: 0})
+        self.assertRaises(AttributeError, JT.retract_evidence, [X])
+        self.assertEqual({self.G.var[-1]: 2}, JT.evidence)
+
+    def testquery_copy(self):
+        JT = JunctionTree(self.factors)
+        R = JT.query([self.I])
+        R.cpd[0] = 5.0
+        self.assertAlmostEqual(0.7, JT.query([self.I]).cpd[0])
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=False)
+##    doctest.testmod(verbose=True)
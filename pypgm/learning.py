@@ -0,0 +1,920 @@
+'''
+    Parameter learning: CPDs of factors with known structure are estimated
+    from data. Data are read in chunks (dicts {variable name: column}), so
+    memory used does not depend on the number of records. Values in columns
+    are mapped to value numbers through Variable.value, and counts of
+    factors' assignments are accumulated by numpy bincount.
+'''
+
+import unittest
+import csv
+import os
+import tempfile
+from itertools import islice
+import numpy as np
+from pypgm.factor import Factor
+from pypgm.batch import encode, BatchElimination
+from pypgm.junction import JunctionTree
+
+
+def read_csv(source, chunk=100000, delimiter=','):
+    '''
+    reads CSV file with header line in chunks. Yields dicts
+    {column name: ndarray of strings}.
+
+    Syntax:
+        >>> from StringIO import StringIO
+        >>> data = StringIO("A,B\\nyes,1\\nno,0\\nno,1\\n")
+        >>> for part in read_csv(data, chunk=2):
+        ...     print part['A'], part['B']
+        ['yes' 'no'] ['1' '0']
+        ['no'] ['1']
+
+    Arguments:
+        source
+            file name or file object
+        chunk
+            number of rows in a chunk
+        delimiter
+            delimiter of CSV fields
+    '''
+    stream = open(source, 'rb') if isinstance(source, basestring) else source
+    try:
+        reader = csv.reader(stream, delimiter=delimiter)
+        header = [name.strip() for name in next(reader, [])]
+        while True:
+            rows = list(islice(reader, chunk))
+            if not rows:
+                break
+            columns = zip(*rows)
+            yield dict((name, np.array(col))
+                        for (name, col) in zip(header, columns))
+    finally:
+        if stream is not source:
+            stream.close()
+
+
+def _chunks(source, chunk):
+    '''
+    returns iterable of data chunks: CSV file is read by read_csv(), dicts
+    of columns are taken as one chunk, other iterables are returned as is
+    '''
+    if isinstance(source, basestring) or hasattr(source, 'read'):
+        return read_csv(source, chunk)
+    if isinstance(source, dict):
+        return [source]
+    return source
+
+
+def _column(data, var):
+    try:
+        return data[var.name]
+    except KeyError:
+        raise AttributeError("Column is missing: " + var.name)
+
+
+def _missing(column):
+    '''
+    returns boolean mask of missing values in the column: empty strings,
+    None and NaN
+    '''
+    if column.dtype.kind == 'f':
+        return np.isnan(column)
+    if column.dtype.kind in 'SU':
+        return column == ''
+    if column.dtype.kind == 'O':
+        return np.array([val is None or val == '' or val != val
+                            for val in column], dtype=bool)
+    return np.zeros(len(column), dtype=bool)
+
+
+def _assignments(factors, data):
+    '''
+    returns number of records in the chunk of data and list of ndarrays:
+    numbers of assignments of factors' scopes (positions in Factor.cpd)
+    in every record
+    '''
+    codes = {}
+    n = 0
+    flats = []
+    for fact in factors:
+        flat = 0
+        for (var, stride) in zip(fact.var, fact.stride):
+            if not var in codes:
+                codes[var] = encode(var, _column(data, var))
+            flat = flat + codes[var] * stride
+            n = len(codes[var])
+        flats.append(flat)
+    return (n, flats)
+
+
+class MaximumLikelihood(object):
+    '''
+    Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"])
+            >>> T = Factor(name='Test', values=["pos", "neg"], cond=[C])
+            >>> ML = MaximumLikelihood([C, T])
+            >>> F = ML.fit({'Cancer': ['no', 'no', 'yes', 'no'],
+            ...             'Test': ['neg', 'pos', 'pos', 'neg']})
+            >>> C.cpd, T.cpd
+            ([0.75, 0.25], [0.3333333333333333, 0.6666666666666666, 1.0, 0.0])
+
+    Fields:
+        factors
+            list of factors, which CPDs are learned
+        laplace
+            pseudocount added to every count (Laplace smoothing)
+        counts
+            list of ndarrays of shape Factor.card: counts of assignments
+            of factors' variables
+        records
+            number of records counted
+    '''
+
+    def __init__(self, factors=None, laplace=0.0):
+        '''
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1])
+            >>> ML = MaximumLikelihood([A], laplace=1)
+            >>> ML.counts, ML.records
+            ([array([0., 0.])], 0)
+
+        Arguments:
+            factors
+                list of factors, for ex. Bayesian.factors
+            laplace
+                pseudocount added to every count
+        '''
+        if not factors:
+            factors = []
+
+        self.factors = factors
+        self.laplace = laplace
+        self.counts = [np.zeros(fact.card) for fact in factors]
+        self.records = 0
+
+    def count(self, data):
+        '''
+        adds counts of a chunk of data
+
+        Syntax:
+            >>> A = Factor(name='A', values=['a', 'b', 'c'])
+            >>> ML = MaximumLikelihood([A])
+            >>> ML.count({'A': ['c', 'a', 'c']})
+            >>> ML.counts[0], ML.records
+            (array([1., 0., 2.]), 3)
+
+        Arguments:
+            data
+                dict {variable name: sequence of values}
+        '''
+        (n, flats) = _assignments(self.factors, data)
+        for (counts, flat) in zip(self.counts, flats):
+            counts += np.bincount(flat, minlength=counts.size
+                                    ).reshape(counts.shape)
+        self.records += n
+
+    def estimate(self):
+        '''
+        sets CPDs of factors to smoothed relative frequencies of counts.
+        Distributions given unseen parents' values are uniform. Returns
+        factors.
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1])
+            >>> ML = MaximumLikelihood([A], laplace=1)
+            >>> ML.count({'A': [1, 1]})
+            >>> ML.estimate()[0].cpd
+            [0.25, 0.75]
+        '''
+        for (fact, counts) in zip(self.factors, self.counts):
+            table = (counts + self.laplace).reshape(-1, fact.card[-1])
+            sums = table.sum(axis=1, keepdims=True)
+            table = np.where(sums > 0, table / np.where(sums > 0, sums, 1),
+                                1.0 / fact.card[-1])
+            fact.cpd = table.ravel().tolist()
+        return self.factors
+
+    def fit(self, source, chunk=100000):
+        '''
+        counts all data and estimates CPDs of factors. Returns factors.
+
+        Syntax:
+            >>> from StringIO import StringIO
+            >>> A = Factor(name='A', values=['a', 'b'])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A])
+            >>> data = StringIO("B,A\\n1,a\\n0,b\\n1,a\\n0,a\\n")
+            >>> [fact.cpd for fact in MaximumLikelihood([A, B]).fit(data)]
+            [[0.75, 0.25], [0.3333333333333333, 0.6666666666666666, 1.0, 0.0]]
+
+        Arguments:
+            source
+                CSV file name or file object with header line of variable
+                names, dict {variable name: column} or iterable of such
+                dicts
+            chunk
+                number of CSV rows read at once
+        '''
+        for data in _chunks(source, chunk):
+            self.count(data)
+        return self.estimate()
+
+
+class ExpectationMaximization(MaximumLikelihood):
+    '''
+    Learning of CPDs from incomplete data. Missing values are empty
+    strings, None or NaN; a column absent from a chunk is missing in all
+    its records. Every iteration passes over all data: E-step accumulates
+    expected counts of factors' assignments given the current CPDs, M-step
+    sets CPDs to their smoothed relative frequencies (as
+    MaximumLikelihood.estimate() does).
+
+    Records of a chunk are grouped by pattern of missing values, and equal
+    records are counted once. For each pattern a junction tree of the
+    factors, built once, is calibrated in one batched pass over all records
+    of the pattern; posteriors of missing variables of every factor are
+    read off beliefs of its clique.
+
+    Syntax:
+            >>> C = Factor(name='C', values=["no", "yes"])
+            >>> T = Factor(name='T', values=["pos", "neg"], cond=[C])
+            >>> EM = ExpectationMaximization([C, T], seed=0)
+            >>> F = EM.fit({'C': ['no', 'no', 'yes', None],
+            ...             'T': ['neg', 'pos', 'pos', 'pos']})
+            >>> EM.converged, [round(p, 3) for p in C.cpd]
+            (True, [0.625, 0.375])
+            >>> [round(p, 3) for p in T.cpd]
+            [0.6, 0.4, 1.0, 0.0]
+
+    Fields:
+        tol
+            iterations stop, when log-likelihood grows by less than tol
+            times its absolute value
+        max_iter
+            maximal number of iterations
+        loglik
+            log-likelihood of data counted since the last reset
+        history
+            list of log-likelihoods of data, one for each iteration,
+            computed with CPDs before its M-step
+        iterations
+            number of iterations made
+        converged
+            True if the last fit stopped by tol
+
+        Other fields are the same as in MaximumLikelihood; counts are
+        expected counts.
+    '''
+
+    def __init__(self, factors=None, laplace=0.0, tol=1e-6, max_iter=100,
+                    order='min-fill', seed=None):
+        '''
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1, 2])
+            >>> EM = ExpectationMaximization([A, B], seed=1)
+            >>> A.cpd, len(B.cpd), round(sum(B.cpd), 6)
+            ([0.6, 0.4], 3, 1.0)
+
+        Arguments:
+            factors
+                list of factors. Factors without CPDs get random ones.
+            laplace
+                pseudocount added to every expected count
+            tol
+                relative tolerance of log-likelihood
+            max_iter
+                maximal number of iterations
+            order
+                elimination heuristic or order used to build the junction
+                tree of E-step (see JunctionTree)
+            seed
+                seed of the random initial CPDs
+        '''
+        MaximumLikelihood.__init__(self, factors, laplace)
+        self.tol = tol
+        self.max_iter = max_iter
+        self.order = order
+        self.loglik = 0.0
+        self.history = []
+        self.iterations = 0
+        self.converged = False
+        self._tree = None
+        rng = np.random.RandomState(seed)
+        for fact in self.factors:
+            if len(fact.cpd) == 0:
+                k = fact.card[-1]
+                table = rng.dirichlet([1.0] * k, fact.pcard[0] // k)
+                fact.cpd = table.ravel().tolist()
+
+    def reset(self):
+        '''
+        drops counts and log-likelihood before the next pass over data
+        '''
+        self.counts = [np.zeros(fact.card) for fact in self.factors]
+        self.records = 0
+        self.loglik = 0.0
+
+    def count(self, data):
+        '''
+        adds expected counts of a chunk of data given current CPDs (E-step)
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.9, 0.1, 0.1, 0.9])
+            >>> EM = ExpectationMaximization([A, B])
+            >>> EM.count({'A': [None, 1], 'B': [0, 1]})
+            >>> EM.counts[0], round(EM.loglik, 6)
+            (array([0.9, 1.1]), -1.491655)
+
+        Arguments:
+            data
+                dict {variable name: sequence of values}
+        '''
+        variables = Factor._canonical(set(v for fact in self.factors
+                                            for v in fact.var))
+        n = max([len(data[v.name]) for v in variables if v.name in data]
+                or [0])
+        codes = {}
+        masks = np.zeros((n, len(variables)), dtype=bool)
+        for (k, var) in enumerate(variables):
+            if not var.name in data:
+                continue
+            column = np.asarray(data[var.name])
+            masks[:, k] = ~_missing(column)
+            codes[var] = np.zeros(n, dtype=np.intp)
+            codes[var][masks[:, k]] = encode(var, column[masks[:, k]])
+
+        if self._tree is None:
+            self._tree = JunctionTree(self.factors, self.order)
+        BE = BatchElimination(self.factors)
+        (patterns, inverse) = np.unique(masks, axis=0, return_inverse=True)
+        groups = np.argsort(inverse, kind='mergesort')
+        sizes = np.bincount(inverse)
+        starts = np.cumsum(sizes) - sizes
+        for (pattern, start, size) in zip(patterns, starts, sizes):
+            rows = groups[start:start + size]
+            observed = [v for (v, seen) in zip(variables, pattern) if seen]
+            table = np.array([codes[v][rows] for v in observed]).T
+            if observed:
+                (table, weights) = np.unique(table, axis=0,
+                                                return_counts=True)
+            else:
+                (table, weights) = (np.zeros((1, 0)), np.array([len(rows)]))
+            for start in range(0, len(weights), 65536):    # bounds memory
+                stop = start + 65536
+                self._expect(BE, dict((v, table[start:stop, k]) for (k, v)
+                                    in enumerate(observed)),
+                                weights[start:stop])
+        self.records += n
+
+    def _calibrate(self, BE, codes, m):
+        '''
+        computes batched beliefs of all cliques of the junction tree, i. e.
+        joint distributions of their missing variables and the evidence for
+        every record. Returns (dict {clique: belief}, ndarray of
+        likelihoods of records).
+
+        Arguments:
+            BE
+                BatchElimination over factors
+            codes
+                dict {observed variable: ndarray of value numbers}
+            m
+                number of records
+        '''
+        tree = self._tree
+        potentials = {}
+        for (i, factors) in tree.assignment.iteritems():
+            res = None
+            for fact in factors:
+                res = BE._evidence(fact, codes) * res
+            potentials[i] = res
+        messages = {}
+        beliefs = {}
+        likelihood = np.ones(m)
+        for root in range(len(tree.cliques)):
+            if root in beliefs:
+                continue
+            schedule = tree._schedule(root)
+            for (i, j) in schedule:
+                res = potentials[i]
+                for k in tree.neighbours[i]:
+                    if k != j:
+                        res = messages[(k, i)] * res
+                sepset = tree._sepset(i, j)
+                for var in list(res.var):
+                    if not var in sepset:
+                        res = res.marginal(var)
+                messages[(i, j)] = res
+            for i in set([root] + [j for (i, j) in schedule]):
+                res = potentials[i]
+                for k in tree.neighbours[i]:
+                    res = messages[(k, i)] * res
+                beliefs[i] = res
+            table = beliefs[root].table
+            likelihood = likelihood * table.reshape(table.shape[0], -1
+                                                    ).sum(axis=1)
+        return (beliefs, likelihood)
+
+    def _expect(self, BE, codes, weights):
+        '''
+        adds expected counts and log-likelihood of distinct records with the
+        same observed variables
+
+        Arguments:
+            BE
+                BatchElimination over factors
+            codes
+                dict {observed variable: ndarray of value numbers}
+            weights
+                ndarray of numbers of equal records
+        '''
+        m = len(weights)
+        (beliefs, likelihood) = self._calibrate(BE, codes, m)
+        clique = dict((fact, i) for (i, factors)
+                        in self._tree.assignment.iteritems()
+                        for fact in factors)
+        for (fact, counts) in zip(self.factors, self.counts):
+            base = np.zeros(m, dtype=np.intp)
+            for (var, stride) in zip(fact.var, fact.stride):
+                if var in codes:
+                    base += codes[var] * stride
+            hidden = Factor._canonical(v for v in fact.var if not v in codes)
+            if not hidden:
+                counts += np.bincount(base, weights, minlength=counts.size
+                                        ).reshape(counts.shape)
+                continue
+            res = beliefs[clique[fact]]
+            for var in list(res.var):
+                if not var in hidden:
+                    res = res.marginal(var)
+            size = reduce(lambda x, y: x*y, [v.card for v in hidden], 1)
+            joint = res._aligned(hidden).reshape(-1, size) * np.ones((m, 1))
+            sums = joint.sum(axis=1)
+            joint *= (weights / np.where(sums > 0, sums, 1))[:, np.newaxis]
+            grid = np.indices([v.card for v in hidden]).reshape(len(hidden),
+                                                                    -1)
+            offsets = sum(grid[k] * fact.stride[fact.var.index(v)]
+                            for (k, v) in enumerate(hidden))
+            flat = base[:, np.newaxis] + offsets[np.newaxis, :]
+            counts += np.bincount(flat.ravel(), joint.ravel(),
+                                    minlength=counts.size).reshape(counts.shape)
+        with np.errstate(divide='ignore'):
+            self.loglik += float(np.dot(weights, np.log(likelihood)))
+
+    def fit(self, source, chunk=100000):
+        '''
+        runs EM iterations until log-likelihood converges. Returns factors.
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A])
+            >>> data = [{'A': [0, 1, 1], 'B': [0, 1, 1]},
+            ...         {'A': ['', 0], 'B': [1, 0]}]
+            >>> EM = ExpectationMaximization([A, B], seed=0)
+            >>> F = EM.fit(data)
+            >>> EM.records, EM.converged
+            (5, True)
+            >>> all(x <= y for (x, y) in zip(EM.history, EM.history[1:]))
+            True
+
+        Arguments:
+            source
+                CSV file name or file object with header line of variable
+                names, dict {variable name: column} or list of such dicts.
+                Data are read once in each iteration, so a file object
+                should be seekable and other iterables reusable.
+            chunk
+                number of CSV rows read at once
+        '''
+        self.history = []
+        self.iterations = 0
+        self.converged = False
+        while self.iterations < self.max_iter:
+            self.reset()
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            for data in _chunks(source, chunk):
+                self.count(data)
+            if not self.records:
+                raise AttributeError("No data to learn from")
+            self.estimate()
+            self.iterations += 1
+            self.history.append(self.loglik)
+            if len(self.history) > 1 and self.history[-1] - \
+                    self.history[-2] <= self.tol * abs(self.history[-2]):
+                self.converged = True
+                break
+        return self.factors
+
+
+class OnlineDirichlet(object):
+    '''
+    Bayesian updating of CPDs from a stream of observations. Every row of a
+    CPD (distribution of the factor's variable given one assignment of its
+    parents) has Dirichlet posterior, kept as prior pseudocounts plus
+    counts of observations. CPDs are set to posterior means. Mini-batches
+    are folded in by vectorized counting, and only rows, which received
+    observations, are recomputed.
+
+    With decay < 1 the weight of observations drops by decay with every
+    following mini-batch, so that CPDs follow drifting data. Decay is
+    applied lazily: a row is brought up to date, when it receives new
+    observations, so rows without new data keep their last distribution.
+
+    Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"])
+            >>> T = Factor(name='Test', values=["pos", "neg"], cond=[C])
+            >>> OD = OnlineDirichlet([C, T], prior=1)
+            >>> OD.update({'Cancer': ['no', 'no', 'yes'],
+            ...             'Test': ['neg', 'neg', 'pos']})
+            >>> C.cpd, T.cpd
+            ([0.6, 0.4], [0.25, 0.75, 0.6666666666666666, 0.3333333333333333])
+            >>> OD.update({'Cancer': ['yes'], 'Test': ['pos']})
+            >>> T.cpd, OD.changed[1]
+            ([0.25, 0.75, 0.75, 0.25], array([1]))
+
+    Fields:
+        factors
+            list of factors, which CPDs are updated
+        decay
+            weight of observations is multiplied by decay with every next
+            mini-batch
+        alpha
+            list of ndarrays (rows x values) of prior pseudocounts
+        counts
+            list of ndarrays (rows x values) of weighted counts of
+            observations, each row up to date as of its stamp
+        stamps
+            list of ndarrays: numbers of the last mini-batch each row
+            received
+        batches
+            number of mini-batches folded in
+        records
+            number of records folded in
+        changed
+            list of ndarrays: rows of CPDs changed by the last update
+    '''
+
+    def __init__(self, factors=None, prior=1.0, decay=1.0):
+        '''
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.2, 0.8])
+            >>> B = Factor(name='B', values=[0, 1, 2])
+            >>> OD = OnlineDirichlet([A, B], prior=5)
+            >>> OD.alpha[0], B.cpd
+            (array([[2., 8.]]), [0.3333333333333333, 0.3333333333333333, 0.3333333333333333])
+
+        Arguments:
+            factors
+                list of factors. CPDs of factors, which have them, are the
+                prior means; factors without CPDs get uniform ones.
+            prior
+                pseudocount per value of a variable, i. e. every row of
+                prior pseudocounts sums to prior * number of values
+            decay
+                weight of observations after one more mini-batch, in (0, 1]
+        '''
+        if not factors:
+            factors = []
+        if not 0 < decay <= 1:
+            raise AttributeError("Decay should be in (0, 1]")
+
+        self.factors = factors
+        self.decay = decay
+        self.alpha = []
+        self.counts = []
+        self.stamps = []
+        self.changed = []
+        self.batches = 0
+        self.records = 0
+        for fact in factors:
+            k = fact.card[-1]
+            if len(fact.cpd) == 0:
+                fact.cpd = [1.0 / k] * fact.pcard[0]
+            mean = np.array(fact.cpd, dtype=float).reshape(-1, k)
+            self.alpha.append(prior * k * mean)
+            self.counts.append(np.zeros(mean.shape))
+            self.stamps.append(np.zeros(len(mean), dtype=np.intp))
+            self.changed.append(np.zeros(0, dtype=np.intp))
+
+    def _write(self, fact, rows, table):
+        '''
+        writes rows of the table into CPD of the factor
+        '''
+        k = fact.card[-1]
+        if getattr(fact, 'table', None) is not None:       # ArrayFactor
+            fact._writable().reshape(-1, k)[rows] = table
+            fact.changed()
+            return
+        cpd = fact.cpd
+        if isinstance(cpd, list) and cpd is getattr(fact, '_cpd', None):
+            for (row, values) in zip(rows.tolist(), table.tolist()):
+                cpd[row * k:(row + 1) * k] = values     # stored list
+            fact.changed()
+            return
+        # LogFactor, SparseFactor etc. return a new list, so CPD is set back
+        cpd = np.array(cpd, dtype=float)
+        cpd.reshape(-1, k)[rows] = table
+        fact.cpd = cpd.tolist()
+
+    def update(self, data):
+        '''
+        folds in a mini-batch of observations and recomputes changed rows
+        of CPDs
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1])
+            >>> OD = OnlineDirichlet([A], prior=0, decay=0.5)
+            >>> OD.update({'A': [0, 0, 0]})
+            >>> OD.update({'A': [1]})
+            >>> A.cpd, OD.counts[0]
+            ([0.6, 0.4], array([[1.5, 1. ]]))
+
+        Arguments:
+            data
+                dict {variable name: sequence of values}
+        '''
+        (n, flats) = _assignments(self.factors, data)
+        self.batches += 1
+        self.records += n
+        for (i, (fact, flat)) in enumerate(zip(self.factors, flats)):
+            (cells, hits) = np.unique(flat, return_counts=True)
+            rows = np.unique(cells // fact.card[-1])
+            counts = self.counts[i]
+            if self.decay < 1:
+                age = self.batches - self.stamps[i][rows]
+                counts[rows] *= (self.decay ** age)[:, np.newaxis]
+            self.stamps[i][rows] = self.batches
+            counts.reshape(-1)[cells] += hits
+            table = self.alpha[i][rows] + counts[rows]
+            sums = table.sum(axis=1, keepdims=True)
+            table /= np.where(sums > 0, sums, 1)
+            self._write(fact, rows, table)
+            self.changed[i] = rows
+
+    def fit(self, source, chunk=100000):
+        '''
+        folds in all data, one chunk per mini-batch. Returns factors.
+
+        Arguments:
+            source
+                CSV file name or file object with header line of variable
+                names, dict {variable name: column} or iterable of such
+                dicts
+            chunk
+                number of CSV rows read at once
+        '''
+        for data in _chunks(source, chunk):
+            self.update(data)
+        return self.factors
+
+
+class TestMaximumLikelihood(unittest.TestCase):
+
+    def setUp(self):
+        self.D = Factor(name='Difficulty', values=[0, 1], cpd=[0.6, 0.4])
+        self.I = Factor(name='Intelligence', values=['low', 'high'],
+                        cpd=[0.7, 0.3])
+        self.G = Factor(name='Grade', values=[1, 2, 3],
+                        cond=[self.D, self.I], cpd=[0.3, 0.4, 0.3,
+                                                0.05, 0.25, 0.7,
+                                                0.9, 0.08, 0.02,
+                                                0.5, 0.3, 0.2])
+        self.S = Factor(name='SAT', values=[0, 1], cond=[self.I],
+                        cpd=[0.95, 0.05, 0.2, 0.8])
+        self.L = Factor(name='Letter', values=[0, 1], cond=[self.G],
+                        cpd=[0.1, 0.9, 0.4, 0.6, 0.99, 0.01])
+        self.factors = [self.D, self.I, self.S, self.G, self.L]
+
+    def tearDown(self):
+        pass
+
+    def _empty(self):
+        '''
+        returns factors with the same variables and no CPDs
+        '''
+        return [Factor(name=fact.name, var=fact.var) for fact in self.factors]
+
+    def testfit_csv(self):
+        from pypgm.sampling import ForwardSampler
+        samples = ForwardSampler(self.factors).sample(50000, seed=1)
+        (handle, path) = tempfile.mkstemp(suffix='.csv')
+        try:
+            stream = os.fdopen(handle, 'wb')
+            writer = csv.writer(stream)
+            writer.writerow([fact.var[-1].name for fact in self.factors])
+            for row in samples.tolist():
+                writer.writerow([fact.var[-1].value[k]
+                                for (fact, k) in zip(self.factors, row)])
+            stream.close()
+            factors = MaximumLikelihood(self._empty()).fit(path, chunk=7000)
+        finally:
+            os.remove(path)
+        for (fact, learned) in zip(self.factors, factors):
+            for (x, y) in zip(fact.cpd, learned.cpd):
+                self.assertAlmostEqual(x, y, delta=0.03)
+
+    def testchunks(self):
+        data = {'Difficulty': [0, 1, 1, 0, 1], 'Intelligence': ['low'] * 5,
+                'SAT': [0, 0, 1, 0, 0], 'Grade': [1, 2, 3, 3, 3],
+                'Letter': [1, 1, 0, 0, 0]}
+        whole = MaximumLikelihood(self._empty(), laplace=0.5)
+        whole.fit(data)
+        parts = MaximumLikelihood(self._empty(), laplace=0.5)
+        parts.fit([dict((k, v[:2]) for (k, v) in data.items()),
+                    dict((k, v[2:]) for (k, v) in data.items())])
+        self.assertEqual(5, parts.records)
+        for (x, y) in zip(whole.factors, parts.factors):
+            self.assertEqual(x.cpd, y.cpd)
+        grade = parts.factors[3].cpd
+        self.assertEqual([1.0 / 3] * 3, grade[3:6])     # unseen parents
+        self.assertAlmostEqual(1.0, sum(grade[:3]))
+
+    def testunknown(self):
+        ML = MaximumLikelihood(self._empty())
+        self.assertRaises(AttributeError, ML.count,
+                            {'Difficulty': [2], 'Intelligence': ['low'],
+                            'SAT': [0], 'Grade': [1], 'Letter': [0]})
+        self.assertRaises(AttributeError, ML.count, {'Difficulty': [0]})
+
+
+class TestExpectationMaximization(unittest.TestCase):
+
+    def setUp(self):
+        self.D = Factor(name='Difficulty', values=[0, 1], cpd=[0.6, 0.4])
+        self.I = Factor(name='Intelligence', values=['low', 'high'],
+                        cpd=[0.7, 0.3])
+        self.G = Factor(name='Grade', values=[1, 2, 3],
+                        cond=[self.D, self.I], cpd=[0.3, 0.4, 0.3,
+                                                0.05, 0.25, 0.7,
+                                                0.9, 0.08, 0.02,
+                                                0.5, 0.3, 0.2])
+        self.S = Factor(name='SAT', values=[0, 1], cond=[self.I],
+                        cpd=[0.95, 0.05, 0.2, 0.8])
+        self.factors = [self.D, self.I, self.S, self.G]
+        from pypgm.sampling import ForwardSampler
+        samples = ForwardSampler(self.factors).sample(20000, seed=2)
+        self.data = {}
+        for (k, fact) in enumerate(self.factors):
+            values = np.array(fact.var[-1].value, dtype=object)
+            self.data[fact.var[-1].name] = values[samples[:, k]]
+
+    def tearDown(self):
+        pass
+
+    def _empty(self):
+        return [Factor(name=fact.name, var=fact.var) for fact in self.factors]
+
+    def testcomplete(self):
+        EM = ExpectationMaximization(self._empty(), laplace=1, seed=0)
+        EM.fit(self.data)
+        ML = MaximumLikelihood(self._empty(), laplace=1)
+        ML.fit(self.data)
+        self.assertTrue(EM.converged)
+        self.assertEqual(3, EM.iterations)     # no gain in the last one
+        for (x, y) in zip(EM.factors, ML.factors):
+            for (p, q) in zip(x.cpd, y.cpd):
+                self.assertAlmostEqual(p, q)
+
+    def testmissing(self):
+        rng = np.random.RandomState(3)
+        for name in ['Intelligence', 'Grade']:
+            self.data[name][rng.random_sample(20000) < 0.3] = None
+        chunks = [dict((name, col[k:k + 5000]) for (name, col)
+                        in self.data.items()) for k in range(0, 20000, 5000)]
+        EM = ExpectationMaximization(self._empty(), tol=1e-8, seed=0)
+        EM.fit(chunks)
+        self.assertTrue(EM.converged)
+        self.assertEqual(20000, EM.records)
+        self.assertEqual(EM.iterations, len(EM.history))
+        for (x, y) in zip(EM.history, EM.history[1:]):
+            self.assertTrue(x <= y + 1e-6)
+        for (fact, learned) in zip(self.factors, EM.factors):
+            for (p, q) in zip(fact.cpd, learned.cpd):
+                self.assertAlmostEqual(p, q, delta=0.05)
+
+        whole = ExpectationMaximization(self._empty(), tol=1e-8, seed=0)
+        whole.fit(self.data)
+        self.assertAlmostEqual(whole.history[-1], EM.history[-1], places=6)
+
+    def testexpected_counts(self):
+        from pypgm.elimination import VariableElimination
+        X = Factor(name='X', values=[0, 1], cpd=[0.25, 0.75])     # unrelated
+        factors = self.factors + [X]
+        data = {'Difficulty': [0, None, 1, None, 0, 1],
+                'Intelligence': ['low', None, None, 'high', None, None],
+                'SAT': [1, 0, None, 1, 1, 1],
+                'Grade': [None, 3, 2, None, 2, 2],
+                'X': [None, 1, 0, None, None, None]}
+        EM = ExpectationMaximization(factors)
+        EM.reset()
+        EM.count(data)
+        VE = VariableElimination(factors)
+        owner = dict((fact.var[-1], fact) for fact in factors)
+        expected = [np.zeros(fact.card) for fact in factors]
+        loglik = 0.0
+        for n in range(6):
+            evidence = dict((owner[fact.var[-1]], data[fact.var[-1].name][n])
+                            for fact in factors
+                            if data[fact.var[-1].name][n] is not None)
+            for (fact, counts) in zip(factors, expected):
+                res = VE.query([owner[v] for v in fact.var], evidence)
+                self.assertEqual(fact.var, res.var)
+                counts += np.reshape(res.cpd, fact.card)
+            res = VE.query(evidence.keys())
+            index = sum(v.find_value(evidence[owner[v]]) * stride
+                        for (v, stride) in zip(res.var, res.stride))
+            loglik += np.log(res.cpd[index])
+        for (x, y) in zip(expected, EM.counts):
+            for (p, q) in zip(x.ravel(), y.ravel()):
+                self.assertAlmostEqual(p, q)
+        self.assertAlmostEqual(loglik, EM.loglik)
+
+    def testearly_stopping(self):
+        self.data['Intelligence'][::3] = None
+        EM = ExpectationMaximization(self._empty(), tol=0, max_iter=3)
+        EM.fit(self.data)
+        self.assertEqual(3, EM.iterations)
+        self.assertFalse(EM.converged)
+
+    def testone_pass(self):
+        EM = ExpectationMaximization(self._empty())
+        self.assertRaises(AttributeError, EM.fit, iter([self.data]))
+
+
+class TestOnlineDirichlet(unittest.TestCase):
+
+    def setUp(self):
+        self.A = Factor(name='A', values=[0, 1])
+        self.B = Factor(name='B', values=['x', 'y', 'z'], cond=[self.A])
+
+    def tearDown(self):
+        pass
+
+    def testmatches_batch(self):
+        data = {'A': [0, 1, 1, 0, 1, 1], 'B': ['x', 'z', 'z', 'y', 'x', 'z']}
+        OD = OnlineDirichlet([self.A, self.B], prior=1)
+        for k in range(0, 6, 2):
+            OD.update(dict((name, col[k:k+2]) for (name, col)
+                            in data.items()))
+        A = Factor(name='A', values=[0, 1])
+        B = Factor(name='B', values=['x', 'y', 'z'], cond=[A])
+        MaximumLikelihood([A, B], laplace=1).fit(data)
+        for (x, y) in zip(B.cpd + A.cpd, self.B.cpd + self.A.cpd):
+            self.assertAlmostEqual(x, y)
+        self.assertEqual(3, OD.batches)
+        self.assertEqual(6, OD.records)
+
+    def testchanged_rows(self):
+        OD = OnlineDirichlet([self.A, self.B], prior=1)
+        before = list(self.B.cpd)
+        OD.update({'A': [1, 1], 'B': ['y', 'y']})
+        self.assertEqual([1], OD.changed[1].tolist())
+        self.assertEqual(before[:3], self.B.cpd[:3])
+        self.assertEqual([0.2, 0.6, 0.2], self.B.cpd[3:])
+
+    def testdecay(self):
+        OD = OnlineDirichlet([self.A, self.B], prior=0.01, decay=0.1)
+        OD.update({'A': [0] * 10, 'B': ['x'] * 10})
+        OD.update({'A': [1], 'B': ['z']})       # row 0 isn't touched
+        self.assertTrue(self.B.cpd[0] > 0.99)
+        OD.update({'A': [0], 'B': ['y']})
+        # 10 observations two batches ago weigh as 0.1 of one
+        self.assertAlmostEqual(0.11 / 1.13, self.B.cpd[0])
+        self.assertEqual([0], OD.changed[1].tolist())
+        self.assertRaises(AttributeError, OnlineDirichlet, [self.A], 1, 0)
+
+    def testarrayfactor(self):
+        from pypgm.arrayfactor import ArrayFactor
+        A = ArrayFactor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+        V = A.permute(A.var)
+        OnlineDirichlet([A], prior=1).update({'A': [1, 1]})
+        self.assertEqual([0.25, 0.75], A.cpd.tolist())
+        self.assertEqual([0.5, 0.5], V.cpd.tolist())
+
+    def testfactor_classes(self):
+        from pypgm.arrayfactor import ArrayFactor
+        from pypgm.logfactor import LogFactor
+        from pypgm.sparsefactor import SparseFactor
+        expected = None
+        for cls in [Factor, ArrayFactor, LogFactor, SparseFactor]:
+            A = cls(name='A', values=[0, 1], cpd=[0.5, 0.5])
+            B = cls(name='B', values=[0, 1, 2], cond=[A],
+                    cpd=[0.2, 0.3, 0.5, 0.6, 0.4, 0])
+            OnlineDirichlet([A, B], prior=1).update({'A': [1, 1],
+                                                    'B': [2, 2]})
+            cpd = list(A.cpd) + list(B.cpd)
+            if expected is None:
+                expected = cpd
+                self.assertEqual([0.25, 0.75, 0.2, 0.3, 0.5], cpd[:5])
+            for (x, y) in zip(expected, cpd):
+                self.assertAlmostEqual(x, y)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=False)
+##    doctest.testmod(verbose=True)
@@ -0,0 +1,507 @@
+'''
+    Factor kept in log domain. Natural logarithms of factor's values are
+    stored instead of the values themselves, so factor product is an addition,
+    marginalization is a log-sum-exp and conditioning is a subtraction. Long
+    products of small probabilities never underflow to zero, and there is no
+    need to normalize intermediate results just to keep numbers in range.
+    Everything else (queries, joint, uncond, reduce) is inherited from Factor
+    and works on top of these operations.
+'''
+
+import unittest
+from math import exp, log
+from itertools import izip
+from pypgm.variable import Variable
+from pypgm.factor import Factor
+
+NEG_INF = float('-inf')
+
+
+def _log(value):
+    '''
+    natural logarithm, extended with log(0) = -inf
+
+    Syntax:
+        >>> _log(1.0), _log(0.0)
+        (0.0, -inf)
+    '''
+    if value > 0:
+        return log(value)
+    return NEG_INF
+
+
+def _logsumexp(values):
+    '''
+    computes log(sum(exp(values))) without overflow or underflow
+
+    Syntax:
+        >>> _logsumexp([-1000.0, -1000.0]) == -1000.0 + log(2.0)
+        True
+        >>> _logsumexp([NEG_INF, NEG_INF])
+        -inf
+
+    Arguments:
+        values
+            list of logarithms
+    '''
+    top = max(values) if values else NEG_INF
+    if top == NEG_INF:
+        return NEG_INF
+    return top + log(sum(exp(val - top) for val in values))
+
+
+class LogFactor(Factor):
+    '''
+    Syntax:
+
+            >>> C = LogFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.5, 0.5])
+            >>> C.log
+            [-0.6931471805599453, -0.6931471805599453]
+            >>> C.cpd
+            [0.5, 0.5]
+
+    Fields:
+        log
+            list of natural logarithms of factor's values, in the same order
+            as Factor.cpd. Zero values are stored as -inf.
+        cpd
+            list of factor's values, computed out of log on each access.
+            Assigning a list to it replaces log; changing elements of the
+            returned list does not change the factor.
+
+        All other fields are the same as in Factor.
+    '''
+
+    def __init__(self, name='',
+                        values=None,
+                        cond=None,
+                        cpd=None,
+                        var=None,
+                        log=None):
+        '''
+        Syntax:
+            Arguments are the same as for Factor, both explicit and implicit
+            ways of defining variables are supported:
+                >>> C = Variable('Cancer', ['yes', 'no'])
+                >>> T = Variable('Test', ['pos', 'neg'])
+                >>> F = LogFactor(name='T', var=[C,T], cpd=[1.0, 0.0, 0.5, 0.5])
+                >>> F.var
+                [Cancer, Test]
+                >>> F.log[:2]
+                [0.0, -inf]
+                >>> LogFactor(name='C', var=[C], log=[0.0, NEG_INF]).cpd
+                [1.0, 0.0]
+
+        Arguments:
+            log
+                list of natural logarithms of factor's values. If given, it
+                is used as is, without copying, and cpd is ignored.
+
+            Other arguments are the same as for Factor.__init__().
+        '''
+        self.log = []
+        Factor.__init__(self, name=name, values=values, cond=cond, cpd=cpd,
+                        var=var)
+
+        if log is not None:
+            if len(log) != self.pcard[0]:
+                string = "Cannot build conditioned factor: " + \
+                        "cpd cardinality doesn't match"
+                raise AttributeError(string)
+            self.log = log
+
+    def _get_cpd(self):
+        return [exp(val) for val in self.log]
+
+    def _set_cpd(self, cpd):
+        self.log = [_log(val) for val in cpd]
+        self.changed()
+
+    cpd = property(_get_cpd, _set_cpd)
+
+    @classmethod
+    def from_factor(cls, factor):
+        '''
+        Builds a log domain copy of any factor. The copy shares variables,
+        conditions and parents with the original.
+
+        Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[1.0, 0.0])
+            >>> L = LogFactor.from_factor(C)
+            >>> L.var == C.var, L.cons is C.cons
+            (True, True)
+            >>> L.log
+            [0.0, -inf]
+
+        Arguments:
+            factor
+                any factor
+        '''
+        if isinstance(factor, cls):
+            return factor
+        res = cls(name=factor.name, var=factor.var, cpd=factor.cpd)
+        res.cons = factor.cons
+        res.cond = list(factor.cond)
+        res.parents = list(factor.parents)
+        return res
+
+    def __mul__(self, other):
+        '''
+        computes product of factors as a sum of logarithms
+        F(A,C)*F(C,B) = F(A,B,C)
+
+        Syntax:
+            >>> C = LogFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.5, 0.5])
+            >>> T = LogFactor(name='Test', values=["pos", "neg"],
+            ...                 cond=[C], cpd=[0.25, 0.75, 1.0, 0.0])
+            >>> P = T*C
+            >>> P.name, P.var
+            ('Product', [Cancer, Test])
+            >>> P.cpd
+            [0.12500000000000003, 0.375, 0.5, 0.0]
+        '''
+        if other is None:           # for compatibility
+            return self
+        other = LogFactor.from_factor(other)
+        res = LogFactor(name='Product',
+                    var=Factor._canonical(set(self.var) | set(other.var)))
+        res.cond = list(other.cond)
+        res.parents = list(other.parents)
+        if self.var == res.var:         # aligned scopes: no index mapping
+            self_ind = xrange(res.pcard[0])
+        else:
+            self_ind = res._indices(self._strides(res.var))
+        if other.var == res.var:
+            other_ind = xrange(res.pcard[0])
+        else:
+            other_ind = res._indices(other._strides(res.var))
+        self_log = self.log
+        other_log = other.log
+        res.log = [self_log[i] + other_log[j]
+                    for (i, j) in izip(self_ind, other_ind)]
+        return res
+
+    def __rmul__(self, other):
+        '''
+        product of an ordinary factor and a log domain one. Result is always
+        in log domain.
+
+        Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.5, 0.5])
+            >>> T = LogFactor(name='Test', values=["pos", "neg"],
+            ...                 cond=[C], cpd=[0.25, 0.75, 1.0, 0.0])
+            >>> (C*T).cpd
+            [0.12500000000000003, 0.375, 0.5, 0.0]
+        '''
+        return LogFactor.from_factor(other) * self
+
+    def _logmarginal(self, res):
+        '''
+        fills log of res with log-sum-exp of this factor's logarithms over
+        all variables missing in res. Returns res.
+        '''
+        strides = res._strides(self.var)
+        size = res.pcard[0]
+        top = [NEG_INF] * size
+        for (val, ind) in izip(self.log, self._indices(strides)):
+            if val > top[ind]:
+                top[ind] = val
+        acc = [0.0] * size
+        for (val, ind) in izip(self.log, self._indices(strides)):
+            if top[ind] != NEG_INF:
+                acc[ind] += exp(val - top[ind])
+        res.log = [t + log(a) if t != NEG_INF else NEG_INF
+                    for (t, a) in izip(top, acc)]
+        return res
+
+    def marginal(self, var=None):
+        '''
+        perfoms a factor marginalization by log-sum-exp
+        F(A,B,C)-B = F(A,C)
+
+        Syntax:
+            >>> C = LogFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.5, 0.5])
+            >>> T = LogFactor(name='Test', values=["pos", "neg"],
+            ...                 cond=[C], cpd=[0.25, 0.75, 1.0, 0.0])
+            >>> M = T.marginal(C.cons)
+            >>> M.name, M.var
+            ('Marginal factor', [Test])
+            >>> M.cpd
+            [1.25, 0.75]
+        '''
+        if not var in self.var:
+            raise AttributeError("Unable to marginalize: variable is missing")
+
+        res = LogFactor('Marginal factor',
+                        var=Factor._canonical(set(self.var) - set([var])))
+        return self._logmarginal(res)
+
+    def _reduce3(self, evidence):
+        '''
+        reduces the factor on all variables of given assignment in a single
+        pass. Result is not normalized.
+
+        Syntax:
+            >>> A = LogFactor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+            >>> B = LogFactor(name='B', values=[0, 1], cond=[A],
+            ...                 cpd=[0.25, 0.75, 1.0, 0.0])
+            >>> R = B._reduce3({A.cons: 0})
+            >>> R.name, R.var, R.cpd
+            ('Marginal factor', [B], [0.25, 0.75])
+        '''
+        offset = 0
+        for (var, value) in evidence.iteritems():
+            if not var in self.var:
+                raise AttributeError()
+            index = var.find_value(value)
+            if index is None:
+                offset = None
+                break
+            offset += self.stride[self.var.index(var)] * index
+
+        res = LogFactor(name='Marginal factor',
+                        var=Factor._canonical(set(self.var) - set(evidence)))
+        if offset is None:              # value is not among var's values
+            res.log = [NEG_INF] * res.pcard[0]
+            return res
+        self_log = self.log
+        res.log = [self_log[offset + i]
+                    for i in res._indices(self._strides(res.var))]
+        return res
+
+    def _reduce1(self, var=None, value=''):
+        '''
+        Same as _reduce3() on a single variable.
+
+        Syntax:
+            >>> A = LogFactor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+            >>> B = LogFactor(name='B', values=[0, 1], cond=[A],
+            ...                 cpd=[0.25, 0.75, 1.0, 0.0])
+            >>> B._reduce1(var=B.cons, value=0).cpd
+            [0.25, 1.0]
+        '''
+        res = self._reduce3({var: value})
+        res.name = 'Reduced'
+        return res
+
+    def _reduce2(self, var=None, value=''):
+        '''
+        Same as _reduce3() on a single variable.
+
+        Syntax:
+            >>> A = LogFactor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+            >>> B = LogFactor(name='B', values=[0, 1], cond=[A],
+            ...                 cpd=[0.25, 0.75, 1.0, 0.0])
+            >>> B._reduce2(var=A.cons, value=1).cpd
+            [1.0, 0.0]
+        '''
+        return self._reduce3({var: value})
+
+    def __div__(self, other=None):
+        '''
+        conditions the factor on the variable of other factor: subtracts
+        log-sum-exp over all the rest variables. Zero divided by zero is
+        zero.
+
+        Syntax:
+            >>> C = LogFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.5, 0.5])
+            >>> T = LogFactor(name='Test', values=["pos", "neg"],
+            ...                 cond=[C], cpd=[0.25, 0.75, 1.0, 0.0])
+            >>> D = (T*C)/C
+            >>> D.name, D.var, D.cond
+            ('Conditional', [Cancer, Test], [Cancer])
+            >>> D.cpd
+            [0.25, 0.7499999999999999, 1.0, 0.0]
+        '''
+        t = Factor._canonical(set(other.var) - set(other.cond))
+        var = t[-1]
+        if not var in self.var:
+            raise AttributeError()
+
+        parents = sorted(set([other]) | set(self.parents),
+                            key=lambda f: f.var[-1].ordinal)
+        cond = [fact.var[-1] for fact in parents]
+        res = LogFactor(name='Conditional',
+                        var=Factor._canonical(set(self.var) | set(cond)))
+        res.cond = cond
+        res.parents = parents
+
+        temp = self._logmarginal(LogFactor(var=t))
+        self_log = self.log
+        temp_log = temp.log
+        self_ind = res._indices(self._strides(res.var))
+        temp_ind = res._indices(temp._strides(res.var))
+        res.log = [self_log[i] - temp_log[k]
+                    if temp_log[k] != NEG_INF else NEG_INF
+                    for (i, k) in izip(self_ind, temp_ind)]
+        return res
+
+    def __rdiv__(self, other):
+        '''
+        conditioning of an ordinary factor on a log domain one.
+
+        Syntax:
+            >>> C = LogFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.5, 0.5])
+            >>> T = Factor(name='Test', values=["pos", "neg"],
+            ...             cond=[C], cpd=[0.25, 0.75, 1.0, 0.0])
+            >>> (T*C/C).cpd
+            [0.25, 0.7499999999999999, 1.0, 0.0]
+        '''
+        return LogFactor.from_factor(other) / self
+
+    def permute(self, var):
+        '''
+        returns the same factor with variables reordered according to given
+        list. Conditions, parents and induced variable are kept.
+
+        Syntax:
+            >>> C = LogFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.5, 0.5])
+            >>> T = LogFactor(name='Test', values=["pos", "neg"],
+            ...                 cond=[C], cpd=[0.25, 0.75, 1.0, 0.0])
+            >>> R = T.permute([T.cons, C.cons])
+            >>> R.var, R.cpd
+            ([Test, Cancer], [0.25, 1.0, 0.75, 0.0])
+
+        Arguments:
+            var
+                list of the same variables as in this factor's var list,
+                in new order
+        '''
+        if sorted(var) != sorted(self.var):
+            raise AttributeError("Unable to permute: scope doesn't match")
+
+        res = LogFactor(name=self.name, var=list(var))
+        res.cons = self.cons
+        res.cond = list(self.cond)
+        res.parents = list(self.parents)
+        self_log = self.log
+        res.log = [self_log[i] for i in res._indices(self._strides(res.var))]
+        return res
+
+    def logsum(self):
+        '''
+        returns logarithm of sum of all factor's values
+
+        Syntax:
+            >>> A = LogFactor(name='A', values=[0, 1],
+            ...                 log=[-1000.0, -1000.0])
+            >>> A.sum()
+            0.0
+            >>> A.logsum() == -1000.0 + log(2.0)
+            True
+        '''
+        return _logsumexp(self.log)
+
+    def sum(self):
+        '''
+        returns sum of all factor's values
+
+        Syntax:
+            >>> C = LogFactor(name='Cancer', values=["no", "yes"],
+            ...                 cpd=[0.5, 0.5])
+            >>> C.sum()
+            1.0
+        '''
+        return exp(self.logsum())
+
+    def _norm(self):
+        '''
+        normalizes values of the factor to make all valies sum to 1.0
+        Warning: mutates the factor!
+        If factor sums to 0, does nothing
+
+        Syntax:
+            >>> A = LogFactor(name='A', values=[0, 1],
+            ...                 log=[-1000.0, -1000.0])
+            >>> [round(val, 9) for val in A._norm().cpd]
+            [0.5, 0.5]
+        '''
+        sum_ = self.logsum()
+        if sum_ != NEG_INF:
+            self.log = [val - sum_ for val in self.log]
+            self.changed()
+        return self
+
+
+class TestLogFactor(unittest.TestCase):
+
+    def setUp(self):
+        self.C = LogFactor(name='Cancer',
+                        values=["no", "yes"],
+                        cpd=[0.99, 0.01])
+        self.T = LogFactor(name='Test',
+                        values=["pos", "neg"], cond=[self.C],
+                        cpd=[0.2, 0.8, 0.9, 0.1])
+
+    def tearDown(self):
+        pass
+
+    def assertCpdEqual(self, first, second):
+        self.assertEqual(len(first), len(second))
+        for (x, y) in zip(first, second):
+            self.assertAlmostEqual(x, y)
+
+    def test__mul__(self):
+        P = self.T * self.C
+        self.assertEqual([self.C.cons, self.T.cons], P.var)
+        self.assertCpdEqual([0.198, 0.792, 0.009, 0.001], P.cpd)
+
+    def testmarginal(self):
+        self.assertCpdEqual([1.1, 0.9], self.T.marginal(self.C.cons).cpd)
+        self.assertCpdEqual([1.0, 1.0], self.T.marginal(self.T.cons).cpd)
+        self.assertRaises(AttributeError, self.C.marginal, self.T.cons)
+
+    def testreduce(self):
+        R = self.T.reduce(var=self.T.cons, value='pos')
+        self.assertTrue(isinstance(R, LogFactor))
+        self.assertCpdEqual([0.18181818, 0.81818182], R.cpd)
+
+    def test__div__(self):
+        D = (self.T * self.C) / self.C
+        self.assertEqual([self.C.cons], D.cond)
+        self.assertCpdEqual([0.2, 0.8, 0.9, 0.1], D.cpd)
+
+    def testquery(self):
+        C = Factor(name='Cancer', values=["no", "yes"], cpd=[0.99, 0.01])
+        T = Factor(name='Test', values=["pos", "neg"], cond=[C],
+                    cpd=[0.2, 0.8, 0.9, 0.1])
+        expected = T.query([C], {T: 'pos'})
+        res = self.T.query([self.C], {self.T: 'pos'})
+        self.assertTrue(isinstance(res, LogFactor))
+        self.assertCpdEqual(expected.cpd, res.cpd)
+
+    def testelimination(self):
+        from pypgm.elimination import VariableElimination
+        res = VariableElimination([self.C, self.T]).query([self.C],
+                                                            {self.T: 'neg'})
+        self.assertTrue(isinstance(res, LogFactor))
+        self.assertCpdEqual([0.99873897, 0.00126103], res.cpd)
+
+    def testunderflow(self):
+        # 60 factors of 1e-6 each: the linear product underflows to zero
+        A = Factor(name='A', values=[0, 1], cpd=[1e-6, 1e-6])
+        L = LogFactor.from_factor(A)
+        plain = A
+        logged = L
+        for i in range(60):
+            B = Factor(name='B', values=[0, 1], cond=[A],
+                        cpd=[1e-6, 1e-6, 1e-6, 1e-6])
+            plain = (plain * B).marginal(A.cons)
+            logged = (logged * LogFactor.from_factor(B)).marginal(A.cons)
+            A = B
+        self.assertEqual([0.0, 0.0], plain.cpd)
+        self.assertCpdEqual([0.5, 0.5], logged._norm().cpd)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=False)
+##    doctest.testmod(verbose=True)
@@ -0,0 +1,407 @@
+'''
+    Loopy belief propagation - approximate inference on the factor graph of
+    a set of factors. Messages are passed between factors and variables of
+    their scopes until they stop changing. Every iteration costs time linear
+    in the total size of the factors, whatever the treewidth of the net; on
+    nets without loops the result is exact.
+
+    Messages can be updated synchronously (all at once per iteration) or by
+    residual scheduling, where the message that would change most is
+    committed first. Damping mixes the old message into the new one.
+'''
+
+import unittest
+import heapq
+from timeit import default_timer
+from pypgm.factor import Factor
+from pypgm.elimination import VariableElimination
+
+
+class LoopyBeliefPropagation(object):
+    '''
+    Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> T = Factor(name='Test', values=["pos", "neg"],
+            ...             cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> BP = LoopyBeliefPropagation([C, T])
+            >>> [round(p, 6) for p in BP.query([C], {T: 'pos'}).cpd]
+            [0.956522, 0.043478]
+            >>> BP.converged
+            True
+
+    Fields:
+        factors
+            list of factors of the factor graph
+        evidence
+            dict {variable: value} of evidence, messages were computed for
+        schedule
+            'synchronous' or 'residual'
+        damping
+            weight of the old message in the updated one, in [0, 1)
+        tol
+            messages are converged, when no message changes by more than tol
+        max_iter
+            maximal number of iterations
+        iterations
+            number of iterations made by the last run
+        residuals
+            list of the largest message changes, one for each iteration
+        timings
+            list of durations of iterations in seconds
+        converged
+            True if the last run reached tol
+    '''
+
+    schedules = {'synchronous': '_synchronous',
+                 'residual': '_residual'}
+
+    def __init__(self, factors=None, schedule='synchronous', damping=0.0,
+                    tol=1e-6, max_iter=100):
+        '''
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> BP = LoopyBeliefPropagation([A], schedule='residual')
+            >>> BP.schedule, BP.iterations
+            ('residual', 0)
+            >>> LoopyBeliefPropagation([A], schedule='random')
+            Traceback (most recent call last):
+            ...
+            AttributeError: Unknown message schedule: random
+
+        Arguments:
+            factors
+                list of factors
+            schedule
+                'synchronous' - all messages are recomputed out of the
+                previous iteration's ones; 'residual' - messages are
+                committed one by one, the largest change first
+            damping
+                weight of the old message in the updated one
+            tol
+                convergence tolerance
+            max_iter
+                maximal number of iterations
+        '''
+        if not factors:
+            factors = []
+        if not schedule in self.schedules:
+            raise AttributeError("Unknown message schedule: " + schedule)
+
+        self.factors = factors
+        self.schedule = schedule
+        self.damping = damping
+        self.tol = tol
+        self.max_iter = max_iter
+        self.evidence = None
+        self.iterations = 0
+        self.residuals = []
+        self.timings = []
+        self.converged = False
+        self._graph = []            # factors and evidence indicators
+        self._nbrs = {}             # variable -> numbers of its factors
+        self._f2v = {}              # (factor number, variable) -> message
+
+    def _build(self, evidence):
+        '''
+        builds the factor graph: factors and indicators of evidence
+        '''
+        self._graph = list(self.factors)
+        for var in Factor._canonical(evidence):
+            index = var.find_value(evidence[var])
+            if index is None:
+                raise AttributeError("Unknown value of variable " + var.name)
+            self._graph.append(Factor(name='Evidence', var=[var],
+                            cpd=[float(j == index) for j in range(var.card)]))
+        self._nbrs = {}
+        for (i, fact) in enumerate(self._graph):
+            for var in fact.var:
+                self._nbrs.setdefault(var, []).append(i)
+        self._f2v = {}
+        for (i, fact) in enumerate(self._graph):
+            for var in fact.var:
+                self._f2v[(i, var)] = self._uniform(var)
+
+    def _uniform(self, var):
+        return Factor(name='Message', var=[var],
+                        cpd=[1.0 / var.card] * var.card)
+
+    def _normalized(self, fact, name='Message'):
+        '''
+        returns normalized copy of the factor
+        '''
+        res = fact.permute(fact.var)._norm()
+        res.name = name
+        return res
+
+    def _variable_message(self, var, i):
+        '''
+        returns message from the variable to factor i: product of messages
+        from the rest factors of the variable
+        '''
+        res = None
+        for j in self._nbrs[var]:
+            if j != i:
+                res = self._f2v[(j, var)] * res
+        if res is None:
+            return self._uniform(var)
+        return self._normalized(res)
+
+    def _factor_message(self, i, var, incoming):
+        '''
+        returns message from factor i to the variable: the factor times
+        messages from the rest variables of its scope, summed over them.
+        incoming(u) gives the message from variable u to the factor.
+        '''
+        res = self._graph[i]
+        for u in res.var:
+            if u != var:
+                res = (res * incoming(u)).marginal(u)
+        res = self._normalized(res)
+        if self.damping:
+            old = self._f2v[(i, var)].cpd
+            res.cpd = [(1 - self.damping) * x + self.damping * y
+                        for (x, y) in zip(res.cpd, old)]
+        return res
+
+    def _change(self, edge, message):
+        return max(abs(x - y) for (x, y)
+                    in zip(message.cpd, self._f2v[edge].cpd))
+
+    def _synchronous(self):
+        '''
+        runs iterations, where every message is recomputed out of the
+        messages of the previous iteration
+        '''
+        edges = sorted(self._f2v, key=lambda e: (e[0], e[1].ordinal))
+        while self.iterations < self.max_iter:
+            start = default_timer()
+            v2f = {}
+            for (i, var) in edges:
+                v2f[(var, i)] = self._variable_message(var, i)
+            new = {}
+            residual = 0.0
+            for (i, var) in edges:
+                message = self._factor_message(i, var,
+                                                lambda u: v2f[(u, i)])
+                residual = max(residual, self._change((i, var), message))
+                new[(i, var)] = message
+            self._f2v = new
+            self._report(start, residual)
+            if self.converged:
+                break
+
+    def _residual(self):
+        '''
+        runs residual belief propagation: the pending message with the
+        largest change is committed, and messages out of factors, which
+        receive it, are recomputed. An iteration is as many commits as
+        there are messages.
+        '''
+        edges = sorted(self._f2v, key=lambda e: (e[0], e[1].ordinal))
+        pending = {}
+        change = {}
+        heap = []
+        order = dict((edge, n) for (n, edge) in enumerate(edges))
+
+        def update(edge):
+            (i, var) = edge
+            pending[edge] = self._factor_message(i, var,
+                            lambda u: self._variable_message(u, i))
+            change[edge] = self._change(edge, pending[edge])
+            heapq.heappush(heap, (-change[edge], order[edge], edge))
+
+        for edge in edges:
+            update(edge)
+        while self.iterations < self.max_iter:
+            start = default_timer()
+            for step in xrange(len(edges)):
+                while heap and -heap[0][0] != change[heap[0][2]]:
+                    heapq.heappop(heap)     # outdated entry
+                if not heap or -heap[0][0] < self.tol:
+                    break
+                (i, var) = heapq.heappop(heap)[2]
+                self._f2v[(i, var)] = pending[(i, var)]
+                update((i, var))            # damped message moves further
+                for j in self._nbrs[var]:
+                    if j != i:
+                        for u in self._graph[j].var:
+                            if u != var:
+                                update((j, u))
+            self._report(start, max(change.values()) if change else 0.0)
+            if self.converged:
+                break
+
+    def _report(self, start, residual):
+        self.iterations += 1
+        self.timings.append(default_timer() - start)
+        self.residuals.append(residual)
+        self.converged = residual < self.tol
+
+    def run(self, evidence=None):
+        '''
+        computes messages for given evidence. Returns self.
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> BP = LoopyBeliefPropagation([A, B]).run({B.cons: 1})
+            >>> BP.converged, BP.iterations, len(BP.timings)
+            (True, 3, 3)
+
+        Arguments:
+            evidence
+                dict {variable: value}
+        '''
+        if not evidence: evidence = {}
+
+        self.evidence = dict(evidence)
+        self.iterations = 0
+        self.residuals = []
+        self.timings = []
+        self.converged = False
+        self._build(self.evidence)
+        getattr(self, self.schedules[self.schedule])()
+        return self
+
+    def belief(self, var):
+        '''
+        returns approximate marginal distribution of the variable: product
+        of all messages coming to it
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> BP = LoopyBeliefPropagation([A, B]).run()
+            >>> BP.belief(B.cons).cpd
+            [0.5, 0.5]
+
+        Arguments:
+            var
+                variable
+        '''
+        if not var in self._nbrs:
+            raise AttributeError("Unable to query: variable is missing")
+        res = None
+        for i in self._nbrs[var]:
+            res = self._f2v[(i, var)] * res
+        return self._normalized(res, 'Marginal factor')
+
+    def query(self, query=None, evidence=None):
+        '''
+        computes approximate distribution of query variables given
+        evidence. Several variables can be queried if some factor's scope
+        includes all of them. Messages are recomputed only if evidence has
+        changed since the last run.
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> BP = LoopyBeliefPropagation([A, B], schedule='residual')
+            >>> [round(p, 6) for p in BP.query([A], {B: 1}).cpd]
+            [0.36, 0.64]
+            >>> R = BP.query([A, B], {})
+            >>> R.var, [round(p, 6) for p in R.cpd]
+            ([A, B], [0.42, 0.18, 0.08, 0.32])
+
+        Arguments:
+            query
+                list of factors, which variables are queried
+            evidence
+                dict {factor: value} of observed values
+        '''
+        if not query: query = []
+        if not evidence: evidence = {}
+
+        query_ = Factor._canonical(fact.var[-1] for fact in query)
+        evid = dict((fact.var[-1], value)
+                        for (fact, value) in evidence.iteritems())
+        if evid != self.evidence:
+            self.run(evid)
+        if len(query_) == 1:
+            return self.belief(query_[0])
+
+        for (i, fact) in enumerate(self._graph):
+            if not set(query_) - set(fact.var):
+                res = fact
+                for u in fact.var:
+                    res = res * self._variable_message(u, i)
+                for u in fact.var:
+                    if not u in query_:
+                        res = res.marginal(u)
+                return self._normalized(res, 'Marginal factor')
+        raise AttributeError("Unable to query: no factor includes " +
+                                "all query variables")
+
+
+class TestLoopyBeliefPropagation(unittest.TestCase):
+
+    def setUp(self):
+        self.D = Factor(name='Difficulty', values=[0, 1], cpd=[0.6, 0.4])
+        self.I = Factor(name='Intelligence', values=['low', 'high'],
+                        cpd=[0.7, 0.3])
+        self.G = Factor(name='Grade|I,D', values=[1, 2, 3],
+                        cond=[self.D, self.I], cpd=[0.3, 0.4, 0.3,
+                                                0.05, 0.25, 0.7,
+                                                0.9, 0.08, 0.02,
+                                                0.5, 0.3, 0.2])
+        self.S = Factor(name='SAT|I', values=[0, 1], cond=[self.I],
+                        cpd=[0.95, 0.05, 0.2, 0.8])
+        self.L = Factor(name='Letter|G', values=[0, 1], cond=[self.G],
+                        cpd=[0.1, 0.9, 0.4, 0.6, 0.99, 0.01])
+        self.factors = [self.D, self.I, self.S, self.G, self.L]
+        # a loop: A -> B, A -> C, (B, C) -> D
+        self.A = Factor(name='A', values=[0, 1], cpd=[0.3, 0.7])
+        self.B = Factor(name='B', values=[0, 1], cond=[self.A],
+                        cpd=[0.8, 0.2, 0.3, 0.7])
+        self.C = Factor(name='C', values=[0, 1], cond=[self.A],
+                        cpd=[0.6, 0.4, 0.1, 0.9])
+        self.E = Factor(name='E', values=[0, 1], cond=[self.B, self.C],
+                        cpd=[0.9, 0.1, 0.5, 0.5, 0.4, 0.6, 0.2, 0.8])
+        self.loop = [self.A, self.B, self.C, self.E]
+
+    def tearDown(self):
+        pass
+
+    def testtree(self):
+        VE = VariableElimination(self.factors)
+        evidence = {self.L: 0, self.S: 1}
+        for schedule in LoopyBeliefPropagation.schedules:
+            BP = LoopyBeliefPropagation(self.factors, schedule=schedule)
+            for fact in [self.D, self.I, self.G]:
+                res = BP.query([fact], evidence)
+                self.assertTrue(BP.converged)
+                for (x, y) in zip(VE.query([fact], evidence).cpd, res.cpd):
+                    self.assertAlmostEqual(x, y, places=5)
+
+    def testloop(self):
+        VE = VariableElimination(self.loop)
+        for schedule in LoopyBeliefPropagation.schedules:
+            BP = LoopyBeliefPropagation(self.loop, schedule=schedule,
+                                        damping=0.3, tol=1e-8)
+            res = BP.query([self.A], {self.E: 1})
+            self.assertTrue(BP.converged)
+            self.assertEqual(BP.iterations, len(BP.residuals))
+            self.assertEqual(BP.iterations, len(BP.timings))
+            self.assertTrue(BP.residuals[-1] < 1e-8)
+            for (x, y) in zip(VE.query([self.A], {self.E: 1}).cpd, res.cpd):
+                self.assertAlmostEqual(x, y, delta=0.025)
+
+    def testmax_iter(self):
+        BP = LoopyBeliefPropagation(self.loop, tol=0.0, max_iter=4)
+        BP.run({self.E.cons: 1})
+        self.assertFalse(BP.converged)
+        self.assertEqual(4, BP.iterations)
+
+    def testquery_missing(self):
+        BP = LoopyBeliefPropagation(self.loop)
+        self.assertRaises(AttributeError, BP.query, [self.B, self.C, self.A])
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=False)
+##    doctest.testmod(verbose=True)
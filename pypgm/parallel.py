@@ -0,0 +1,251 @@
+'''
+    Parallel execution of many independent queries. Queries are CPU-bound
+    and run on one core under the GIL, so they are fanned out in batches to
+    a pool of worker processes. CPDs of all factors are copied once into a
+    single shared-memory buffer; workers attach ArrayFactor views to it
+    instead of receiving the network by pickling, and only query and
+    evidence indices travel to workers, with result tables coming back.
+'''
+
+import unittest
+import multiprocessing
+from itertools import chain
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+from pypgm.factor import Factor
+from pypgm.arrayfactor import ArrayFactor
+from pypgm.elimination import VariableElimination
+
+_worker = {}            # state of a worker process, see _attach()
+
+
+def _attach(buf, scopes, order):
+    '''
+    builds factors over the shared buffer in a worker process. It is
+    a pool initializer, so it is kept at module level.
+
+    Arguments:
+        buf
+            shared buffer of CPDs
+        scopes
+            list of (name, variables, offset) of factors
+        order
+            elimination order for queries
+    '''
+    data = np.frombuffer(buf, dtype=float)
+    factors = []
+    for (name, var, offset) in scopes:
+        size = int(np.prod([v.card for v in var]))
+        table = data[offset:offset + size].reshape([v.card for v in var])
+        table.flags.writeable = False
+        factors.append(ArrayFactor(name=name, var=var, table=table))
+    _worker['factors'] = factors
+    _worker['VE'] = VariableElimination(factors)
+    _worker['order'] = order
+
+
+def _run_batch(batch):
+    '''
+    answers a batch of queries given as (query indices, evidence
+    {index: value}) in a worker process. Returns list of (name, cpd).
+    '''
+    factors = _worker['factors']
+    results = []
+    for (query, evidence) in batch:
+        res = _worker['VE'].query([factors[i] for i in query],
+                        dict((factors[i], value)
+                                for (i, value) in evidence.iteritems()),
+                        _worker['order'])
+        results.append((res.name, np.asarray(res.cpd, dtype=float).tolist()))
+    return results
+
+
+class ParallelQuery(object):
+    '''
+    Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> T = Factor(name='Test', values=["pos", "neg"],
+            ...             cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> PQ = ParallelQuery([C, T], processes=2)
+            >>> R = PQ.map([([C], {T: 'pos'}), ([T], {})])
+            >>> PQ.close()
+            >>> [[round(p, 6) for p in r.cpd] for r in R]
+            [[0.956522, 0.043478], [0.207, 0.793]]
+
+    Fields:
+        factors
+            list of factors
+        processes
+            number of worker processes
+        buffer
+            shared buffer with CPDs of all factors one after another
+        scopes
+            list of (name, variables, offset in buffer) of factors
+
+    Changes of factors after the executor is built are not seen by it.
+    '''
+
+    def __init__(self, factors=None, processes=None, order='min-fill'):
+        '''
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> PQ = ParallelQuery([A, B], processes=1)
+            >>> list(PQ.buffer), PQ.scopes
+            ([0.6, 0.4, 0.7, 0.3, 0.2, 0.8], [('A', [A], 0), ('B', [A, B], 2)])
+
+        Arguments:
+            factors
+                list of factors
+            processes
+                number of worker processes, by default number of cores. With
+                1 queries run in this process.
+            order
+                elimination heuristic or order, see VariableElimination
+        '''
+        if not factors:
+            factors = []
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        self.factors = factors
+        self.processes = max(1, processes)
+        self.order = order
+        self.scopes = []
+        offset = 0
+        for fact in factors:
+            self.scopes.append((fact.name, list(fact.var), offset))
+            offset += len(fact.cpd)
+        self.buffer = RawArray('d', offset)
+        data = np.frombuffer(self.buffer, dtype=float)
+        for (fact, (name, var, offset)) in zip(factors, self.scopes):
+            data[offset:offset + len(fact.cpd)] = fact.cpd
+        self._index = dict((fact, i) for (i, fact) in enumerate(factors))
+        self._pool = None
+
+    def _task(self, query, evidence):
+        '''
+        converts query and evidence to indices of factors
+        '''
+        try:
+            return ([self._index[fact] for fact in query],
+                    dict((self._index[fact], value)
+                            for (fact, value) in evidence.iteritems()))
+        except KeyError:
+            raise AttributeError("Unable to query: factor is missing")
+
+    def _start(self):
+        if self._pool is None:
+            # workers are forked, so they inherit the buffer, not pickle it
+            self._pool = multiprocessing.Pool(self.processes, _attach,
+                                    (self.buffer, self.scopes, self.order))
+        return self._pool
+
+    def map(self, queries, batch=None):
+        '''
+        answers list of queries. Results are returned in the same order.
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> PQ = ParallelQuery([A, B], processes=1)
+            >>> R = PQ.map([([A], {B: 0}), ([A, B], {})])
+            >>> R[0].var, [round(p, 6) for p in R[0].cpd]
+            ([A], [0.84, 0.16])
+            >>> R[1].name, R[1].var
+            ('Marginal factor', [A, B])
+
+        Arguments:
+            queries
+                list of (query, evidence) as for Factor.query(): query is
+                list of factors and evidence is dict {factor: value}
+            batch
+                number of queries sent to a worker at once; by default
+                queries are split into four batches per worker
+        '''
+        tasks = [self._task(query or [], evidence or {})
+                    for (query, evidence) in queries]
+        if not tasks:
+            return []
+        if batch is None:
+            batch = -(-len(tasks) // (4 * self.processes))
+        batches = [tasks[i:i + batch] for i in xrange(0, len(tasks), batch)]
+        if self.processes == 1:
+            _attach(self.buffer, self.scopes, self.order)
+            results = map(_run_batch, batches)
+        else:
+            results = self._start().map(_run_batch, batches)
+
+        answers = []
+        for ((query, evidence), (name, cpd)) in zip(tasks,
+                                            chain(*results)):
+            var = Factor._canonical(self.factors[i].var[-1] for i in query)
+            answers.append(Factor(name=name, var=var, cpd=cpd))
+        return answers
+
+    def close(self):
+        '''
+        stops worker processes. The executor can still be used, new workers
+        are started on demand.
+        '''
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+class TestParallelQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.D = Factor(name='Difficulty', values=[0, 1], cpd=[0.6, 0.4])
+        self.I = Factor(name='Intelligence', values=['low', 'high'],
+                        cpd=[0.7, 0.3])
+        self.G = Factor(name='Grade|I,D', values=[1, 2, 3],
+                        cond=[self.D, self.I], cpd=[0.3, 0.4, 0.3,
+                                                0.05, 0.25, 0.7,
+                                                0.9, 0.08, 0.02,
+                                                0.5, 0.3, 0.2])
+        self.S = Factor(name='SAT|I', values=[0, 1], cond=[self.I],
+                        cpd=[0.95, 0.05, 0.2, 0.8])
+        self.L = Factor(name='Letter|G', values=[0, 1], cond=[self.G],
+                        cpd=[0.1, 0.9, 0.4, 0.6, 0.99, 0.01])
+        self.factors = [self.D, self.I, self.S, self.G, self.L]
+        self.queries = []
+        for g in [1, 2, 3]:
+            for s in [0, 1]:
+                self.queries.append(([self.I], {self.G: g, self.S: s}))
+                self.queries.append(([self.D, self.I], {self.G: g}))
+        self.queries.append(([self.L], {}))
+
+    def tearDown(self):
+        pass
+
+    def testmap(self):
+        VE = VariableElimination(self.factors)
+        for processes in [1, 3]:
+            PQ = ParallelQuery(self.factors, processes=processes)
+            try:
+                results = PQ.map(self.queries, batch=2)
+            finally:
+                PQ.close()
+            self.assertEqual(len(self.queries), len(results))
+            for ((query, evidence), res) in zip(self.queries, results):
+                expected = VE.query(query, evidence)
+                self.assertEqual(expected.var, res.var)
+                for (x, y) in zip(expected.cpd, res.cpd):
+                    self.assertAlmostEqual(x, y)
+
+    def testmissing(self):
+        A = Factor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+        PQ = ParallelQuery(self.factors, processes=1)
+        self.assertRaises(AttributeError, PQ.map, [([A], {})])
+        self.assertEqual([], PQ.map([]))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=False)
+##    doctest.testmod(verbose=True)
@@ -0,0 +1,668 @@
+'''
+    Sampling from bayesian nets. Samples are drawn in topological order of
+    the net, all N samples of a variable at once: parents' columns of the
+    sample array give row numbers of the variable's CPD, and values are
+    drawn from these rows by inverse CDF of uniform numbers. Samples are
+    integer arrays of numbers of values (see Variable.value), one column per
+    factor.
+
+    Gibbs sampling runs many chains at once: chains are split between worker
+    processes, and every worker updates its chains as vectors, one variable
+    at a time, from precomputed Markov blanket conditionals.
+'''
+
+import unittest
+import multiprocessing
+import numpy as np
+from pypgm.factor import Factor
+from pypgm.elimination import VariableElimination
+
+
+def topological(factors):
+    '''
+    returns given factors sorted so that every factor goes after factors
+    introducing the rest variables of its scope. Raises AttributeError if
+    a variable has no factor introducing it or the net has a cycle.
+
+    Syntax:
+        >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+        >>> B = Factor(name='B', values=[0, 1], cond=[A],
+        ...             cpd=[0.7, 0.3, 0.2, 0.8])
+        >>> C = Factor(name='C', values=[0, 1], cond=[B],
+        ...             cpd=[0.1, 0.9, 0.5, 0.5])
+        >>> topological([C, B, A])
+        [A, B, C]
+
+    Arguments:
+        factors
+            list of factors of a bayesian net
+    '''
+    owner = {}
+    for fact in factors:
+        owner[fact.var[-1]] = fact
+    res = []
+    state = {}                      # factor -> 1 while visited, 2 when done
+    for start in factors:
+        stack = [(start, False)]
+        while stack:
+            (fact, done) = stack.pop()
+            if done:
+                state[fact] = 2
+                res.append(fact)
+                continue
+            if state.get(fact) == 2:
+                continue
+            if state.get(fact) == 1:
+                raise AttributeError("Unable to sort: the net has a cycle")
+            state[fact] = 1
+            stack.append((fact, True))
+            for var in reversed(fact.var[:-1]):
+                if not var in owner:
+                    raise AttributeError("Unable to sort: no factor for " +
+                                            var.name)
+                if state.get(owner[var]) != 2:
+                    stack.append((owner[var], False))
+    return res
+
+
+class ForwardSampler(object):
+    '''
+    Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> T = Factor(name='Test', values=["pos", "neg"],
+            ...             cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> S = ForwardSampler([C, T])
+            >>> S.sample(5, seed=1)
+            array([[0, 0],
+                   [0, 0],
+                   [0, 1],
+                   [0, 1],
+                   [0, 1]])
+
+    Fields:
+        factors
+            list of factors of the net; columns of samples go in this order
+        order
+            numbers of factors in topological order
+    '''
+
+    def __init__(self, factors=None):
+        '''
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> ForwardSampler([B, A]).order
+            [1, 0]
+
+        Arguments:
+            factors
+                list of factors of a bayesian net
+        '''
+        if not factors:
+            factors = []
+
+        self.factors = factors
+        column = dict((fact, i) for (i, fact) in enumerate(factors))
+        self.order = [column[fact] for fact in topological(factors)]
+        var_column = dict((fact.var[-1], i) for (i, fact) in enumerate(factors))
+        self._plans = [self._plan(factors[i], var_column) for i in self.order]
+
+    def _plan(self, fact, var_column):
+        '''
+        returns (column of the factor, columns of parents, multipliers of
+        parents' values giving CPD row number, cumulative CPD columns,
+        normalized CPD rows)
+        '''
+        card = fact.var[-1].card
+        table = getattr(fact, 'table', None)      # ArrayFactor, not copied
+        if table is None:
+            table = fact.cpd
+        table = np.asarray(table, dtype=float).reshape(-1, card)
+        sums = table.sum(axis=1, keepdims=True)
+        cdf = np.cumsum(table, axis=1)
+        np.divide(cdf, sums, out=cdf, where=sums != 0)
+        prob = np.zeros_like(table)
+        np.divide(table, sums, out=prob, where=sums != 0)
+        parents = [var_column[var] for var in fact.var[:-1]]
+        steps = np.array([s // card for s in fact.stride[:-1]],
+                            dtype=np.intp)
+        cdf = [np.ascontiguousarray(cdf[:, k]) for k in range(card - 1)]
+        return (var_column[fact.var[-1]], parents, steps, cdf, prob)
+
+    def _draw(self, cdf, rows, uniform, out):
+        '''
+        writes to out numbers of values, drawn from given rows of cumulative
+        distributions by given uniform numbers: the number of value is the
+        number of CDF columns not exceeding the uniform number
+        '''
+        out[:] = 0
+        for column in cdf:
+            out += uniform >= column[rows]
+
+    def _rows(self, samples, parents, steps):
+        '''
+        returns CPD row numbers for given samples (variables by rows)
+        '''
+        rows = np.zeros(samples.shape[1], dtype=np.intp)
+        for (col, step) in zip(parents, steps):
+            rows += samples[col] * step
+        return rows
+
+    def sample(self, n, seed=None):
+        '''
+        draws n samples from the joint distribution of the net. Returns
+        integer ndarray n x len(factors), where [k, i] is the number of value
+        of factors[i].var[-1] in k-th sample.
+
+        Syntax:
+            >>> A = Factor(name='A', values=['a0', 'a1'], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> X = ForwardSampler([A, B]).sample(100000, seed=0)
+            >>> X.shape
+            (100000, 2)
+            >>> round(X[:, 1].mean(), 2)
+            0.5
+
+        Arguments:
+            n
+                number of samples
+            seed
+                seed of the random number generator; same seed gives same
+                samples
+        '''
+        rng = np.random.RandomState(seed)
+        samples = np.zeros((len(self.factors), n), dtype=np.intp)
+        for (col, parents, steps, cdf, prob) in self._plans:
+            rows = self._rows(samples, parents, steps)
+            self._draw(cdf, rows, rng.random_sample(n), samples[col])
+        return samples.T
+
+
+class LikelihoodWeighting(ForwardSampler):
+    '''
+    Approximate inference by likelihood weighting: evidence variables are
+    clamped to observed values, the rest are sampled from their CPDs, and
+    every sample is weighted by the product of CPD entries of observed
+    values. Samples are generated in vectorized blocks until the effective
+    sample size or the confidence interval width reaches its target.
+
+    Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.99, 0.01])
+            >>> T = Factor(name='Test', values=["pos", "neg"],
+            ...             cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> LW = LikelihoodWeighting([C, T])
+            >>> R = LW.query([C], {T: 'pos'}, ess=50000, seed=0)
+            >>> R.name, R.var
+            ('Marginal factor', [Cancer])
+            >>> [round(p, 2) for p in R.cpd]
+            [0.96, 0.04]
+            >>> LW.ess >= 50000
+            True
+
+    Fields:
+        samples
+            number of samples drawn by the last query
+        ess
+            effective sample size of the last query: (sum w)^2 / sum w^2
+        width
+            widest confidence interval of posterior probabilities of the
+            last query (normal approximation)
+
+        All other fields are the same as in ForwardSampler.
+    '''
+
+    def __init__(self, factors=None):
+        '''
+        Arguments:
+            factors
+                list of factors of a bayesian net
+        '''
+        ForwardSampler.__init__(self, factors)
+        self.samples = 0
+        self.ess = 0.0
+        self.width = None
+
+    def query(self, query=None, evidence=None, ess=None, width=None,
+                z=1.96, block=10000, limit=1000000, seed=None):
+        '''
+        estimates joint distribution of query variables given evidence.
+        Returns factor of the same type as the query factors over query
+        variables in canonical order, like exact queries do. Sampling stops
+        after a block, where the effective sample size reaches ess or the
+        confidence interval width falls to width, or when limit samples are
+        drawn. If neither target is given, limit samples are drawn.
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> LW = LikelihoodWeighting([A, B])
+            >>> R = LW.query([A], {B: 1}, width=0.02, seed=0)
+            >>> LW.width <= 0.02, LW.samples < 1000000
+            (True, True)
+            >>> [round(p, 1) for p in R.cpd]
+            [0.4, 0.6]
+
+        Arguments:
+            query
+                list of factors, which variables are queried
+            evidence
+                dict {factor: value} of observed values
+            ess
+                target effective sample size
+            width
+                target width of confidence intervals of all posterior
+                probabilities
+            z
+                quantile of the normal distribution for confidence
+                intervals; 1.96 gives 95% intervals
+            block
+                number of samples drawn at once
+            limit
+                maximal number of samples
+            seed
+                seed of the random number generator
+        '''
+        if not query: query = []
+        if not evidence: evidence = {}
+
+        query_ = Factor._canonical(fact.var[-1] for fact in query)
+        observed = {}
+        for (fact, value) in evidence.iteritems():
+            index = fact.var[-1].find_value(value)
+            if index is None:
+                raise AttributeError("Unknown value of variable " +
+                                        fact.var[-1].name)
+            observed[fact.var[-1]] = index
+        if set(query_) & set(observed):
+            raise AttributeError("Unable to query: variable is observed")
+
+        VE = VariableElimination(self.factors)
+        relevant = set(VE._relevant(query_ + observed.keys()))
+        column = dict((fact.var[-1], i) for (i, fact)
+                        in enumerate(self.factors))
+        plans = []
+        for (i, plan) in zip(self.order, self._plans):
+            if self.factors[i] in relevant:
+                plans.append(plan + (observed.get(self.factors[i].var[-1]),))
+        cols = [column[var] for var in query_]
+        steps = [1] * len(query_)
+        for k in range(len(query_) - 2, -1, -1):
+            steps[k] = steps[k+1] * query_[k+1].card
+        size = steps[0] * query_[0].card if query_ else 1
+
+        rng = np.random.RandomState(seed)
+        sum_w = np.zeros(size)          # sums of weights by query assignment
+        sum_w2 = np.zeros(size)         # sums of squared weights
+        self.samples = 0
+        while self.samples < limit:
+            n = min(block, limit - self.samples)
+            samples = np.zeros((len(self.factors), n), dtype=np.intp)
+            weights = np.ones(n)
+            for (col, parents, psteps, cdf, prob, value) in plans:
+                rows = self._rows(samples, parents, psteps)
+                if value is None:
+                    self._draw(cdf, rows, rng.random_sample(n), samples[col])
+                else:
+                    samples[col] = value
+                    weights *= prob[rows, value]
+            index = self._rows(samples, cols, steps)
+            sum_w += np.bincount(index, weights=weights, minlength=size)
+            sum_w2 += np.bincount(index, weights=weights ** 2, minlength=size)
+            self.samples += n
+            self._diagnose(sum_w, sum_w2, z)
+            if ess is not None and self.ess >= ess:
+                break
+            if width is not None and self.width is not None \
+                    and self.width <= width:
+                break
+
+        total = sum_w.sum()
+        post = sum_w / total if total > 0 else sum_w
+        cls = type(query[0]) if query else Factor
+        return cls(name='Marginal factor', var=query_,
+                    cpd=[float(p) for p in post])
+
+    def _diagnose(self, sum_w, sum_w2, z):
+        '''
+        updates ess and width out of accumulated sums of weights
+        '''
+        total = sum_w.sum()
+        total2 = sum_w2.sum()
+        if total <= 0:
+            self.ess = 0.0
+            self.width = None
+            return
+        self.ess = total ** 2 / total2
+        post = sum_w / total
+        var = (sum_w2 * (1 - post) ** 2 + (total2 - sum_w2) * post ** 2) \
+                / total ** 2
+        self.width = float(2 * z * np.sqrt(var.max()))
+
+
+def _gibbs_chains(args):
+    '''
+    runs a block of Gibbs chains as vectors and returns their traces:
+    ndarray chains x samples of numbers of query assignments. Kept at
+    module level for worker processes.
+    '''
+    (state, plans, cols, steps, burn, samples, seed) = args
+    rng = np.random.RandomState(seed)
+    trace = np.empty((state.shape[1], samples), dtype=np.intp)
+    rows = np.empty(state.shape[1], dtype=np.intp)
+    for t in xrange(burn + samples):
+        for (col, others, ssteps, cdf) in plans:
+            rows[:] = 0
+            for (o, s) in zip(others, ssteps):
+                rows += state[o] * s
+            uniform = rng.random_sample(len(rows))
+            out = state[col]
+            out[:] = 0
+            for column in cdf:
+                out += uniform >= column[rows]
+        if t >= burn:
+            index = trace[:, t - burn]
+            index[:] = 0
+            for (c, s) in zip(cols, steps):
+                index += state[c] * s
+    return trace
+
+
+def diagnostics(trace):
+    '''
+    returns (R-hat, effective sample size) of a scalar quantity, given its
+    traces in several chains. Chains are split in halves (split R-hat), and
+    ESS is computed out of autocorrelations, summed in pairs while the
+    pairs stay positive. Constant traces give (1.0, number of samples).
+
+    Syntax:
+        >>> rng = np.random.RandomState(0)
+        >>> (rhat, ess) = diagnostics(rng.normal(size=(4, 1000)))
+        >>> round(rhat, 2), 3000 < ess < 5000
+        (1.0, True)
+        >>> (rhat, ess) = diagnostics(np.arange(2000.0).reshape(2, 1000))
+        >>> rhat > 2, ess < 100
+        (True, True)
+
+    Arguments:
+        trace
+            ndarray chains x samples
+    '''
+    trace = np.asarray(trace, dtype=float)
+    half = trace.shape[1] // 2
+    x = np.concatenate([trace[:, :half], trace[:, half:2*half]])
+    (m, n) = x.shape
+    means = x.mean(axis=1)
+    within = x.var(axis=1, ddof=1).mean()
+    between = n * means.var(ddof=1)
+    var_hat = (n - 1.0) / n * within + between / n
+    if var_hat == 0:
+        return (1.0, float(m * n))
+    if within == 0:
+        return (float('inf'), 1.0)
+    rhat = float(np.sqrt(var_hat / within))
+
+    centered = x - means[:, np.newaxis]
+    spectrum = np.fft.rfft(centered, n=2*n)
+    acov = np.fft.irfft(spectrum * np.conj(spectrum))[:, :n] / n
+    rho = 1 - (within - acov.mean(axis=0)) / var_hat
+    tau = -1.0
+    for t in xrange(0, n - 1, 2):
+        pair = rho[t] + rho[t+1]
+        if pair < 0:
+            break
+        tau += 2 * pair
+    tau = max(tau, 1.0 / np.log10(m * n))  # bounds ESS of antithetic chains
+    return (rhat, m * n / tau)
+
+
+class GibbsSampler(ForwardSampler):
+    '''
+    Approximate inference by Gibbs sampling. Every unobserved variable is
+    resampled in turn from its distribution given its Markov blanket. These
+    conditionals are computed once per query as tables over the blanket,
+    so an update is a table lookup. Independent chains run in a process
+    pool and their counts are merged.
+
+    Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[0.8, 0.2])
+            >>> T = Factor(name='Test', values=["pos", "neg"],
+            ...             cond=[C], cpd=[0.2, 0.8, 0.9, 0.1])
+            >>> GS = GibbsSampler([C, T])
+            >>> R = GS.query([C], {T: 'pos'}, samples=5000, processes=1,
+            ...                 seed=0)
+            >>> R.name, R.var
+            ('Marginal factor', [Cancer])
+            >>> [round(p, 1) for p in R.cpd]
+            [0.5, 0.5]
+            >>> GS.rhat < 1.1
+            True
+
+    Fields:
+        samples
+            number of samples kept by the last query, in all chains
+        rhat
+            the worst (largest) split R-hat of indicators of query
+            assignments in the last query
+        ess
+            the worst (smallest) effective sample size of indicators of
+            query assignments in the last query
+
+        All other fields are the same as in ForwardSampler.
+    '''
+
+    def __init__(self, factors=None):
+        '''
+        Arguments:
+            factors
+                list of factors of a bayesian net
+        '''
+        ForwardSampler.__init__(self, factors)
+        self.samples = 0
+        self.rhat = None
+        self.ess = None
+
+    def _blanket(self, var, factors, column):
+        '''
+        returns (column of the variable, columns of its Markov blanket,
+        multipliers of their values giving row number, cumulative columns
+        of conditional distributions of the variable given the blanket)
+        '''
+        prod = None
+        for fact in factors:
+            if var in fact.var:
+                prod = fact * prod
+        others = [v for v in prod.var if v != var]
+        prod = prod.permute(others + [var])
+        table = np.asarray(prod.cpd, dtype=float).reshape(-1, var.card)
+        sums = table.sum(axis=1, keepdims=True)
+        cdf = np.cumsum(table, axis=1)
+        np.divide(cdf, sums, out=cdf, where=sums != 0)
+        ssteps = [s // var.card for s in prod.stride[:-1]]
+        cdf = [np.ascontiguousarray(cdf[:, k]) for k in range(var.card - 1)]
+        return (column[var], [column[v] for v in others], ssteps, cdf)
+
+    def query(self, query=None, evidence=None, samples=1000, burn=100,
+                chains=4, processes=None, seed=None):
+        '''
+        estimates joint distribution of query variables given evidence.
+        Returns factor of the same type as the query factors over query
+        variables in canonical order. Chains start from forward samples
+        with evidence clamped.
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.7, 0.3, 0.2, 0.8])
+            >>> GS = GibbsSampler([A, B])
+            >>> R = GS.query([A], {B: 1}, samples=2000, chains=2,
+            ...                 processes=2, seed=1)
+            >>> GS.samples
+            4000
+            >>> [round(p, 1) for p in R.cpd]
+            [0.4, 0.6]
+
+        Arguments:
+            query
+                list of factors, which variables are queried
+            evidence
+                dict {factor: value} of observed values
+            samples
+                number of samples kept in each chain
+            burn
+                number of sweeps discarded at the beginning of each chain
+            chains
+                number of independent chains
+            processes
+                number of worker processes; by default as many as chains or
+                CPUs, whichever is fewer. With 1 chains run in this process.
+            seed
+                seed of the random number generator
+        '''
+        if not query: query = []
+        if not evidence: evidence = {}
+
+        query_ = Factor._canonical(fact.var[-1] for fact in query)
+        observed = {}
+        for (fact, value) in evidence.iteritems():
+            index = fact.var[-1].find_value(value)
+            if index is None:
+                raise AttributeError("Unknown value of variable " +
+                                        fact.var[-1].name)
+            observed[fact.var[-1]] = index
+        if set(query_) & set(observed):
+            raise AttributeError("Unable to query: variable is observed")
+
+        VE = VariableElimination(self.factors)
+        relevant = VE._relevant(query_ + observed.keys())
+        column = dict((fact.var[-1], i) for (i, fact)
+                        in enumerate(self.factors))
+        plans = [self._blanket(fact.var[-1], relevant, column)
+                    for fact in topological(relevant)
+                    if not fact.var[-1] in observed]
+        cols = [column[var] for var in query_]
+        steps = [1] * len(query_)
+        for k in range(len(query_) - 2, -1, -1):
+            steps[k] = steps[k+1] * query_[k+1].card
+        size = steps[0] * query_[0].card if query_ else 1
+
+        rng = np.random.RandomState(seed)
+        state = self.sample(chains, seed=rng.randint(1 << 30)).T.copy()
+        for (var, index) in observed.iteritems():
+            state[column[var]] = index
+        if processes is None:
+            processes = min(chains, multiprocessing.cpu_count())
+        processes = max(1, min(processes, chains))
+        blocks = np.array_split(np.arange(chains), processes)
+        tasks = [(state[:, block], plans, cols, steps, burn, samples,
+                    rng.randint(1 << 30)) for block in blocks]
+        if processes == 1:
+            traces = map(_gibbs_chains, tasks)
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                traces = pool.map(_gibbs_chains, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        trace = np.concatenate(traces)
+
+        self.samples = trace.size
+        self.rhat = 1.0
+        self.ess = float(trace.size)
+        for k in range(size):
+            (rhat, ess) = diagnostics(trace == k)
+            self.rhat = max(self.rhat, rhat)
+            self.ess = min(self.ess, ess)
+        counts = np.bincount(trace.ravel(), minlength=size)
+        cls = type(query[0]) if query else Factor
+        return cls(name='Marginal factor', var=query_,
+                    cpd=[float(c) / trace.size for c in counts])
+
+
+class TestForwardSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.D = Factor(name='Difficulty', values=[0, 1], cpd=[0.6, 0.4])
+        self.I = Factor(name='Intelligence', values=['low', 'high'],
+                        cpd=[0.7, 0.3])
+        self.G = Factor(name='Grade|I,D', values=[1, 2, 3],
+                        cond=[self.D, self.I], cpd=[0.3, 0.4, 0.3,
+                                                0.05, 0.25, 0.7,
+                                                0.9, 0.08, 0.02,
+                                                0.5, 0.3, 0.2])
+        self.S = Factor(name='SAT|I', values=[0, 1], cond=[self.I],
+                        cpd=[0.95, 0.05, 0.2, 0.8])
+        self.L = Factor(name='Letter|G', values=[0, 1], cond=[self.G],
+                        cpd=[0.1, 0.9, 0.4, 0.6, 0.99, 0.01])
+        self.factors = [self.L, self.S, self.G, self.I, self.D]
+
+    def tearDown(self):
+        pass
+
+    def testtopological(self):
+        order = topological(self.factors)
+        for (i, fact) in enumerate(order):
+            for parent in fact.parents:
+                self.assertTrue(order.index(parent) < i)
+        A = Factor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+        B = Factor(name='B', values=[0, 1], cond=[A], cpd=[1, 0, 0, 1])
+        self.assertRaises(AttributeError, topological, [B])
+
+    def testsample(self):
+        X = ForwardSampler(self.factors).sample(200000, seed=7)
+        self.assertEqual((200000, 5), X.shape)
+        VE = VariableElimination(self.factors)
+        for (i, fact) in enumerate(self.factors):
+            freq = np.bincount(X[:, i], minlength=fact.var[-1].card) / 2e5
+            for (x, y) in zip(VE.query([fact]).cpd, freq):
+                self.assertAlmostEqual(x, y, places=2)
+
+    def testseed(self):
+        S = ForwardSampler(self.factors)
+        self.assertTrue((S.sample(100, seed=3) == S.sample(100, seed=3)).all())
+        self.assertFalse((S.sample(100, seed=3) == S.sample(100, seed=4)).all())
+
+    def testlikelihood_weighting(self):
+        LW = LikelihoodWeighting(self.factors)
+        VE = VariableElimination(self.factors)
+        evidence = {self.L: 0, self.S: 1}
+        R = LW.query([self.I, self.D], evidence, limit=300000, seed=1)
+        self.assertEqual(300000, LW.samples)
+        self.assertEqual(VE.query([self.I, self.D], evidence).var, R.var)
+        for (x, y) in zip(VE.query([self.I, self.D], evidence).cpd, R.cpd):
+            self.assertAlmostEqual(x, y, places=2)
+
+    def testlikelihood_weighting_stop(self):
+        LW = LikelihoodWeighting(self.factors)
+        LW.query([self.G], {self.L: 1}, ess=20000, block=1000, seed=2)
+        self.assertTrue(LW.ess >= 20000)
+        self.assertTrue(LW.samples < 1000000)
+        LW.query([self.G], {self.L: 1}, width=0.05, block=1000, seed=2)
+        self.assertTrue(LW.width <= 0.05)
+        self.assertRaises(AttributeError, LW.query, [self.L], {self.L: 1})
+
+    def testgibbs(self):
+        GS = GibbsSampler(self.factors)
+        VE = VariableElimination(self.factors)
+        evidence = {self.L: 0, self.S: 1}
+        R = GS.query([self.I, self.G], evidence, samples=5000, chains=4,
+                        processes=2, seed=3)
+        self.assertEqual(20000, GS.samples)
+        self.assertTrue(GS.rhat < 1.05)
+        self.assertTrue(0 < GS.ess <= 20000)
+        exact = VE.query([self.I, self.G], evidence)
+        self.assertEqual(exact.var, R.var)
+        for (x, y) in zip(exact.cpd, R.cpd):
+            self.assertAlmostEqual(x, y, delta=0.03)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=False)
+##    doctest.testmod(verbose=True)
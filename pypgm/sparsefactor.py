@@ -0,0 +1,537 @@
+'''
+    Factor with sparse storage: only non-zero values are kept, in a dict
+    {number of assignment: value}. Deterministic CPDs and their products are
+    mostly zeros, so product, marginalization, reduction and conditioning
+    visit only the non-zero entries. Results of operations are converted
+    automatically to ordinary (dense) factors when their fill ratio exceeds
+    SparseFactor.threshold, and dense operands are converted to sparse ones
+    on the fly.
+'''
+
+import unittest
+from itertools import izip
+from pypgm.variable import Variable
+from pypgm.factor import Factor
+
+
+class SparseFactor(Factor):
+    '''
+    Syntax:
+
+            >>> A = SparseFactor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+            >>> B = SparseFactor(name='B', values=[0, 1], cond=[A],
+            ...                 cpd=[1, 0, 0, 1])
+            >>> B.entries
+            {0: 1, 3: 1}
+            >>> B.cpd
+            [1, 0.0, 0.0, 1]
+            >>> B.fill()
+            0.5
+
+    Fields:
+        entries
+            dict {number of assignment: value} of all non-zero values of the
+            factor. Numbers of assignments are the same as indices in
+            Factor.cpd.
+        cpd
+            dense list of factor's values, computed out of entries on each
+            access. Assigning a list to it replaces entries; changing
+            elements of the returned list does not change the factor.
+        threshold
+            class-wide fill ratio, above which results of operations are
+            returned as dense Factor instances.
+
+        All other fields are the same as in Factor.
+    '''
+
+    threshold = 0.5
+
+    def __init__(self, name='',
+                        values=None,
+                        cond=None,
+                        cpd=None,
+                        var=None,
+                        entries=None):
+        '''
+        Syntax:
+            Arguments are the same as for Factor, both explicit and implicit
+            ways of defining variables are supported:
+                >>> C = Variable('Cancer', ['yes', 'no'])
+                >>> T = Variable('Test', ['pos', 'neg'])
+                >>> F = SparseFactor(name='T', var=[C,T], cpd=[1, 0, 0, 1])
+                >>> F.var, F.entries
+                ([Cancer, Test], {0: 1, 3: 1})
+                >>> SparseFactor(name='C', var=[C], entries={1: 1.0}).cpd
+                [0.0, 1.0]
+
+        Arguments:
+            entries
+                dict {number of assignment: value} of non-zero values. If
+                given, it is used as is, without copying, and cpd is ignored.
+
+            Other arguments are the same as for Factor.__init__().
+        '''
+        self.entries = {}
+        Factor.__init__(self, name=name, values=values, cond=cond, cpd=cpd,
+                        var=var)
+
+        if entries is not None:
+            self.entries = entries
+
+    def _get_cpd(self):
+        cpd = [0.0] * self.pcard[0]
+        for (i, val) in self.entries.iteritems():
+            cpd[i] = val
+        return cpd
+
+    def _set_cpd(self, cpd):
+        self.entries = dict((i, val) for (i, val) in enumerate(cpd)
+                                if val != 0)
+        self.changed()
+
+    cpd = property(_get_cpd, _set_cpd)
+
+    def fill(self):
+        '''
+        returns fill ratio: share of non-zero values of the factor
+
+        Syntax:
+            >>> A = SparseFactor(name='A', values=[0, 1, 2, 3],
+            ...                 cpd=[0.5, 0, 0, 0.5])
+            >>> A.fill()
+            0.5
+        '''
+        return float(len(self.entries)) / self.pcard[0]
+
+    def _digits(self, index):
+        '''
+        returns values' numbers of all variables of this factor's var list
+        in the assignment with given number
+
+        Syntax:
+            >>> A = SparseFactor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+            >>> B = SparseFactor(name='B', values=[0, 1, 2], cond=[A],
+            ...                 cpd=[1, 0, 0, 0, 0, 1])
+            >>> B._digits(5)
+            [1, 2]
+        '''
+        return [(index // s) % c for (s, c) in izip(self.stride, self.card)]
+
+    @classmethod
+    def from_factor(cls, factor):
+        '''
+        Builds a sparse copy of any factor. The copy shares variables,
+        conditions and parents with the original.
+
+        Syntax:
+            >>> C = Factor(name='Cancer', values=["no", "yes"],
+            ...             cpd=[1.0, 0.0])
+            >>> S = SparseFactor.from_factor(C)
+            >>> S.var == C.var, S.cons is C.cons
+            (True, True)
+            >>> S.entries
+            {0: 1.0}
+
+        Arguments:
+            factor
+                any factor
+        '''
+        if isinstance(factor, cls):
+            return factor
+        res = cls(name=factor.name, var=factor.var)
+        res.entries = dict((i, float(val)) for (i, val)
+                                in enumerate(factor.cpd) if val != 0)
+        res.cons = factor.cons
+        res.cond = list(factor.cond)
+        res.parents = list(factor.parents)
+        return res
+
+    def to_factor(self):
+        '''
+        Builds a dense copy of the factor. The copy shares variables,
+        conditions and parents with the original.
+
+        Syntax:
+            >>> A = SparseFactor(name='A', values=[0, 1], cpd=[0, 1.0])
+            >>> F = A.to_factor()
+            >>> type(F).__name__, F.cpd
+            ('Factor', [0.0, 1.0])
+        '''
+        res = Factor(name=self.name, var=self.var, cpd=self.cpd)
+        res.cons = self.cons
+        res.cond = list(self.cond)
+        res.parents = list(self.parents)
+        return res
+
+    @classmethod
+    def auto(cls, factor):
+        '''
+        returns the factor in storage, suitable for its fill ratio: sparse
+        if the share of non-zero values does not exceed threshold, dense
+        otherwise. Converts only if needed.
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1, 2, 3], cpd=[1, 0, 0, 0])
+            >>> type(SparseFactor.auto(A)).__name__
+            'SparseFactor'
+            >>> B = SparseFactor(name='B', values=[0, 1], cpd=[0.5, 0.5])
+            >>> type(SparseFactor.auto(B)).__name__
+            'Factor'
+
+        Arguments:
+            factor
+                any factor
+        '''
+        if isinstance(factor, cls):
+            if factor.fill() > cls.threshold:
+                return factor.to_factor()
+            return factor
+        if type(factor) is not Factor:
+            return factor               # other storages are kept as is
+        nonzero = sum(1 for val in factor.cpd if val != 0)
+        if nonzero <= cls.threshold * factor.pcard[0]:
+            return cls.from_factor(factor)
+        return factor
+
+    def __mul__(self, other):
+        '''
+        computes product of factors, joining non-zero entries of both on
+        values of shared variables
+        F(A,C)*F(C,B) = F(A,B,C)
+
+        Syntax:
+            >>> A = SparseFactor(name='A', values=[0, 1], cpd=[1.0, 0])
+            >>> B = SparseFactor(name='B', values=[0, 1], cond=[A],
+            ...                 cpd=[0.2, 0.8, 1.0, 0])
+            >>> P = B*A
+            >>> P.name, P.var, P.entries
+            ('Product', [A, B], {0: 0.2, 1: 0.8})
+        '''
+        if other is None:           # for compatibility
+            return self
+        other = SparseFactor.from_factor(other)
+        res = SparseFactor(name='Product',
+                    var=Factor._canonical(set(self.var) | set(other.var)))
+        res.cond = list(other.cond)
+        res.parents = list(other.parents)
+
+        shared = [v for v in self.var if v in other.var]
+        self_key = [self.var.index(v) for v in shared]
+        other_key = [other.var.index(v) for v in shared]
+        self_str = res._strides(self.var)
+        other_str = [0 if v in self.var else s
+                        for (v, s) in izip(other.var, res._strides(other.var))]
+
+        groups = {}
+        for (j, val) in other.entries.iteritems():
+            digits = other._digits(j)
+            key = tuple(digits[k] for k in other_key)
+            offset = sum(d * s for (d, s) in izip(digits, other_str))
+            groups.setdefault(key, []).append((offset, val))
+
+        entries = {}
+        for (i, val) in self.entries.iteritems():
+            digits = self._digits(i)
+            key = tuple(digits[k] for k in self_key)
+            base = sum(d * s for (d, s) in izip(digits, self_str))
+            for (offset, val2) in groups.get(key, ()):
+                prod = val * val2
+                if prod != 0:
+                    entries[base + offset] = prod
+        res.entries = entries
+        return SparseFactor.auto(res)
+
+    def __rmul__(self, other):
+        '''
+        product of a dense factor and a sparse one.
+
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+            >>> B = SparseFactor(name='B', values=[0, 1, 2, 3], cond=[A],
+            ...                 cpd=[1, 0, 0, 0, 0, 0, 0, 1])
+            >>> (A*B).entries
+            {0: 0.5, 7: 0.5}
+        '''
+        return SparseFactor.from_factor(other) * self
+
+    def marginal(self, var=None):
+        '''
+        perfoms a factor marginalization over non-zero entries
+        F(A,B,C)-B = F(A,C)
+
+        Syntax:
+            >>> A = SparseFactor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+            >>> B = SparseFactor(name='B', values=[0, 1, 2, 3], cond=[A],
+            ...                 cpd=[1, 0, 0, 0, 0, 0, 0, 1])
+            >>> M = B.marginal(A.cons)
+            >>> M.name, M.var, M.entries
+            ('Marginal factor', [B], {0: 1, 3: 1})
+        '''
+        if not var in self.var:
+            raise AttributeError("Unable to marginalize: variable is missing")
+
+        res = SparseFactor('Marginal factor',
+                        var=Factor._canonical(set(self.var) - set([var])))
+        strides = res._strides(self.var)
+        entries = {}
+        for (i, val) in self.entries.iteritems():
+            ind = sum(d * s for (d, s) in izip(self._digits(i), strides))
+            entries[ind] = entries.get(ind, 0) + val
+        res.entries = entries
+        return SparseFactor.auto(res)
+
+    def _reduce3(self, evidence):
+        '''
+        reduces the factor on all variables of given assignment at once,
+        keeping only non-zero entries consistent with the assignment.
+        Result is not normalized.
+
+        Syntax:
+            >>> A = SparseFactor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+            >>> B = SparseFactor(name='B', values=[0, 1], cpd=[0.5, 0.5])
+            >>> C = SparseFactor(name='C', values=[0, 1], cond=[A, B],
+            ...                 cpd=[1, 0, 1, 0, 1, 0, 0, 1])
+            >>> R = C._reduce3({C.cons: 0, B.cons: 0})
+            >>> R.name, R.var, R.cpd
+            ('Marginal factor', [A], [1, 1])
+        '''
+        wanted = []
+        for (var, value) in evidence.iteritems():
+            if not var in self.var:
+                raise AttributeError()
+            wanted.append((self.var.index(var), var.find_value(value)))
+
+        res = SparseFactor(name='Marginal factor',
+                        var=Factor._canonical(set(self.var) - set(evidence)))
+        entries = {}
+        if not [k for (k, index) in wanted if index is None]:
+            strides = res._strides(self.var)
+            for (i, val) in self.entries.iteritems():
+                digits = self._digits(i)
+                for (k, index) in wanted:
+                    if digits[k] != index:
+                        break
+                else:
+                    ind = sum(d * s for (d, s) in izip(digits, strides))
+                    entries[ind] = val
+        res.entries = entries
+        return SparseFactor.auto(res)
+
+    def _reduce1(self, var=None, value=''):
+        '''
+        Same as _reduce3() on a single variable.
+
+        Syntax:
+            >>> A = SparseFactor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+            >>> B = SparseFactor(name='B', values=[0, 1], cond=[A],
+            ...                 cpd=[1, 0, 0, 1])
+            >>> B._reduce1(var=B.cons, value=1).cpd
+            [0.0, 1]
+        '''
+        res = self._reduce3({var: value})
+        res.name = 'Reduced'
+        return res
+
+    def _reduce2(self, var=None, value=''):
+        '''
+        Same as _reduce3() on a single variable.
+
+        Syntax:
+            >>> A = SparseFactor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+            >>> B = SparseFactor(name='B', values=[0, 1], cond=[A],
+            ...                 cpd=[1, 0, 0, 1])
+            >>> B._reduce2(var=A.cons, value=0).cpd
+            [1, 0.0]
+        '''
+        return self._reduce3({var: value})
+
+    def __div__(self, other=None):
+        '''
+        conditions the factor on the variable of other factor, dividing
+        non-zero entries only
+
+        Syntax:
+            >>> A = SparseFactor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+            >>> B = SparseFactor(name='B', values=[0, 1, 2, 3], cond=[A],
+            ...                 cpd=[1, 0, 0, 0, 0, 0, 0, 1])
+            >>> D = (B*A)/A
+            >>> D.name, D.var, D.cond
+            ('Conditional', [A, B], [A])
+            >>> D.entries
+            {0: 1.0, 7: 1.0}
+        '''
+        t = Factor._canonical(set(other.var) - set(other.cond))
+        var = t[-1]
+        if not var in self.var:
+            raise AttributeError()
+
+        parents = sorted(set([other]) | set(self.parents),
+                            key=lambda f: f.var[-1].ordinal)
+        cond = [fact.var[-1] for fact in parents]
+        res = SparseFactor(name='Conditional',
+                        var=Factor._canonical(set(self.var) | set(cond)))
+        res.cond = cond
+        res.parents = parents
+
+        src = self
+        extra = [v for v in res.var if not v in self.var]
+        if extra:                   # parents outside of the scope
+            ones = Factor(var=extra)
+            ones.cpd = [1.0] * ones.pcard[0]
+            src = SparseFactor.from_factor(self * ones)
+
+        temp = Factor(var=t)
+        temp_str = temp._strides(src.var)
+        res_str = res._strides(src.var)
+        keyed = []
+        sums = {}
+        for (i, val) in src.entries.iteritems():
+            digits = src._digits(i)
+            k = sum(d * s for (d, s) in izip(digits, temp_str))
+            sums[k] = sums.get(k, 0) + val
+            keyed.append((sum(d * s for (d, s) in izip(digits, res_str)),
+                            k, val))
+        res.entries = dict((ind, float(val) / sums[k])
+                            for (ind, k, val) in keyed)
+        return SparseFactor.auto(res)
+
+    def __rdiv__(self, other):
+        '''
+        conditioning of a dense factor on a sparse one.
+
+        Syntax:
+            >>> A = SparseFactor(name='A', values=[0, 1], cpd=[1.0, 0])
+            >>> B = Factor(name='B', values=[0, 1], cond=[A],
+            ...             cpd=[0.2, 0.8, 0.5, 0.5])
+            >>> (B/A).cpd
+            [0.2, 0.8, 0.5, 0.5]
+        '''
+        return SparseFactor.from_factor(other) / self
+
+    def permute(self, var):
+        '''
+        returns the same factor with variables reordered according to given
+        list. Conditions, parents and induced variable are kept.
+
+        Syntax:
+            >>> A = SparseFactor(name='A', values=[0, 1], cpd=[0.5, 0.5])
+            >>> B = SparseFactor(name='B', values=[0, 1, 2], cond=[A],
+            ...                 cpd=[1, 0, 0, 0, 0, 1])
+            >>> R = B.permute([B.cons, A.cons])
+            >>> R.var, R.entries
+            ([B, A], {0: 1, 5: 1})
+
+        Arguments:
+            var
+                list of the same variables as in this factor's var list,
+                in new order
+        '''
+        if sorted(var) != sorted(self.var):
+            raise AttributeError("Unable to permute: scope doesn't match")
+
+        res = SparseFactor(name=self.name, var=list(var))
+        res.cons = self.cons
+        res.cond = list(self.cond)
+        res.parents = list(self.parents)
+        strides = res._strides(self.var)
+        res.entries = dict(
+                (sum(d * s for (d, s) in izip(self._digits(i), strides)), val)
+                for (i, val) in self.entries.iteritems())
+        return res
+
+    def sum(self):
+        '''
+        returns sum of all factor's values
+
+        Syntax:
+            >>> A = SparseFactor(name='A', values=[0, 1, 2], cpd=[2, 0, 1])
+            >>> A.sum()
+            3
+        '''
+        return sum(self.entries.itervalues())
+
+    def _norm(self):
+        '''
+        normalizes values of the factor to make all valies sum to 1.0
+        Warning: mutates the factor!
+        If factor sums to 0, does nothing
+
+        Syntax:
+            >>> A = SparseFactor(name='A', values=[0, 1, 2], cpd=[3, 0, 1])
+            >>> A._norm().entries
+            {0: 0.75, 2: 0.25}
+        '''
+        sum_ = float(self.sum())
+        if sum_ != 0:
+            self.entries = dict((i, val / sum_)
+                                for (i, val) in self.entries.iteritems())
+            self.changed()
+        return self
+
+
+class TestSparseFactor(unittest.TestCase):
+
+    def setUp(self):
+        # deterministic network of examples/inference.py: C = A and B
+        self.A = SparseFactor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+        self.B = SparseFactor(name='B', values=[0, 1], cpd=[0.3, 0.7])
+        self.C = SparseFactor(name='C|A,B', values=[0, 1],
+                        cond=[self.A, self.B],
+                        cpd=[1, 0, 1, 0, 1, 0, 0, 1])
+        self.dense = [Factor(name=f.name, var=f.var, cpd=f.cpd)
+                        for f in [self.A, self.B, self.C]]
+
+    def tearDown(self):
+        pass
+
+    def assertCpdEqual(self, first, second):
+        self.assertEqual(len(first), len(second))
+        for (x, y) in zip(first, second):
+            self.assertAlmostEqual(x, y)
+
+    def test__mul__(self):
+        (A, B, C) = self.dense
+        P = self.C * self.B * self.A
+        self.assertTrue(isinstance(P, SparseFactor))
+        self.assertEqual(4, len(P.entries))
+        self.assertCpdEqual((C * B * A).cpd, P.cpd)
+
+    def testmarginal(self):
+        (A, B, C) = self.dense
+        M = (self.C * self.A).marginal(self.A.cons)
+        self.assertCpdEqual((C * A).marginal(A.var[-1]).cpd, M.cpd)
+
+    def testreduce(self):
+        R = self.C.reduce(evidence={self.C.cons: 1})
+        self.assertEqual([self.A.cons, self.B.cons], R.var)
+        self.assertEqual({3: 1.0}, R.entries)
+
+    def test__div__(self):
+        (A, B, C) = self.dense
+        D = (self.C * self.B * self.A) / self.A
+        self.assertEqual([self.A.cons], D.cond)
+        self.assertCpdEqual(((C * B * A) / A).cpd, D.cpd)
+
+    def testauto(self):
+        M = self.C.marginal(self.C.cons)
+        self.assertEqual(Factor, type(M))
+        self.assertCpdEqual([1.0, 1.0, 1.0, 1.0], M.cpd)
+        Z = SparseFactor.auto(Factor(var=self.C.var, cpd=[0] * 7 + [1]))
+        self.assertTrue(isinstance(Z, SparseFactor))
+
+    def testquery(self):
+        from pypgm.elimination import VariableElimination
+        res = VariableElimination([self.A, self.B, self.C]).query(
+                    [self.A], {self.C: 0, self.B: 1})
+        self.assertCpdEqual([1.0, 0.0], res.cpd)
+        res = VariableElimination(self.dense).query(
+                    [self.dense[0]], {self.dense[2]: 0})
+        expected = VariableElimination([self.A, self.B, self.C]).query(
+                    [self.A], {self.C: 0})
+        self.assertCpdEqual(res.cpd, expected.cpd)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=False)
+##    doctest.testmod(verbose=True)
@@ -0,0 +1,286 @@
+'''
+    Binary storage of bayesian nets. A file holds a short JSON header with
+    variables, factors' scopes and parent links, followed by CPDs of all
+    factors as one contiguous array of little-endian doubles. Loading maps
+    the array into memory instead of reading it, so a large model opens
+    almost instantly, only touched pages are read, and processes opening
+    the same file share its pages in the OS page cache.
+
+    Layout: 8 bytes of MAGIC, header length as little-endian uint64, JSON
+    header padded with spaces up to a multiple of ALIGN bytes, CPD data.
+'''
+
+import unittest
+import os
+import json
+import struct
+import tempfile
+import numpy as np
+from pypgm.variable import Variable
+from pypgm.factor import Factor
+from pypgm.arrayfactor import ArrayFactor
+
+MAGIC = 'PYPGM\x00\x01\x00'
+ALIGN = 64
+DTYPE = '<f8'
+
+
+def _plain(value):
+    '''
+    returns value read from JSON with unicode strings turned back to str
+    where possible
+    '''
+    if isinstance(value, unicode):
+        try:
+            return str(value)
+        except UnicodeEncodeError:
+            return value
+    if isinstance(value, list):
+        return [_plain(x) for x in value]
+    return value
+
+
+def _values(fact):
+    '''
+    returns CPD of a factor as ndarray. Tables of ArrayFactors are taken as
+    they are, so mapped tables are not copied.
+    '''
+    table = getattr(fact, 'table', None)
+    if table is None:
+        table = np.asarray(fact.cpd, dtype=float)
+    return table
+
+
+def save(factors, path):
+    '''
+    writes factors to a file. CPDs are written one factor at a time. The
+    file is written under a temporary name and renamed, so nets, which
+    have the old file mapped, keep reading the old data.
+
+    Syntax:
+        >>> C = Factor(name='Cancer', values=["no", "yes"], cpd=[0.99, 0.01])
+        >>> T = Factor(name='Test', values=["pos", "neg"], cond=[C],
+        ...             cpd=[0.2, 0.8, 0.9, 0.1])
+        >>> (handle, path) = tempfile.mkstemp()
+        >>> os.close(handle)
+        >>> save([C, T], path)
+        >>> BN = load(path)
+        >>> [(fact.name, fact.cond, fact.cpd.tolist()) for fact in BN.factors]
+        [('Cancer', [], [0.99, 0.01]), ('Test', [Cancer], [0.2, 0.8, 0.9, 0.1])]
+        >>> os.remove(path)
+
+    Arguments:
+        factors
+            list of factors, for ex. Bayesian.factors
+        path
+            file name
+    '''
+    variables = Factor._canonical(set(v for fact in factors
+                                        for v in fact.var))
+    number = dict((var, i) for (i, var) in enumerate(variables))
+    position = dict((fact, i) for (i, fact) in enumerate(factors))
+    header = {'dtype': DTYPE, 'variables': [], 'factors': []}
+    for var in variables:
+        header['variables'].append({'name': var.name, 'values': var.value})
+    offset = 0
+    for fact in factors:
+        size = _values(fact).size
+        if size != fact.pcard[0]:
+            raise AttributeError("Factor has no CPD: " + fact.name)
+        missing = [p for p in fact.parents if not p in position]
+        if missing:
+            raise AttributeError("Parent factor is missing: " +
+                                    missing[0].name)
+        header['factors'].append({'name': fact.name,
+                'var': [number[v] for v in fact.var],
+                'cons': number[fact.cons] if fact.cons is not None else None,
+                'cond': [number[v] for v in fact.cond],
+                'parents': [position[p] for p in fact.parents],
+                'offset': offset, 'size': size})
+        offset += size
+    header['count'] = offset
+    text = json.dumps(header, separators=(',', ':'))
+    start = len(MAGIC) + 8 + len(text)
+    padding = -start % ALIGN
+    (handle, temp) = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    stream = os.fdopen(handle, 'wb')
+    try:
+        stream.write(MAGIC)
+        stream.write(struct.pack('<Q', len(text) + padding))
+        stream.write(text)
+        stream.write(' ' * padding)
+        for fact in factors:
+            np.ascontiguousarray(_values(fact), dtype=DTYPE).tofile(stream)
+        stream.close()
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp, 0666 & ~umask)   # mkstemp makes private files
+        os.rename(temp, path)
+    except:
+        stream.close()
+        os.remove(temp)
+        raise
+
+
+def _header(path):
+    '''
+    returns JSON header of a file and offset of its data
+    '''
+    stream = open(path, 'rb')
+    try:
+        if stream.read(len(MAGIC)) != MAGIC:
+            raise AttributeError("Not a pypgm file: " + path)
+        (length, ) = struct.unpack('<Q', stream.read(8))
+        header = json.loads(stream.read(length))
+    finally:
+        stream.close()
+    return (header, len(MAGIC) + 8 + length)
+
+
+def load(path, mmap=True):
+    '''
+    reads bayesian net from a file. Returns Bayesian.
+
+    Syntax:
+        >>> A = Factor(name='A', values=[0, 1], cpd=[0.6, 0.4])
+        >>> B = Factor(name='B', values=['b0', 'b1'], cond=[A],
+        ...             cpd=[0.7, 0.3, 0.2, 0.8])
+        >>> (handle, path) = tempfile.mkstemp()
+        >>> os.close(handle)
+        >>> save([A, B], path)
+        >>> BN = load(path, mmap=False)
+        >>> [(fact.var, fact.var[-1].value) for fact in BN.factors]
+        [([A], [0, 1]), ([A, B], ['b0', 'b1'])]
+        >>> BN.factors[1].parents[0] is BN.factors[0]
+        True
+        >>> BN.query([BN.factors[0]], {BN.factors[1]: 'b1'}).cpd
+        [0.36, 0.6400000000000001]
+        >>> os.remove(path)
+
+    Arguments:
+        path
+            file name
+        mmap
+            if True, factors are ArrayFactors, which tables are read-only
+            views of the file mapped into memory (written to, a table is
+            copied first); otherwise factors are Factors with CPDs read
+            into lists
+    '''
+    from pypgm.bayesian import Bayesian
+    (header, offset) = _header(path)
+    count = header['count']
+    if mmap and count:
+        data = np.memmap(path, dtype=header['dtype'], mode='r',
+                            offset=offset, shape=(count, ))
+    else:
+        stream = open(path, 'rb')
+        try:
+            stream.seek(offset)
+            data = np.fromfile(stream, dtype=header['dtype'], count=count)
+        finally:
+            stream.close()
+    variables = [Variable(_plain(var['name']), _plain(var['values']))
+                    for var in header['variables']]
+    factors = []
+    for item in header['factors']:
+        var = [variables[i] for i in item['var']]
+        block = data[item['offset']:item['offset'] + item['size']]
+        if mmap:
+            table = np.asarray(block).reshape([v.card for v in var])
+            fact = ArrayFactor(name=_plain(item['name']), var=var,
+                                table=table)
+        else:
+            fact = Factor(name=_plain(item['name']), var=var,
+                            cpd=block.tolist())
+        if item['cons'] is not None:
+            fact.cons = variables[item['cons']]
+        fact.cond = [variables[i] for i in item['cond']]
+        fact.parents = [factors[i] for i in item['parents']]
+        factors.append(fact)
+    return Bayesian(factors)
+
+
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.D = Factor(name='Difficulty', values=[0, 1], cpd=[0.6, 0.4])
+        self.I = Factor(name='Intelligence', values=['low', 'high'],
+                        cpd=[0.7, 0.3])
+        self.G = Factor(name='Grade|I,D', values=[1, 2, 3],
+                        cond=[self.D, self.I], cpd=[0.3, 0.4, 0.3,
+                                                0.05, 0.25, 0.7,
+                                                0.9, 0.08, 0.02,
+                                                0.5, 0.3, 0.2])
+        self.S = Factor(name='SAT|I', values=[0, 1], cond=[self.I],
+                        cpd=[0.95, 0.05, 0.2, 0.8])
+        self.L = Factor(name='Letter|G', values=[0, 1], cond=[self.G],
+                        cpd=[0.1, 0.9, 0.4, 0.6, 0.99, 0.01])
+        self.factors = [self.D, self.I, self.S, self.G, self.L]
+        (handle, self.path) = tempfile.mkstemp(suffix='.pgm')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def testround_trip(self):
+        from pypgm.bayesian import Bayesian
+        save(self.factors, self.path)
+        expected = Bayesian(self.factors).query([self.I],
+                                                {self.L: 0, self.S: 1})
+        for mmap in [True, False]:
+            BN = load(self.path, mmap)
+            for (fact, loaded) in zip(self.factors, BN.factors):
+                self.assertEqual(fact.name, loaded.name)
+                self.assertEqual(list(fact.cpd), list(loaded.cpd))
+                self.assertEqual([v.name for v in fact.var],
+                                    [v.name for v in loaded.var])
+                self.assertEqual(fact.var[-1].value, loaded.var[-1].value)
+                self.assertEqual([p.name for p in fact.parents],
+                                    [p.name for p in loaded.parents])
+                self.assertEqual(loaded.cond, loaded.var[:-1])
+                self.assertTrue(loaded.cons is loaded.var[-1])
+            (G, I, L, S) = (BN.factors[3], BN.factors[1], BN.factors[4],
+                            BN.factors[2])
+            R = BN.query([I], {L: 0, S: 1})
+            for (x, y) in zip(expected.cpd, R.cpd):
+                self.assertAlmostEqual(x, y)
+            self.assertEqual(str, type(I.var[-1].value[0]))
+
+    def testmmap(self):
+        save(self.factors, self.path)
+        self.assertEqual(0, (os.path.getsize(self.path) - 8 * 26) % ALIGN)
+        BN = load(self.path)
+        G = BN.factors[3]
+
+        def mapped(fact):
+            base = fact.table
+            while base is not None and not isinstance(base, np.memmap):
+                base = base.base
+            return base is not None
+
+        self.assertTrue(all(mapped(fact) for fact in BN.factors))
+        self.assertFalse(G.table.flags.writeable)
+        self.assertEqual(0.3, G.cpd[0])
+        self.assertRaises(ValueError, G.cpd.__setitem__, 0, 0.5)
+        BN.sample(10, seed=1)
+        BN.query([BN.factors[1]], {BN.factors[4]: 0})
+        save(BN.factors, self.path)     # mapped tables are written as is
+        self.assertTrue(all(mapped(fact) for fact in BN.factors))
+        G.cpd = [0.5] + list(G.cpd[1:])         # copied, the file is intact
+        self.assertFalse(mapped(G))
+        self.assertEqual(0.3, load(self.path).factors[3].cpd[0])
+
+    def testerrors(self):
+        stream = open(self.path, 'wb')
+        stream.write('not a model')
+        stream.close()
+        self.assertRaises(AttributeError, load, self.path)
+        self.assertRaises(AttributeError, save, [self.S], self.path)
+        A = Factor(name='A', values=[0, 1])
+        self.assertRaises(AttributeError, save, [A], self.path)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=False)
+##    doctest.testmod(verbose=True)
@@ -0,0 +1,498 @@
+'''
+    Structure learning: a bayesian net is searched for, which fits data
+    best by BIC or BDeu score. Both scores are sums of family scores (a
+    variable given its parents), so a move of hill climbing (adding,
+    removing or reversing an edge) changes scores of one or two families
+    only. Family scores are cached by (child, parents), and scores of new
+    families needed for candidate moves are computed in a process pool.
+    Data are reduced to a CountIndex, so families are counted over distinct
+    records instead of all records.
+'''
+
+import unittest
+import math
+import multiprocessing
+from collections import deque
+import numpy as np
+from pypgm.factor import Factor
+from pypgm.bayesian import Bayesian
+from pypgm.learning import MaximumLikelihood
+from pypgm.counts import CountIndex
+
+_lgamma = np.vectorize(math.lgamma, otypes=[float])
+
+_worker = {}            # data of a worker process, see _attach()
+
+
+def family_score(codes, cards, child, parents, score='bic', ess=1.0,
+                    weights=None):
+    '''
+    returns score of a family: variable with given parents
+
+    Syntax:
+        >>> codes = np.array([[0, 0, 1, 1], [0, 0, 1, 0]])
+        >>> round(family_score(codes, [2, 2], 1, (), 'bic'), 6)
+        -2.942488
+        >>> round(family_score(codes, [2, 2], 1, (0, ), 'bic'), 6)
+        -2.772589
+        >>> round(family_score(codes, [2, 2], 1, (0, ), 'bdeu', 1.0), 6)
+        -3.360375
+        >>> codes = np.array([[0, 1, 1], [0, 1, 0]])
+        >>> round(family_score(codes, [2, 2], 1, (0, ), 'bdeu', 1.0,
+        ...                     weights=np.array([2, 1, 1])), 6)
+        -3.360375
+
+    Arguments:
+        codes
+            integer ndarray V x N: value numbers of V variables in N records
+        cards
+            cardinalities of variables
+        child
+            number of the variable
+        parents
+            tuple of numbers of its parents
+        score
+            'bic' or 'bdeu'
+        ess
+            equivalent sample size of BDeu prior
+        weights
+            numbers of records with each column of codes, by default ones
+    '''
+    n = codes.shape[1] if weights is None else weights.sum()
+    k = cards[child]
+    q = 1
+    flat = np.zeros(codes.shape[1], dtype=np.intp)
+    for p in parents:
+        flat = flat * cards[p] + codes[p]
+        q *= cards[p]
+    flat = flat * k + codes[child]
+    if q * k <= 4 * codes.shape[1] + 1024:
+        cells = np.bincount(flat, weights, minlength=q * k)
+        values = np.flatnonzero(cells)
+        cells = cells[values]
+    else:
+        (values, inverse) = np.unique(flat, return_inverse=True)
+        cells = np.bincount(inverse, weights)
+    (rows, inverse) = np.unique(values // k, return_inverse=True)
+    cells = cells.astype(float)
+    totals = np.bincount(inverse, weights=cells)
+    if score == 'bic':
+        loglik = np.dot(cells, np.log(cells / totals[inverse]))
+        return float(loglik - 0.5 * math.log(n) * q * (k - 1))
+    row = ess / q
+    cell = ess / (q * k)
+    return float(len(rows) * math.lgamma(row) - _lgamma(row + totals).sum()
+                 + _lgamma(cell + cells).sum() - len(cells) * math.lgamma(cell))
+
+
+def _attach(codes, weights, cards, score, ess):
+    '''
+    keeps data in a worker process. It is a pool initializer, so it is kept
+    at module level.
+    '''
+    _worker['args'] = (codes, weights, cards)
+    _worker['score'] = (score, ess)
+
+
+def _score_families(families):
+    '''
+    returns scores of list of (child, parents) in a worker process
+    '''
+    (codes, weights, cards) = _worker['args']
+    (score, ess) = _worker['score']
+    return [family_score(codes, cards, child, parents, score, ess, weights)
+            for (child, parents) in families]
+
+
+class HillClimbing(object):
+    '''
+    Syntax:
+            >>> rng = np.random.RandomState(0)
+            >>> a = rng.randint(2, size=2000)
+            >>> b = np.where(rng.random_sample(2000) < 0.9, a, 1 - a)
+            >>> c = rng.randint(2, size=2000)
+            >>> A = Factor(name='A', values=[0, 1])
+            >>> B = Factor(name='B', values=[0, 1])
+            >>> C = Factor(name='C', values=[0, 1])
+            >>> HC = HillClimbing([A, B, C], processes=1)
+            >>> BN = HC.fit({'A': a, 'B': b, 'C': c})
+            >>> [(fact.name, fact.cond) for fact in BN.factors]
+            [('B', []), ('C', []), ('A', [B])]
+            >>> [round(p, 2) for p in BN.factors[2].cpd]
+            [0.89, 0.11, 0.12, 0.88]
+
+    Fields:
+        factors
+            list of factors, which variables are modeled; their parents
+            are ignored
+        score
+            'bic' or 'bdeu'
+        ess
+            equivalent sample size of BDeu prior
+        max_parents
+            maximal number of parents of a variable, None for no limit
+        tabu
+            length of tabu list. With 0 the search is plain hill climbing
+            and stops, when no move improves the score; otherwise the
+            best move, which doesn't undo one of the last tabu moves, is
+            made even if it worsens the score, and the search stops after
+            tabu moves without improvement of the best score found.
+        max_iter
+            maximal number of moves
+        processes
+            number of worker processes scoring families
+        cache
+            dict {(child, parents): family score}, numbers of variables
+            are positions in factors, parents is a sorted tuple
+        hits, misses
+            numbers of cached and computed family scores
+        parents
+            dict {variable number: list of parent numbers} of the best
+            structure found
+        total
+            score of the best structure
+        history
+            list of scores after every move
+        index
+            CountIndex of data
+    '''
+
+    scores = ('bic', 'bdeu')
+
+    def __init__(self, factors=None, score='bic', ess=1.0, max_parents=None,
+                    tabu=0, max_iter=1000, processes=None):
+        '''
+        Syntax:
+            >>> A = Factor(name='A', values=[0, 1])
+            >>> HC = HillClimbing([A], score='bdeu', ess=10)
+            >>> HC.score, HC.ess, HC.cache
+            ('bdeu', 10, {})
+            >>> HillClimbing([A], score='aic')
+            Traceback (most recent call last):
+            ...
+            AttributeError: Unknown score: aic
+
+        Arguments:
+            factors
+                list of factors, which variables are modeled
+            score
+                'bic' or 'bdeu'
+            ess
+                equivalent sample size of BDeu prior
+            max_parents
+                maximal number of parents of a variable
+            tabu
+                length of tabu list
+            max_iter
+                maximal number of moves
+            processes
+                number of worker processes, by default number of cores. With
+                1 families are scored in this process.
+        '''
+        if not factors:
+            factors = []
+        if not score in self.scores:
+            raise AttributeError("Unknown score: " + score)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        self.factors = factors
+        self.score = score
+        self.ess = ess
+        self.max_parents = max_parents
+        self.tabu = tabu
+        self.max_iter = max_iter
+        self.processes = max(1, processes)
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.parents = dict((i, []) for i in range(len(factors)))
+        self.total = None
+        self.history = []
+        self.index = None
+        self._pool = None
+
+    def _score(self, families):
+        '''
+        fills the cache with scores of given families. New families are
+        scored in the pool, if there are enough of them.
+        '''
+        todo = []
+        for family in families:
+            if family in self.cache:
+                self.hits += 1
+            elif not family in todo:
+                todo.append(family)
+        self.misses += len(todo)
+        if not todo:
+            return
+        if self._pool is None or len(todo) < 2 * self.processes:
+            results = _score_families(todo)
+        else:
+            size = -(-len(todo) // (4 * self.processes))
+            parts = self._pool.map(_score_families,
+                        [todo[i:i + size] for i in xrange(0, len(todo), size)])
+            results = [x for part in parts for x in part]
+        self.cache.update(zip(todo, results))
+
+    def _path(self, parents, src, dst, skip=None):
+        '''
+        returns True if there is a directed path from src to dst, not
+        using the edge skip
+        '''
+        stack = [dst]
+        seen = set()
+        while stack:
+            node = stack.pop()              # walk back from dst
+            if node == src:
+                return True
+            if node in seen:
+                continue
+            seen.add(node)
+            stack.extend(p for p in parents[node] if (p, node) != skip)
+        return False
+
+    def _moves(self, parents):
+        '''
+        returns list of candidate moves (kind, i, j) with families they
+        score: [(child, new parents)]
+        '''
+        moves = []
+        for j in parents:
+            for i in parents:
+                if i == j:
+                    continue
+                if i in parents[j]:
+                    rest = tuple(p for p in parents[j] if p != i)
+                    moves.append((('remove', i, j), [(j, rest)]))
+                    if self.max_parents is None or \
+                            len(parents[i]) < self.max_parents:
+                        moves.append((('reverse', i, j), [(j, rest),
+                                (i, tuple(sorted(parents[i] + [j])))]))
+                elif not j in parents[i] and (self.max_parents is None or
+                                    len(parents[j]) < self.max_parents):
+                    moves.append((('add', i, j),
+                                    [(j, tuple(sorted(parents[j] + [i])))]))
+        return moves
+
+    def _acyclic(self, parents, move):
+        (kind, i, j) = move
+        if kind == 'add':
+            return not self._path(parents, j, i)
+        if kind == 'reverse':
+            return not self._path(parents, i, j, skip=(i, j))
+        return True
+
+    def _apply(self, parents, move):
+        (kind, i, j) = move
+        if kind in ('remove', 'reverse'):
+            parents[j] = [p for p in parents[j] if p != i]
+        if kind == 'add':
+            parents[j] = sorted(parents[j] + [i])
+        if kind == 'reverse':
+            parents[i] = sorted(parents[i] + [j])
+
+    def search(self):
+        '''
+        runs the search over loaded data and sets parents, total and
+        history
+        '''
+        parents = dict((i, []) for i in range(len(self.factors)))
+        self._score([(i, ()) for i in parents])
+        current = dict((i, self.cache[(i, ())]) for i in parents)
+        total = sum(current.values())
+        best = (total, dict((i, list(p)) for (i, p) in parents.items()))
+        tabu = deque(maxlen=max(self.tabu, 1))
+        inverse = {'add': 'remove', 'remove': 'add', 'reverse': 'reverse'}
+        self.history = []
+        stall = 0
+        while len(self.history) < self.max_iter:
+            moves = self._moves(parents)
+            self._score([family for (move, families) in moves
+                            for family in families])
+            ranked = []
+            for (move, families) in moves:
+                delta = sum(self.cache[(child, rest)] - current[child]
+                            for (child, rest) in families)
+                ranked.append((delta, move, families))
+            ranked.sort(key=lambda x: -x[0])
+            chosen = None
+            for (delta, move, families) in ranked:
+                if self.tabu and move in tabu:
+                    continue
+                if self._acyclic(parents, move):
+                    chosen = (delta, move, families)
+                    break
+            if chosen is None or (not self.tabu and chosen[0] <= 1e-9):
+                break
+            (delta, move, families) = chosen
+            self._apply(parents, move)
+            for (child, rest) in families:
+                current[child] = self.cache[(child, rest)]
+            total += delta
+            self.history.append(total)
+            (kind, i, j) = move
+            tabu.append((inverse[kind], j, i) if kind == 'reverse'
+                            else (inverse[kind], i, j))
+            if total > best[0] + 1e-9:
+                best = (total, dict((i, list(p)) for (i, p) in parents.items()))
+                stall = 0
+            else:
+                stall += 1
+                if stall >= self.tabu:
+                    break
+        (self.total, self.parents) = best
+
+    def network(self):
+        '''
+        returns Bayesian with the found structure and factors without CPDs.
+        Factors go in topological order; their variables are the same as
+        variables of given factors.
+        '''
+        column = dict((fact.var[-1], i) for (i, fact)
+                        in enumerate(self.factors))
+        made = {}
+        order = []
+        while len(made) < len(self.factors):
+            for i in range(len(self.factors)):
+                if not i in made and all(p in made for p in self.parents[i]):
+                    var = self.factors[i].var[-1]
+                    cond = Factor._canonical(self.factors[p].var[-1]
+                                                for p in self.parents[i])
+                    fact = Factor(name=var.name, var=cond + [var])
+                    fact.cons = var
+                    fact.cond = cond
+                    fact.parents = [made[column[v]] for v in cond]
+                    made[i] = fact
+                    order.append(fact)
+        return Bayesian(order)
+
+    def fit(self, source, laplace=0.0, chunk=100000):
+        '''
+        learns structure and CPDs (by maximum likelihood) from data.
+        Returns Bayesian.
+
+        Arguments:
+            source
+                CSV file name or file object with header line of variable
+                names, dict {variable name: column} or iterable of such
+                dicts
+            laplace
+                pseudocount added to every count of CPDs
+            chunk
+                number of CSV rows read at once
+        '''
+        self.index = CountIndex(self.factors, source, chunk)
+        if not self.index.records:
+            raise AttributeError("No data to learn from")
+        codes = np.ascontiguousarray(self.index.rows.T, dtype=np.intp)
+        weights = self.index.weights
+        if len(weights) == self.index.records:
+            weights = None              # all records are distinct
+        args = (codes, weights,
+                [fact.var[-1].card for fact in self.factors],
+                self.score, self.ess)
+        _attach(*args)
+        if self.processes > 1:
+            # workers are forked, so they inherit data, not pickle it
+            self._pool = multiprocessing.Pool(self.processes, _attach, args)
+        try:
+            self.search()
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+        BN = self.network()
+        ML = MaximumLikelihood(BN.factors, laplace)
+        for (fact, counts) in zip(BN.factors, ML.counts):
+            counts += self.index.table(fact.parents + [fact])
+        ML.estimate()
+        return BN
+
+
+class TestHillClimbing(unittest.TestCase):
+
+    def setUp(self):
+        self.D = Factor(name='Difficulty', values=[0, 1], cpd=[0.6, 0.4])
+        self.I = Factor(name='Intelligence', values=['low', 'high'],
+                        cpd=[0.7, 0.3])
+        self.G = Factor(name='Grade', values=[1, 2, 3],
+                        cond=[self.D, self.I], cpd=[0.3, 0.4, 0.3,
+                                                0.05, 0.25, 0.7,
+                                                0.9, 0.08, 0.02,
+                                                0.5, 0.3, 0.2])
+        self.S = Factor(name='SAT', values=[0, 1], cond=[self.I],
+                        cpd=[0.95, 0.05, 0.2, 0.8])
+        self.L = Factor(name='Letter', values=[0, 1], cond=[self.G],
+                        cpd=[0.1, 0.9, 0.4, 0.6, 0.99, 0.01])
+        self.factors = [self.D, self.I, self.S, self.G, self.L]
+        from pypgm.sampling import ForwardSampler
+        self.samples = samples = ForwardSampler(self.factors).sample(5000,
+                                                                    seed=4)
+        self.data = dict((fact.var[-1].name, samples[:, k])
+                            for (k, fact) in enumerate(self.factors))
+        self.data['Intelligence'] = np.array(['low', 'high'])[
+                                                self.data['Intelligence']]
+        self.data['Grade'] = self.data['Grade'] + 1
+
+    def tearDown(self):
+        pass
+
+    def _skeleton(self, BN):
+        return set(frozenset([v.name, fact.var[-1].name])
+                    for fact in BN.factors for v in fact.cond)
+
+    def testrecover(self):
+        expected = set(frozenset(edge) for edge in [('Difficulty', 'Grade'),
+                    ('Intelligence', 'Grade'), ('Intelligence', 'SAT'),
+                    ('Grade', 'Letter')])
+        for score in HillClimbing.scores:
+            HC = HillClimbing(self.factors, score=score, processes=1)
+            BN = HC.fit(self.data)
+            self.assertEqual(expected, self._skeleton(BN))
+            self.assertAlmostEqual(HC.total, HC.history[-1])
+            for (x, y) in zip(HC.history, HC.history[1:]):
+                self.assertTrue(x < y)
+            for fact in BN.factors:
+                self.assertTrue(fact.var[-1] in
+                                [f.var[-1] for f in self.factors])
+                for (parent, var) in zip(fact.parents, fact.cond):
+                    self.assertTrue(parent.var[-1] is var)
+            # learned net answers queries
+            R = BN.query([BN.factors[0]])
+            self.assertAlmostEqual(1.0, sum(R.cpd))
+
+    def testcache(self):
+        HC = HillClimbing(self.factors, processes=1)
+        HC.fit(self.data)
+        families = len(HC.cache)
+        self.assertEqual(families, HC.misses)
+        self.assertTrue(HC.hits > HC.misses)
+        for ((child, parents), score) in HC.cache.items():
+            self.assertEqual(tuple(sorted(parents)), parents)
+            self.assertAlmostEqual(score, family_score(self.samples.T,
+                    [f.var[-1].card for f in self.factors], child, parents))
+        self.assertTrue(len(HC.index.rows) < 5000)
+
+    def testpool(self):
+        single = HillClimbing(self.factors, score='bdeu', processes=1)
+        single.fit(self.data)
+        pooled = HillClimbing(self.factors, score='bdeu', processes=2)
+        pooled.fit(self.data)
+        self.assertEqual(single.parents, pooled.parents)
+        self.assertAlmostEqual(single.total, pooled.total)
+
+    def testtabu_max_parents(self):
+        HC = HillClimbing(self.factors, tabu=5, max_parents=1, processes=1)
+        BN = HC.fit(self.data)
+        self.assertTrue(all(len(fact.cond) <= 1 for fact in BN.factors))
+        self.assertAlmostEqual(HC.total, max(HC.history))
+        self.assertTrue(len(HC.history) >= 5)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=False)
+##    doctest.testmod(verbose=True)
@@ -4,6 +4,8 @@
     represents discrete variable.
 '''
 
+from itertools import count
+
 class Variable(object):
     '''
     Syntax:
@@ -21,9 +23,18 @@ class Variable(object):
             equality operation
         card
             cardinality of the variable - number of all possible values
+        index
+            dictionary mapping each value to its number among values. None if
+            values are not hashable.
+        ordinal
+            unique number of the variable, given in order of creation. Factor
+            operations keep their variables sorted by it, so the layout of
+            the results is the same across calls and runs.
 
     '''
 
+    _ordinals = count()
+
     def __init__(self, name, a):
         '''
         Syntax:
@@ -39,6 +50,8 @@ class Variable(object):
             [0, 1, 2]
             >>> E.card
             3
+            >>> E.ordinal < Variable("Radio", 2).ordinal
+            True
 
         Arguments:
             name
@@ -52,6 +65,7 @@ class Variable(object):
         self.name = name                # имя переменной
         self.value = []                 # значения переменной
         self.card = 0                   # мощность переменной
+        self.ordinal = next(Variable._ordinals)   # порядковый номер
 
         if  type(a) == int:             # cardinality passed
             self.card = a
@@ -61,6 +75,24 @@ class Variable(object):
             self.value = a
             self.card = len(a)
 
+        self.index = self._build_index()
+
+    def _build_index(self):
+        '''
+        builds value-to-number dictionary for constant time value lookup
+
+        Syntax:
+            >>> E = Variable("Eartquake", ['still', 'shake'])
+            >>> sorted(E._build_index().items())
+            [('shake', 1), ('still', 0)]
+            >>> print Variable("Points", [[0, 0], [0, 1]])._build_index()
+            None
+        '''
+        try:
+            return dict((val, j) for j, val in enumerate(self.value))
+        except TypeError:               # unhashable values
+            return None
+
     def find_value(self, val):
         '''
         Given value finds its number among variable's values.
@@ -82,6 +114,11 @@ class Variable(object):
             val
                 one of the values of this variable
         '''
+        if self.index is not None:
+            try:
+                return self.index.get(val)
+            except TypeError:           # unhashable val
+                pass
         for j in range(len(self.value)):
             if self.value[j] == val:
                 return j
@@ -166,6 +203,7 @@ class BinaryVariable(Variable):
         self.name = name
         self.value = [0, 1]
         self.card = 2
+        self.index = self._build_index()
 
 
 if __name__ == "__main__":